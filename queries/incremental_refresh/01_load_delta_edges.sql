@@ -0,0 +1,52 @@
+-- edges of the new partitions between sampled sender-benef pairs, mapped to the
+-- reindexed node ids, transactions already in edges are dropped
+CREATE OR REPLACE TEMPORARY TABLE delta_edges AS
+
+WITH new_edges AS (
+    SELECT
+        *
+        , CASE
+            WHEN trx_date >= $date_train_start AND trx_date <= $date_train_end THEN 'train'
+            WHEN trx_date >= $date_valid_start AND trx_date <= $date_valid_end THEN 'valid'
+            WHEN trx_date >= $date_test_start  AND trx_date <= $date_test_end  THEN 'test'
+        END AS data_split
+    FROM
+        read_parquet({edges_paths})
+)
+
+, mapped AS (
+    SELECT DISTINCT
+        e.trx_id::INT4 AS trx_id
+        , ns.id AS sender_node_id
+        , nb.id AS benef_node_id
+        , e.* EXCLUDE(trx_id, sender_node_id, benef_node_id)
+    FROM
+        new_edges AS e
+    JOIN
+        nodes AS ns
+    ON
+        e.sender_node_id = ns.raw_id
+    JOIN
+        nodes AS nb
+    ON
+        e.benef_node_id = nb.raw_id
+)
+
+SELECT
+    m.*
+FROM
+    mapped AS m
+SEMI JOIN
+    sender_benef_pairs AS sbp
+USING(
+    sender_node_id
+    , benef_node_id
+)
+ANTI JOIN
+    edges AS e
+USING(trx_id)
+ORDER BY
+    trx_date
+    , trx_id
+
+;
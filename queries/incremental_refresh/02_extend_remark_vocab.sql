@@ -0,0 +1,39 @@
+-- unseen remarks get the next ids, by descending frequency in the delta
+INSERT INTO remark_vocab
+
+WITH new_remarks AS (
+    SELECT
+        d.remark
+        , COUNT(*) AS cnt
+    FROM
+        delta_edges AS d
+    ANTI JOIN
+        remark_vocab AS v
+    USING(remark)
+    WHERE 1 = 1
+        AND d.remark IS NOT NULL
+    GROUP BY
+        d.remark
+)
+
+SELECT
+    (
+        (SELECT COALESCE(MAX(remark_id), 0) FROM remark_vocab)
+        + ROW_NUMBER() OVER(ORDER BY cnt DESC, remark)
+    )::INT4 AS remark_id
+    , remark
+FROM
+    new_remarks
+
+;
+
+ALTER TABLE delta_edges ADD COLUMN remark_id INT4 DEFAULT 0
+
+;
+
+UPDATE delta_edges AS d
+SET remark_id = v.remark_id
+FROM remark_vocab AS v
+WHERE d.remark = v.remark
+
+;
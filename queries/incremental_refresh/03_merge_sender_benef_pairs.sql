@@ -0,0 +1,106 @@
+-- transaction counts are additive, distinct label and day counts are
+-- recomputed from the edges of the touched pairs only
+CREATE OR REPLACE TEMPORARY TABLE delta_pairs AS
+
+SELECT
+    sender_node_id
+    , benef_node_id
+    , COUNT_IF(data_split = 'train')::INT AS count_trx_train
+    , COUNT_IF(data_split = 'valid')::INT AS count_trx_valid
+    , COUNT_IF(data_split = 'test')::INT AS count_trx_test
+    , COUNT(*)::INT AS count_trx_total
+FROM
+    delta_edges
+GROUP BY
+    sender_node_id
+    , benef_node_id
+
+;
+
+CREATE OR REPLACE TEMPORARY TABLE delta_pairs_distinct AS
+
+SELECT
+    e.sender_node_id
+    , e.benef_node_id
+    , COUNT(DISTINCT CASE WHEN e.data_split = 'train' THEN e.purpose END)::INT AS count_labels_train
+    , COUNT(DISTINCT CASE WHEN e.data_split = 'valid' THEN e.purpose END)::INT AS count_labels_valid
+    , COUNT(DISTINCT CASE WHEN e.data_split = 'test' THEN e.purpose END)::INT AS count_labels_test
+    , COUNT(DISTINCT CASE WHEN e.data_split = 'train' THEN e.trx_date END)::INT AS count_days_train
+    , COUNT(DISTINCT CASE WHEN e.data_split = 'valid' THEN e.trx_date END)::INT AS count_days_valid
+    , COUNT(DISTINCT CASE WHEN e.data_split = 'test' THEN e.trx_date END)::INT AS count_days_test
+FROM
+    edges AS e
+SEMI JOIN
+    delta_pairs AS dp
+USING(
+    sender_node_id
+    , benef_node_id
+)
+GROUP BY
+    e.sender_node_id
+    , e.benef_node_id
+
+;
+
+UPDATE sender_benef_pairs AS sbp
+SET
+    count_trx_train = sbp.count_trx_train + d.count_trx_train
+    , count_trx_valid = sbp.count_trx_valid + d.count_trx_valid
+    , count_trx_test = sbp.count_trx_test + d.count_trx_test
+    , count_trx_total = sbp.count_trx_total + d.count_trx_total
+    , count_labels_train = d.count_labels_train
+    , count_labels_valid = d.count_labels_valid
+    , count_labels_test = d.count_labels_test
+    , count_days_train = d.count_days_train
+    , count_days_valid = d.count_days_valid
+    , count_days_test = d.count_days_test
+FROM (
+    SELECT
+        *
+    FROM
+        delta_pairs
+    JOIN
+        delta_pairs_distinct
+    USING(
+        sender_node_id
+        , benef_node_id
+    )
+) AS d
+WHERE 1 = 1
+    AND sbp.sender_node_id = d.sender_node_id
+    AND sbp.benef_node_id = d.benef_node_id
+
+;
+
+UPDATE sender_benef_pairs AS sbp
+SET pair_rank = r.pair_rank
+FROM (
+    SELECT
+        sender_node_id
+        , benef_node_id
+        , ROW_NUMBER() OVER(
+            ORDER BY
+                count_trx_total DESC
+                , count_trx_test DESC
+                , count_trx_valid DESC
+                , count_trx_train DESC
+                , sender_node_id
+                , benef_node_id
+        ) AS pair_rank
+    FROM
+        sender_benef_pairs
+) AS r
+WHERE 1 = 1
+    AND sbp.sender_node_id = r.sender_node_id
+    AND sbp.benef_node_id = r.benef_node_id
+    AND sbp.pair_rank != r.pair_rank
+
+;
+
+CREATE OR REPLACE TEMPORARY TABLE touched_nodes AS
+
+SELECT sender_node_id AS node_id FROM delta_pairs
+UNION
+SELECT benef_node_id AS node_id FROM delta_pairs
+
+;
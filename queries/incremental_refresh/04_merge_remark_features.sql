@@ -0,0 +1,44 @@
+CREATE OR REPLACE TEMPORARY TABLE delta_remark_features AS
+
+WITH delta AS (
+    SELECT
+        remark
+        {purpose_counts}
+    FROM
+        delta_edges
+    WHERE 1 = 1
+        AND data_split = 'train'
+    GROUP BY
+        remark
+)
+
+, count_trx AS (
+    SELECT
+        d.remark
+        {purpose_merged_counts}
+    FROM
+        delta AS d
+    LEFT JOIN
+        remark_features AS ft
+    ON
+        d.remark IS NOT DISTINCT FROM ft.remark
+)
+
+SELECT
+    *
+    {purpose_ratios}
+FROM
+    count_trx
+
+;
+
+DELETE FROM remark_features AS ft
+WHERE EXISTS (
+    SELECT 1 FROM delta_remark_features AS d WHERE d.remark IS NOT DISTINCT FROM ft.remark
+)
+
+;
+
+INSERT INTO remark_features BY NAME SELECT * FROM delta_remark_features
+
+;
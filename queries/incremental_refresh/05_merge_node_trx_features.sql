@@ -0,0 +1,42 @@
+CREATE OR REPLACE TEMPORARY TABLE delta_node_trx_features AS
+
+WITH delta AS (
+    SELECT
+        COALESCE(sender_node_id, benef_node_id) AS node_id
+        {purpose_counts}
+    FROM
+        delta_edges
+    WHERE 1 = 1
+        AND data_split = 'train'
+    GROUP BY
+        GROUPING SETS ((sender_node_id), (benef_node_id))
+)
+
+, count_trx AS (
+    SELECT
+        ft.node_id
+        , ft.is_sender
+        {purpose_merged_counts}
+    FROM
+        delta AS d
+    JOIN
+        node_trx_features AS ft
+    USING(node_id)
+)
+
+SELECT
+    *
+    {purpose_ratios}
+FROM
+    count_trx
+
+;
+
+DELETE FROM node_trx_features
+WHERE node_id IN (SELECT node_id FROM delta_node_trx_features)
+
+;
+
+INSERT INTO node_trx_features BY NAME SELECT * FROM delta_node_trx_features
+
+;
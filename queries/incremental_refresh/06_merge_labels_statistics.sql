@@ -0,0 +1,43 @@
+CREATE OR REPLACE TEMPORARY TABLE merged_labels_statistics AS
+
+WITH delta AS (
+    SELECT
+        purpose
+        , COUNT_IF(data_split = 'train')::INT AS cnt_train
+        , COUNT_IF(data_split = 'valid')::INT AS cnt_valid
+        , COUNT_IF(data_split = 'test')::INT AS cnt_test
+    FROM
+        delta_edges
+    GROUP BY
+        purpose
+)
+
+, count_samples AS (
+    SELECT
+        COALESCE(s.purpose, d.purpose) AS purpose
+        , (IFNULL(s.cnt_train, 0) + IFNULL(d.cnt_train, 0))::INT AS cnt_train
+        , (IFNULL(s.cnt_valid, 0) + IFNULL(d.cnt_valid, 0))::INT AS cnt_valid
+        , (IFNULL(s.cnt_test, 0) + IFNULL(d.cnt_test, 0))::INT AS cnt_test
+    FROM
+        statistics_labels AS s
+    FULL JOIN
+        delta AS d
+    ON
+        s.purpose IS NOT DISTINCT FROM d.purpose
+)
+
+SELECT
+    *
+    , (cnt_train / SUM(cnt_train) OVER())::FLOAT AS pct_train
+    , (cnt_valid / SUM(cnt_valid) OVER())::FLOAT AS pct_valid
+    , (cnt_test / SUM(cnt_test) OVER())::FLOAT AS pct_test
+FROM
+    count_samples
+ORDER BY
+    purpose
+
+;
+
+CREATE OR REPLACE TABLE statistics_labels AS SELECT * FROM merged_labels_statistics
+
+;
@@ -4,14 +4,18 @@ SELECT * FROM '{nodes_path}'
 
 ;
 
-CREATE OR REPLACE TABLE edges AS
-    
+-- a view streams the parquet scan into the next stages instead of copying
+-- every raw edge into the database, each query's projection is pushed into
+-- the scan so the pair ranking only reads the columns it uses. The dates are
+-- validated ISO dates formatted in by `create_nodes_and_edges_table`
+CREATE OR REPLACE {edges_relation} raw_edges AS
+
 SELECT
     *
     , CASE
-        WHEN trx_date >= $date_train_start AND trx_date <= $date_train_end THEN 'train'
-        WHEN trx_date >= $date_valid_start AND trx_date <= $date_valid_end THEN 'valid'
-        WHEN trx_date >= $date_test_start  AND trx_date <= $date_test_end  THEN 'test'
+        WHEN trx_date >= DATE '{date_train_start}' AND trx_date <= DATE '{date_train_end}' THEN 'train'
+        WHEN trx_date >= DATE '{date_valid_start}' AND trx_date <= DATE '{date_valid_end}' THEN 'valid'
+        WHEN trx_date >= DATE '{date_test_start}'  AND trx_date <= DATE '{date_test_end}'  THEN 'test'
     END AS data_split
 FROM
     '{edges_path}'
@@ -0,0 +1,42 @@
+WITH counted AS (
+    SELECT
+        sender_node_id
+        , benef_node_id
+        , COUNT(DISTINCT CASE WHEN data_split = 'train' THEN trx_id END)::INT AS count_trx_train
+        , COUNT(DISTINCT CASE WHEN data_split = 'valid' THEN trx_id END)::INT AS count_trx_valid
+        , COUNT(DISTINCT CASE WHEN data_split = 'test' THEN trx_id END)::INT AS count_trx_test
+        , COUNT(DISTINCT trx_id)::INT AS count_trx_total
+        , COUNT(DISTINCT CASE WHEN data_split = 'train' THEN purpose END)::INT AS count_labels_train
+        , COUNT(DISTINCT CASE WHEN data_split = 'valid' THEN purpose END)::INT AS count_labels_valid
+        , COUNT(DISTINCT CASE WHEN data_split = 'test' THEN purpose END)::INT AS count_labels_test
+        , COUNT(DISTINCT CASE WHEN data_split = 'train' THEN trx_date END)::INT AS count_days_train
+        , COUNT(DISTINCT CASE WHEN data_split = 'valid' THEN trx_date END)::INT AS count_days_valid
+        , COUNT(DISTINCT CASE WHEN data_split = 'test' THEN trx_date END)::INT AS count_days_test
+    FROM
+        raw_edges
+    GROUP BY
+        sender_node_id
+        , benef_node_id
+)
+
+-- with a limit, `top_n_statement` keeps the best `limit_edges` pairs in a
+-- bounded heap, so only the selected pairs are sorted to get their rank
+, selected AS (
+    SELECT
+        *
+    FROM
+        counted
+    WHERE 1 = 1
+        AND count_trx_train > 0
+        AND count_trx_valid > 0
+        AND count_trx_test > 0
+    {top_n_statement}
+)
+
+SELECT
+    *
+    , ROW_NUMBER() OVER(ORDER BY {pair_rank_order}) AS pair_rank
+FROM
+    selected
+ORDER BY
+    pair_rank
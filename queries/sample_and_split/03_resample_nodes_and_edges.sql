@@ -23,7 +23,7 @@ CREATE OR REPLACE TABLE edges AS
 SELECT DISTINCT
     e.*
 FROM
-    edges AS e
+    raw_edges AS e
 JOIN
     sender_benef_pairs AS sbp
 USING(
@@ -41,6 +41,7 @@ ON
 
 CREATE OR REPLACE TABLE nodes AS
 
-SELECT new_id::INT4 AS id, * EXCLUDE(new_id, id) FROM nodes
+-- the raw id is kept to map the edges of later partitions
+SELECT new_id::INT4 AS id, id AS raw_id, * EXCLUDE(new_id, id) FROM nodes
 
 ;
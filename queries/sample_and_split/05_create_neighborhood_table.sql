@@ -1,4 +1,4 @@
-CREATE OR REPLACE TABLE neighborhood AS
+CREATE OR REPLACE TABLE {dest_table} AS
 
 WITH sender_benef AS (
     SELECT
@@ -34,13 +34,22 @@ WITH sender_benef AS (
     SELECT * FROM benef_sender
 )
 
+, selected_pairs AS (
+    SELECT
+        *
+    FROM
+        all_pairs
+    WHERE 1 = 1
+        {src_node_filter}
+)
+
 , count_src AS (
     SELECT
         src_node_id
         , SUM(count_trx_train) AS count_trx_train
         , SUM(count_trx) AS count_trx
     FROM
-        all_pairs
+        selected_pairs
     GROUP BY
         src_node_id
 )
@@ -51,7 +60,7 @@ WITH sender_benef AS (
         , IFNULL(ap.count_trx_train / cs.count_trx_train, 0) AS proportion_train
         , ap.count_trx / cs.count_trx AS proportion
     FROM
-        all_pairs AS ap
+        selected_pairs AS ap
     LEFT JOIN
         count_src AS cs
     USING(src_node_id)
@@ -1,13 +1,17 @@
 import argparse
 import sys
 import warnings
-from torch.utils.data import DataLoader
+from time import perf_counter
 
 sys.path.append("./utils/")
 
 from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling  # type: ignore
 from utils.db import load_db
-from utils.dataset import CustomDataset
+from utils.dataset import CustomDataset, row_loader
+from utils.batch_plan import BatchPlan  # type: ignore
+from utils.prefetch import PrefetchLoader  # type: ignore
+from utils.batch_cache import CACHE_POLICIES  # type: ignore
 
 warnings.filterwarnings("ignore")
 
@@ -17,21 +21,104 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--db_path", type=str, required=True)
     parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--feature_store_dir", type=str, default=None)
+    # serve the first epoch as views of a batch-ordered copy of each split,
+    # written next to the feature store and as large as it
+    parser.add_argument("--batch_layout", action="store_true")
+    # batches fetched ahead of the training loop and the threads fetching them
+    parser.add_argument("--prefetch_depth", type=int, default=4)
+    parser.add_argument("--prefetch_workers", type=int, default=2)
+    # memory budget for the queried batches of each split, its eviction policy
+    # and where evicted batches are spilled
+    parser.add_argument("--batch_cache_mb", type=int, default=256)
+    parser.add_argument(
+        "--batch_cache_policy", type=str, default="lru", choices=CACHE_POLICIES
+    )
+    parser.add_argument("--batch_cache_dir", type=str, default=None)
+    # row-level datasets over the feature store, batched by a DataLoader with
+    # its own worker processes and pinned memory
+    parser.add_argument("--row_loader", action="store_true")
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--pin_memory", action="store_true")
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
     args = parser.parse_args()
+    if args.row_loader and not args.feature_store_dir:
+        parser.error("--row_loader needs --feature_store_dir")
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
 
     conn = load_db(args.db_path)
+    # planned once for the three splits
+    batch_plan = BatchPlan.load(conn, args.batch_size)
 
-    train_ds = CustomDataset(conn, batch_size=args.batch_size, data_split="train")
-    valid_ds = CustomDataset(conn, batch_size=args.batch_size, data_split="valid")
-    test_ds = CustomDataset(conn, batch_size=args.batch_size, data_split="test")
+    if args.row_loader:
+        store_dir = args.feature_store_dir
+        loader = {"num_workers": args.num_workers, "pin_memory": args.pin_memory}
+        train_dl = row_loader(store_dir, "train", batch_plan, shuffle=True, **loader)
+        valid_dl = row_loader(store_dir, "valid", batch_plan, **loader)  # NOQA
+        test_dl = row_loader(store_dir, "test", batch_plan, **loader)  # NOQA
 
-    train_dl = DataLoader(train_ds, batch_size=1, shuffle=True)  # NOQA
-    valid_dl = DataLoader(valid_ds, batch_size=1, shuffle=False)  # NOQA
-    test_dl = DataLoader(test_ds, batch_size=1, shuffle=False)  # NOQA
+        rows = 0
+        start = perf_counter()
+        for features, labels in train_dl:
+            rows += len(labels)
+        runtime = perf_counter() - start
+        print(features.shape, labels.shape)
+        print(
+            f"[INFO] train loader {len(train_dl)} batches"
+            f" - {rows / runtime:,.0f} rows/s"
+        )
+        return
+
+    batch_cache = {
+        "batch_cache_bytes": args.batch_cache_mb * 2**20,
+        "batch_cache_policy": args.batch_cache_policy,
+        "batch_cache_dir": args.batch_cache_dir,
+    }
+
+    train_ds = CustomDataset(
+        conn,
+        batch_size=args.batch_size,
+        data_split="train",
+        feature_store_dir=args.feature_store_dir,
+        batch_plan=batch_plan,
+        batch_layout=args.batch_layout,
+        **batch_cache,
+    )
+    valid_ds = CustomDataset(
+        conn,
+        batch_size=args.batch_size,
+        data_split="valid",
+        feature_store_dir=args.feature_store_dir,
+        batch_plan=batch_plan,
+        batch_layout=args.batch_layout,
+        **batch_cache,
+    )
+    test_ds = CustomDataset(
+        conn,
+        batch_size=args.batch_size,
+        data_split="test",
+        feature_store_dir=args.feature_store_dir,
+        batch_plan=batch_plan,
+        batch_layout=args.batch_layout,
+        **batch_cache,
+    )
+
+    prefetch = {"depth": args.prefetch_depth, "workers": args.prefetch_workers}
+    train_dl = PrefetchLoader(train_ds, shuffle=True, **prefetch)
+    valid_dl = PrefetchLoader(valid_ds, **prefetch)  # NOQA
+    test_dl = PrefetchLoader(test_ds, **prefetch)  # NOQA
 
     features, labels = train_ds[0]
     print(features.shape, labels.shape)
 
+    for features, labels in train_dl:
+        pass
+    print(f"[INFO] train loader {train_dl.stats()}")
+    print(f"[INFO] train batch cache {train_ds.batch_cache_stats()}")
+
 
 if __name__ == "__main__":
     main()
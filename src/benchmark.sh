@@ -0,0 +1,55 @@
+python ./src/benchmark_amount_encoding.py \
+    > ./logs/benchmarks/amount_encoding_202405_202408_06_full.txt \
+    --db_path ./datasets/processed/202405_202408_06_full/database.duckdb \
+    --repeats 5
+
+echo "Benchmark amount encoding done"
+
+python ./src/benchmark_embedding_workers.py \
+    > ./logs/benchmarks/embedding_workers_202405_202408_06_full.txt \
+    --db_path ./datasets/processed/202405_202408_06_full/database.duckdb \
+    --num_strings 20000
+
+echo "Benchmark embedding workers done"
+
+python ./src/benchmark_embedding_storage.py \
+    > ./logs/benchmarks/embedding_storage_202405_202408_03_s.txt \
+    --db_path ./datasets/processed/202405_202408_03_s/database.duckdb \
+    --pca_dim 128 \
+    --epochs 5
+
+echo "Benchmark embedding storage done"
+
+python ./src/benchmark_pair_selection.py \
+    > ./logs/benchmarks/pair_selection_202405_202408.txt \
+    --nodes_path ./datasets/processed/202405_202408/nodes.parquet \
+    --edges_path ./datasets/processed/202405_202408/edges.parquet \
+    --date_train_start 2024-05-01 \
+    --date_train_end 2024-05-31 \
+    --date_valid_start 2024-06-01 \
+    --date_valid_end 2024-06-30 \
+    --date_test_start 2024-07-01 \
+    --date_test_end 2024-07-31 \
+    --sizes 100 1000 10000 50000 100000 0 \
+    --repeats 3
+
+echo "Benchmark pair selection done"
+
+python ./src/benchmark_suite.py \
+    > ./logs/benchmarks/suite.txt \
+    --work_dir ./datasets/benchmark \
+    --num_edges 1000000 \
+    --tiers 01_xxs 02_xs 03_s 04_m 05_l 06_full \
+    --output ./logs/benchmarks/suite.json \
+    --profile_path ./logs/benchmarks/suite.jsonl
+
+echo "Benchmark suite done"
+
+python ./src/benchmark_text_encoders.py \
+    > ./logs/benchmarks/text_encoders_202405_202408_03_s.txt \
+    --db_path ./datasets/processed/202405_202408_03_s/database.duckdb \
+    --encoders indobert hashing_tf \
+    --num_strings 20000 \
+    --epochs 5
+
+echo "Benchmark text encoders done"
@@ -0,0 +1,90 @@
+import argparse
+import duckdb
+import sys
+from time import perf_counter
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.features import AMOUNT_BANDS, amount_encoding_sql  # type: ignore
+
+
+def udf_expressions(column: str) -> list[str]:
+    return [
+        f"amount_encoding({column}, {min_val}, {max_val})"
+        for min_val, max_val in AMOUNT_BANDS
+    ]
+
+
+def sql_expressions(column: str) -> list[str]:
+    return [
+        amount_encoding_sql(column, min_val, max_val)
+        for min_val, max_val in AMOUNT_BANDS
+    ]
+
+
+@timeit
+def check_bit_identical(conn: duckdb.DuckDBPyConnection) -> None:
+    conditions = " OR ".join(
+        f"({udf}) IS DISTINCT FROM ({sql})"
+        for udf, sql in zip(udf_expressions("amount"), sql_expressions("amount"))
+    )
+    count_mismatch = conn.execute(
+        f"SELECT COUNT(*) FROM edges WHERE {conditions}"
+    ).fetchone()[0]
+
+    if count_mismatch:
+        raise AssertionError(f"{count_mismatch} rows differ between UDF and SQL")
+
+    print("[BENCH] UDF and SQL amount encodings are bit-identical")
+
+
+@timeit
+def benchmark_encoding(
+    conn: duckdb.DuckDBPyConnection, name: str, expressions: list[str], repeats: int
+) -> float:
+    num_rows = conn.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+    select_list = "\n, ".join(
+        f"{expr} AS band_{i}" for i, expr in enumerate(expressions)
+    )
+
+    runtimes = []
+    for _ in range(repeats):
+        start = perf_counter()
+        conn.execute(
+            f"""
+            CREATE OR REPLACE TEMPORARY TABLE benchmark_amount_encoding AS
+            SELECT {select_list} FROM edges
+            """
+        )
+        runtimes.append(perf_counter() - start)
+
+    conn.execute("DROP TABLE benchmark_amount_encoding")
+
+    rows_per_sec = num_rows / min(runtimes)
+    print(f"[BENCH] {name}: {num_rows} rows - {rows_per_sec:,.0f} rows/s")
+    return rows_per_sec
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_path", type=str, required=True)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = load_db(args.db_path)
+
+    check_bit_identical(conn)
+    udf_rows_per_sec = benchmark_encoding(
+        conn, "python_udf", udf_expressions("amount"), args.repeats
+    )
+    sql_rows_per_sec = benchmark_encoding(
+        conn, "native_sql", sql_expressions("amount"), args.repeats
+    )
+    print(f"[BENCH] speedup: {sql_rows_per_sec / udf_rows_per_sec:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.benchmark import train_and_evaluate  # type: ignore
+from utils.encoders import TEXT_ENCODERS, load_text_encoder  # type: ignore
+from utils.features import EMBEDDING_TABLES  # type: ignore
+from utils.embedding_storage import (  # type: ignore
+    EmbeddingStorage,
+    compress_embedding_tables,
+    load_embedding_lookups,
+    storage_row_bytes,
+)
+
+warnings.filterwarnings("ignore")
+
+
+@timeit
+def benchmark_setting(
+    db_path: str,
+    tmp_dir: str,
+    dtype: str,
+    pca_dim: int | None,
+    text_encoder,
+    batch_size: int,
+    epochs: int,
+) -> dict:
+    # every setting works on its own copy of the database
+    name = f"{dtype}_pca{pca_dim}" if pca_dim else dtype
+    setting_db_path = os.path.join(tmp_dir, f"{name}.duckdb")
+    shutil.copyfile(db_path, setting_db_path)
+
+    conn = load_db(setting_db_path)
+    if dtype != "float32" or pca_dim:
+        compress_embedding_tables(conn, dtype, pca_dim=pca_dim)
+
+    lookups = load_embedding_lookups(conn, with_vocab=True)
+    bytes_per_trx = storage_row_bytes(dtype, lookups["remark"].dim) + (
+        2 * storage_row_bytes(dtype, lookups["node_name"].dim)
+    )
+    metrics = train_and_evaluate(
+        conn,
+        text_encoder,
+        batch_size=batch_size,
+        epochs=epochs,
+        embedding_lookups=lookups,
+    )
+    conn.close()
+    os.remove(setting_db_path)
+
+    result = {"setting": name, "bytes_per_batch": bytes_per_trx * batch_size, **metrics}
+    print(
+        f"[BENCH] {name}: {result['bytes_per_batch']:,} embedding bytes/batch"
+        f" - val_f1: {result['val_f1']:.4f}"
+    )
+    return result
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_path", type=str, required=True)
+    parser.add_argument("--pca_dim", type=int, default=128)
+    parser.add_argument(
+        "--text_encoder", type=str, default="indobert", choices=TEXT_ENCODERS
+    )
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--epochs", type=int, default=5)
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
+    args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
+
+    # every setting is compressed from the float32 embeddings, a database
+    # built with another --embedding_dtype or --embedding_pca_dim has none
+    conn = load_db(args.db_path)
+    compressed = [
+        table_name
+        for table_name in EMBEDDING_TABLES.values()
+        if EmbeddingStorage.load(conn, table_name).is_compressed
+    ]
+    conn.close()
+    if compressed:
+        parser.error(
+            f"{', '.join(compressed)} of {args.db_path} are already compressed,"
+            " rebuild the embeddings as float32 to benchmark their storage"
+        )
+
+    text_encoder = load_text_encoder(args.text_encoder)
+
+    settings = [
+        ("float32", None),
+        ("float16", None),
+        ("int8", None),
+        ("float32", args.pca_dim),
+        ("float16", args.pca_dim),
+        ("int8", args.pca_dim),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            benchmark_setting(
+                args.db_path,
+                tmp_dir,
+                dtype,
+                pca_dim,
+                text_encoder,
+                args.batch_size,
+                args.epochs,
+            )
+            for dtype, pca_dim in settings
+        ]
+
+    reference = results[0]
+    for result in results:
+        print(
+            f"[BENCH] {result['setting']}:"
+            f" {result['bytes_per_batch'] / reference['bytes_per_batch']:.2f}x bytes"
+            f" - {result['val_f1'] - reference['val_f1']:+.4f} val_f1"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import warnings
+import numpy as np
+from time import perf_counter
+from transformers import BertTokenizer, AutoModel
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.embeddings import (  # type: ignore
+    create_embedding_pool,
+    iter_embeddings,
+    token_budget_batches,
+    tokenize,
+)
+
+warnings.filterwarnings("ignore")
+
+INDOBERT_MODEL = "indobert-lite-base-p2"
+
+
+@timeit
+def benchmark_workers(
+    shards: list[list[dict]], tokenizer, text_encoder, workers: int
+) -> float:
+    num_strings = sum(len(features) for features in shards)
+
+    # start the workers and load the model before timing
+    pool = None
+    if workers > 1:
+        pool = create_embedding_pool(f"indobenchmark/{INDOBERT_MODEL}", workers)
+        for _ in iter_embeddings(shards[:workers], None, None, pool=pool):
+            pass
+
+    start = perf_counter()
+    for _ in iter_embeddings(shards, tokenizer, text_encoder, pool=pool):
+        pass
+    runtime = perf_counter() - start
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    strings_per_sec = num_strings / runtime
+    print(f"[BENCH] workers={workers}: {strings_per_sec:.1f} strings/s")
+    return strings_per_sec
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_path", type=str, required=True)
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--num_strings", type=int, default=20000)
+    parser.add_argument("--token_budget", type=int, default=8192)
+    args = parser.parse_args()
+
+    tokenizer = BertTokenizer.from_pretrained(f"indobenchmark/{INDOBERT_MODEL}")
+    indobert = AutoModel.from_pretrained(f"indobenchmark/{INDOBERT_MODEL}")
+
+    conn = load_db(args.db_path)
+    word_list = [
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT remark FROM edges WHERE remark IS NOT NULL LIMIT $limit",
+            {"limit": args.num_strings},
+        ).fetchall()
+    ]
+    conn.close()
+
+    features = tokenize(tokenizer, word_list)
+    lengths = np.array([len(f["input_ids"]) for f in features])
+    batches = token_budget_batches(lengths, args.token_budget, 1000)
+    shards = [[features[i] for i in indices] for indices in batches]
+
+    workers_list = [1]
+    while workers_list[-1] * 2 <= args.max_workers:
+        workers_list.append(workers_list[-1] * 2)
+    if workers_list[-1] != args.max_workers:
+        workers_list.append(args.max_workers)
+
+    baseline = None
+    for workers in workers_list:
+        strings_per_sec = benchmark_workers(shards, tokenizer, indobert, workers)
+        baseline = baseline or strings_per_sec
+        print(f"[BENCH] workers={workers}: {strings_per_sec / baseline:.2f}x speedup")
+
+
+if __name__ == "__main__":
+    main()
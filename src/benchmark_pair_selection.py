@@ -0,0 +1,88 @@
+import argparse
+import duckdb
+import sys
+from time import perf_counter
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from sample_and_split import (  # type: ignore
+    configure_memory,
+    create_nodes_and_edges_table,
+    rank_pairs_query,
+)
+
+SIZES = [100, 1000, 10000, 50000, 100000, 0]
+
+
+def window_rank_query(limit_edges: int | None) -> str:
+    # previous selection, every pair is ranked before the limit is applied
+    query = rank_pairs_query()
+    return f"{query}\nLIMIT {limit_edges}" if limit_edges else query
+
+
+@timeit
+def benchmark_selection(
+    conn: duckdb.DuckDBPyConnection, name: str, query: str, repeats: int
+) -> tuple[float, list]:
+    runtimes = []
+    for _ in range(repeats):
+        start = perf_counter()
+        rows = conn.execute(query).fetchall()
+        runtimes.append(perf_counter() - start)
+
+    runtime = min(runtimes)
+    print(f"[BENCH] {name}: {runtime:.3f}s (best of {repeats}), {len(rows)} pairs")
+    return runtime, rows
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes_path", type=str, required=True)
+    parser.add_argument("--edges_path", type=str, required=True)
+    parser.add_argument("--date_train_start", type=str, default="2024-05-01")
+    parser.add_argument("--date_train_end", type=str, default="2024-05-31")
+    parser.add_argument("--date_valid_start", type=str, default="2024-06-01")
+    parser.add_argument("--date_valid_end", type=str, default="2024-06-30")
+    parser.add_argument("--date_test_start", type=str, default="2024-07-01")
+    parser.add_argument("--date_test_end", type=str, default="2024-07-31")
+    # a size of 0 selects every pair
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--memory_limit", type=str, default=None)
+    parser.add_argument("--temp_directory", type=str, default=None)
+    args = parser.parse_args()
+
+    date_params = {
+        "date_train_start": args.date_train_start,
+        "date_train_end": args.date_train_end,
+        "date_valid_start": args.date_valid_start,
+        "date_valid_end": args.date_valid_end,
+        "date_test_start": args.date_test_start,
+        "date_test_end": args.date_test_end,
+    }
+
+    # raw edges are loaded once, both selections pay the same aggregation
+    conn = duckdb.connect()
+    configure_memory(
+        conn, memory_limit=args.memory_limit, temp_directory=args.temp_directory
+    )
+    create_nodes_and_edges_table(conn, args.nodes_path, args.edges_path, date_params)
+
+    for size in args.sizes:
+        window_runtime, window_rows = benchmark_selection(
+            conn, f"window rank size={size}", window_rank_query(size), args.repeats
+        )
+        top_n_runtime, top_n_rows = benchmark_selection(
+            conn, f"top-n size={size}", rank_pairs_query(size), args.repeats
+        )
+
+        if window_rows != top_n_rows:
+            raise AssertionError(f"Selections differ for size={size}")
+
+        print(f"[BENCH] size={size}: {window_runtime / top_n_runtime:.2f}x speedup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import warnings
+import duckdb
+import torch
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling, peak_rss_mb  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.synthetic import generate_dataset  # type: ignore
+from utils.benchmark import compare_to_baseline  # type: ignore
+from utils.dataset import LABELS, CustomDataset  # type: ignore
+from utils.model import FCN  # type: ignore
+from utils.trainer import Trainer  # type: ignore
+from utils.prefetch import PrefetchLoader  # type: ignore
+from utils.encoders import TEXT_ENCODERS, load_text_encoder  # type: ignore
+from sample_and_split import build_database, rank_sender_benef_pairs  # type: ignore
+from features_remark_and_nodes import build_feature_pipeline  # type: ignore
+
+warnings.filterwarnings("ignore")
+
+# same sizes as the processed datasets, a limit of 0 keeps every pair
+TIERS = {
+    "01_xxs": 100,
+    "02_xs": 1000,
+    "03_s": 10000,
+    "04_m": 50000,
+    "05_l": 100000,
+    "06_full": 0,
+}
+
+
+@timeit
+def benchmark_sample_and_split(
+    db_path: str,
+    nodes_path: str,
+    edges_path: str,
+    date_params: dict,
+    pairs_path: str,
+    limit_edges: int,
+) -> dict:
+    start = perf_counter()
+    build_database(
+        db_path,
+        nodes_path,
+        edges_path,
+        date_params,
+        pairs_path,
+        limit_edges=limit_edges or None,
+        streaming=True,
+    )
+    runtime = perf_counter() - start
+
+    conn = duckdb.connect(db_path, read_only=True)
+    num_edges = conn.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+    conn.close()
+    return {"edges": num_edges, "sample_and_split_s": runtime}
+
+
+@timeit
+def benchmark_feature_engineering(
+    conn: duckdb.DuckDBPyConnection,
+    text_encoder,
+    limit_embeddings: int,
+    neighbor_hops: int,
+) -> dict:
+    pipeline = build_feature_pipeline(
+        conn,
+        text_encoder,
+        limit_remark_embeddings=limit_embeddings,
+        limit_node_name_embeddings=limit_embeddings,
+        neighbor_hops=neighbor_hops,
+        force=True,
+    )
+    start = perf_counter()
+    pipeline.run()
+    return {"feature_engineering_s": perf_counter() - start}
+
+
+@timeit
+def benchmark_batch_fetch(
+    conn: duckdb.DuckDBPyConnection,
+    text_encoder,
+    batch_size: int,
+    num_batches: int,
+    neighbor_hops: int,
+) -> tuple[dict, list]:
+    # batches are fetched once, so every fetch misses the dataset caches
+    start = perf_counter()
+    dataset = CustomDataset(
+        conn,
+        batch_size,
+        "train",
+        text_encoder,
+        online_encoding=False,
+        neighbor_hops=neighbor_hops,
+    )
+    init_runtime = perf_counter() - start
+
+    start = perf_counter()
+    batches = [dataset[idx] for idx in range(min(num_batches, len(dataset)))]
+    runtime = perf_counter() - start
+
+    rows = sum(len(labels) for _, labels in batches)
+    return {
+        "dataset_init_s": init_runtime,
+        "fetched_batches": len(batches),
+        "fetch_batches_per_s": len(batches) / runtime if batches else None,
+        "fetch_rows_per_s": rows / runtime if batches else None,
+    }, batches
+
+
+def build_trainer(input_shape: int, n_hiddens: list[int]) -> Trainer:
+    torch.manual_seed(42)
+    model = FCN(LABELS, input_shape=input_shape, n_hiddens=n_hiddens)
+    model.train()
+    return Trainer(
+        model,
+        torch.optim.Adam(model.parameters(), lr=1e-3),
+        torch.nn.CrossEntropyLoss(),
+        device="cpu",
+    )
+
+
+@timeit
+def benchmark_train_steps(batches: list, num_steps: int, n_hiddens: list[int]) -> dict:
+    # steps cycle over the fetched batches, so only the model is timed
+    if not batches:
+        return {"train_steps_per_s": None, "train_rows_per_s": None}
+
+    trainer = build_trainer(batches[0][0].shape[-1], n_hiddens)
+    trainer.train_step(*batches[0])
+
+    rows = 0
+    start = perf_counter()
+    for step in range(num_steps):
+        features, labels = batches[step % len(batches)]
+        trainer.train_step(features, labels)
+        rows += len(labels)
+    runtime = perf_counter() - start
+
+    return {
+        "train_steps_per_s": num_steps / runtime,
+        "train_rows_per_s": rows / runtime,
+    }
+
+
+@timeit
+def benchmark_prefetch_training(
+    conn: duckdb.DuckDBPyConnection,
+    text_encoder,
+    batch_size: int,
+    num_batches: int,
+    neighbor_hops: int,
+    n_hiddens: list[int],
+    depth: int,
+    workers: int,
+) -> dict:
+    # training steps fed with uncached batches through the prefetch loader,
+    # the consumer wait is the part of the fetches not hidden by the steps
+    dataset = CustomDataset(
+        conn,
+        batch_size,
+        "train",
+        text_encoder,
+        online_encoding=False,
+        neighbor_hops=neighbor_hops,
+    )
+    if not len(dataset):
+        return {"prefetch_train_steps_per_s": None, "prefetch_consumer_wait_s": None}
+
+    trainer = build_trainer(dataset[0][0].shape[-1], n_hiddens)
+    loader = PrefetchLoader(dataset, depth=depth, workers=workers)
+
+    steps = 0
+    start = perf_counter()
+    for features, labels in islice(loader, num_batches):
+        trainer.train_step(features, labels)
+        steps += 1
+    runtime = perf_counter() - start
+
+    stats = loader.stats()
+    return {
+        "prefetch_train_steps_per_s": steps / runtime,
+        "prefetch_consumer_wait_s": stats["consumer_wait_s"],
+        "prefetch_mean_queue_depth": stats["mean_queue_depth"],
+    }
+
+
+def print_comparison(rows: list[dict], tolerance: float) -> None:
+    for row in rows:
+        status = "REGRESSION" if row["regression"] else "ok"
+        print(
+            f"[BENCH] {row['tier']} {row['metric']}:"
+            f" {row['baseline']:.4g} -> {row['current']:.4g}"
+            f" ({row['change']:+.1%}) {status}"
+        )
+    regressions = sum(row["regression"] for row in rows)
+    print(
+        f"[BENCH] {regressions} of {len(rows)} metrics regressed"
+        f" by more than {tolerance:.0%}"
+    )
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--work_dir", type=str, default="./datasets/benchmark")
+    parser.add_argument(
+        "--tiers", type=str, nargs="+", default=list(TIERS), choices=list(TIERS)
+    )
+    # synthetic raw data, reused across runs with the same size and seed
+    parser.add_argument("--num_edges", type=int, default=1_000_000)
+    parser.add_argument("--num_senders", type=int, default=20_000)
+    parser.add_argument("--num_benefs", type=int, default=30_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--date_train_start", type=str, default="2024-05-01")
+    parser.add_argument("--date_train_end", type=str, default="2024-05-31")
+    parser.add_argument("--date_valid_start", type=str, default="2024-06-01")
+    parser.add_argument("--date_valid_end", type=str, default="2024-06-30")
+    parser.add_argument("--date_test_start", type=str, default="2024-07-01")
+    parser.add_argument("--date_test_end", type=str, default="2024-07-31")
+    parser.add_argument(
+        "--text_encoder", type=str, default="indobert", choices=TEXT_ENCODERS
+    )
+    parser.add_argument("--limit_embeddings", type=int, default=5000)
+    parser.add_argument("--neighbor_hops", type=int, default=3, choices=[0, 1, 2, 3])
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--num_batches", type=int, default=50)
+    parser.add_argument("--train_steps", type=int, default=200)
+    parser.add_argument("--n_hiddens", type=int, nargs="+", default=[256, 64])
+    parser.add_argument("--prefetch_depth", type=int, default=4)
+    parser.add_argument("--prefetch_workers", type=int, default=2)
+    # results are written as JSON, a previous output can be given as baseline
+    parser.add_argument("--output", type=str, default="./logs/benchmarks/suite.json")
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--fail_on_regression", action="store_true")
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
+    args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
+
+    date_params = {
+        "date_train_start": args.date_train_start,
+        "date_train_end": args.date_train_end,
+        "date_valid_start": args.date_valid_start,
+        "date_valid_end": args.date_valid_end,
+        "date_test_start": args.date_test_start,
+        "date_test_end": args.date_test_end,
+    }
+
+    raw_dir = os.path.join(
+        args.work_dir,
+        f"raw_{args.num_edges}_{args.num_senders}_{args.num_benefs}_{args.seed}",
+    )
+    nodes_path = os.path.join(raw_dir, "nodes.parquet")
+    edges_path = os.path.join(raw_dir, "edges.parquet")
+    if not os.path.exists(edges_path):
+        generate_dataset(
+            raw_dir,
+            num_edges=args.num_edges,
+            num_senders=args.num_senders,
+            num_benefs=args.num_benefs,
+            date_start=args.date_train_start,
+            date_end=args.date_test_end,
+            seed=args.seed,
+        )
+
+    start = perf_counter()
+    pairs_path = rank_sender_benef_pairs(
+        nodes_path, edges_path, date_params, os.path.join(raw_dir, "sender_benef_pairs")
+    )
+    rank_pairs_runtime = perf_counter() - start
+
+    text_encoder = load_text_encoder(args.text_encoder)
+
+    results = {}
+    for tier in args.tiers:
+        db_path = os.path.join(args.work_dir, tier, "database.duckdb")
+        metrics = benchmark_sample_and_split(
+            db_path, nodes_path, edges_path, date_params, pairs_path, TIERS[tier]
+        )
+
+        conn = load_db(db_path)
+        metrics.update(
+            benchmark_feature_engineering(
+                conn, text_encoder, args.limit_embeddings, args.neighbor_hops
+            )
+        )
+        fetch_metrics, batches = benchmark_batch_fetch(
+            conn,
+            text_encoder,
+            args.batch_size,
+            args.num_batches,
+            args.neighbor_hops,
+        )
+        metrics.update(fetch_metrics)
+        metrics.update(benchmark_train_steps(batches, args.train_steps, args.n_hiddens))
+        metrics.update(
+            benchmark_prefetch_training(
+                conn,
+                text_encoder,
+                args.batch_size,
+                args.num_batches,
+                args.neighbor_hops,
+                args.n_hiddens,
+                args.prefetch_depth,
+                args.prefetch_workers,
+            )
+        )
+        conn.close()
+
+        metrics["peak_rss_mb"] = peak_rss_mb()
+        results[tier] = metrics
+        print(f"[BENCH] {tier}: {json.dumps(metrics)}")
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "duckdb": duckdb.__version__,
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "rank_pairs_s": rank_pairs_runtime,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+        rows = compare_to_baseline(results, baseline, args.tolerance)
+        print_comparison(rows, args.tolerance)
+        if args.fail_on_regression and any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
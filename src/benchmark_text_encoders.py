@@ -0,0 +1,116 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+from time import perf_counter
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.benchmark import train_and_evaluate  # type: ignore
+from utils.encoders import TEXT_ENCODERS, load_text_encoder  # type: ignore
+from features_remark_and_nodes import (  # type: ignore
+    create_node_name_embeddings,
+    create_remark_embeddings,
+)
+
+warnings.filterwarnings("ignore")
+
+
+@timeit
+def benchmark_encoder(
+    db_path: str,
+    tmp_dir: str,
+    name: str,
+    word_list: list[str],
+    limit_embeddings: int | None,
+    batch_size: int,
+    epochs: int,
+) -> dict:
+    text_encoder = load_text_encoder(name)
+
+    # throughput over the most frequent remarks, model loading excluded
+    start = perf_counter()
+    for _ in text_encoder.iter_batches(word_list):
+        pass
+    strings_per_sec = len(word_list) / (perf_counter() - start)
+
+    # every encoder re-embeds its own copy of the database
+    encoder_db_path = os.path.join(tmp_dir, f"{name}.duckdb")
+    shutil.copyfile(db_path, encoder_db_path)
+
+    conn = load_db(encoder_db_path)
+    create_remark_embeddings(conn, text_encoder, limit=limit_embeddings)
+    create_node_name_embeddings(conn, text_encoder, limit=limit_embeddings)
+    metrics = train_and_evaluate(
+        conn, text_encoder, batch_size=batch_size, epochs=epochs
+    )
+    conn.close()
+    os.remove(encoder_db_path)
+
+    result = {"encoder": name, "strings_per_sec": strings_per_sec, **metrics}
+    print(
+        f"[BENCH] {name}: {strings_per_sec:,.1f} strings/s"
+        f" - val_f1: {result['val_f1']:.4f}"
+    )
+    return result
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_path", type=str, required=True)
+    parser.add_argument(
+        "--encoders", type=str, nargs="+", default=TEXT_ENCODERS, choices=TEXT_ENCODERS
+    )
+    parser.add_argument("--num_strings", type=int, default=20000)
+    parser.add_argument("--limit_embeddings", type=int, default=None)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--epochs", type=int, default=5)
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
+    args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
+
+    conn = load_db(args.db_path)
+    word_list = [
+        row[0]
+        for row in conn.execute(
+            "SELECT remark FROM remark_vocab ORDER BY remark_id LIMIT $limit",
+            {"limit": args.num_strings},
+        ).fetchall()
+    ]
+    conn.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            benchmark_encoder(
+                args.db_path,
+                tmp_dir,
+                name,
+                word_list,
+                args.limit_embeddings,
+                args.batch_size,
+                args.epochs,
+            )
+            for name in args.encoders
+        ]
+
+    reference = results[0]
+    for result in results:
+        print(
+            f"[BENCH] {result['encoder']}:"
+            f" {result['strings_per_sec'] / reference['strings_per_sec']:.2f}x"
+            " strings/s"
+            f" - {result['val_f1'] - reference['val_f1']:+.4f} val_f1"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,36 +9,42 @@ echo "Feature engineering dates done"
 
 python ./src/features_remark_and_nodes.py \
     > ./logs/feature_engineering/202405_202408_01_xxs.txt \
+    --profile_path ./logs/feature_engineering/202405_202408_01_xxs.jsonl \
     --db_path ./datasets/processed/202405_202408_01_xxs/database.duckdb \
 
 echo "Feature engineering 202405_202408_01_xxs done"
 
 python ./src/features_remark_and_nodes.py \
     > ./logs/feature_engineering/202405_202408_02_xs.txt \
+    --profile_path ./logs/feature_engineering/202405_202408_02_xs.jsonl \
     --db_path ./datasets/processed/202405_202408_02_xs/database.duckdb \
 
 echo "Feature engineering 202405_202408_02_xs done"
 
 python ./src/features_remark_and_nodes.py \
     > ./logs/feature_engineering/202405_202408_03_s.txt \
+    --profile_path ./logs/feature_engineering/202405_202408_03_s.jsonl \
     --db_path ./datasets/processed/202405_202408_03_s/database.duckdb \
 
 echo "Feature engineering 202405_202408_03_s done"
 
 python ./src/features_remark_and_nodes.py \
     > ./logs/feature_engineering/202405_202408_04_m.txt \
+    --profile_path ./logs/feature_engineering/202405_202408_04_m.jsonl \
     --db_path ./datasets/processed/202405_202408_04_m/database.duckdb \
 
 echo "Feature engineering 202405_202408_04_m done"
 
 python ./src/features_remark_and_nodes.py \
     > ./logs/feature_engineering/202405_202408_05_l.txt \
+    --profile_path ./logs/feature_engineering/202405_202408_05_l.jsonl \
     --db_path ./datasets/processed/202405_202408_05_l/database.duckdb \
 
 echo "Feature engineering 202405_202408_05_l done"
 
 python ./src/features_remark_and_nodes.py \
     > ./logs/feature_engineering/202405_202408_06_full.txt \
+    --profile_path ./logs/feature_engineering/202405_202408_06_full.jsonl \
     --db_path ./datasets/processed/202405_202408_06_full/database.duckdb \
 
 echo "Feature engineering 202405_202408_06_full done"
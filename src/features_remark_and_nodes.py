@@ -2,18 +2,95 @@ import argparse
 import duckdb
 import sys
 import warnings
-import torch
-import pandas as pd
-from transformers import BertTokenizer, AutoModel
+import numpy as np
+from time import perf_counter
 
 sys.path.append("./utils/")
 
 from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling, record_table_rows  # type: ignore
 from utils.db import load_db  # type: ignore
+from utils.encoders import TEXT_ENCODERS, load_text_encoder  # type: ignore
+from utils.embedding_storage import (  # type: ignore
+    EMBEDDING_DTYPES,
+    EmbeddingStorage,
+    compress_embedding_tables,
+    reset_embedding_storage,
+)
+from utils.graph import create_neighbor_features_table  # type: ignore
+from utils.pipeline import Pipeline, Stage  # type: ignore
+from utils.features import (  # type: ignore
+    LABELS,
+    UNKNOWN_ID,
+    VOCAB_TABLES,
+    purpose_features_sql,
+)
 
 warnings.filterwarnings("ignore")
 
-INDOBERT_MODEL = "indobert-lite-base-p2"
+
+@timeit
+def create_text_ids(
+    conn: duckdb.DuckDBPyConnection, entity: str, source_table: str
+) -> None:
+    # dense ids stored as `<entity>_id` on `source_table` so embeddings are
+    # looked up by integer index instead of by text. Ids are stable: existing
+    # texts keep theirs and unseen texts get the next ids by descending
+    # frequency, like the incremental refresh, so stored and cached
+    # embeddings stay valid across reruns
+    vocab_table = VOCAB_TABLES[entity]
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {vocab_table} (
+            {entity}_id INT4
+            , {entity} VARCHAR
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO {vocab_table}
+
+        WITH new_texts AS (
+            SELECT
+                s.{entity}
+                , COUNT(*) AS cnt
+            FROM
+                {source_table} AS s
+            ANTI JOIN
+                {vocab_table} AS v
+            USING({entity})
+            WHERE 1 = 1
+                AND s.{entity} IS NOT NULL
+            GROUP BY
+                s.{entity}
+        )
+
+        SELECT
+            (
+                (SELECT COALESCE(MAX({entity}_id), 0) FROM {vocab_table})
+                + ROW_NUMBER() OVER(ORDER BY cnt DESC, {entity})
+            )::INT4 AS {entity}_id
+            , {entity}
+        FROM
+            new_texts
+        """
+    )
+
+    conn.execute(
+        f"""
+        ALTER TABLE {source_table}
+        ADD COLUMN IF NOT EXISTS {entity}_id INT4 DEFAULT {UNKNOWN_ID}
+        """
+    )
+    conn.execute(
+        f"""
+        UPDATE {source_table} AS s
+        SET {entity}_id = v.{entity}_id
+        FROM {vocab_table} AS v
+        WHERE s.{entity} = v.{entity}
+        """
+    )
 
 
 @timeit
@@ -21,7 +98,7 @@ def create_remark_features(
     conn: duckdb.DuckDBPyConnection, dest_table: str | None = "remark_features"
 ) -> None:
     with open("./queries/feature_engineering/01_remark_features.sql") as f:
-        query = f.read()
+        query = f.read().format(**purpose_features_sql(LABELS))
 
     if dest_table:
         query = f"CREATE OR REPLACE TABLE {dest_table} AS\n{query}"
@@ -34,7 +111,7 @@ def create_node_trx_features(
     conn: duckdb.DuckDBPyConnection, dest_table: str | None = "node_trx_features"
 ) -> None:
     with open("./queries/feature_engineering/02_node_trx_features.sql") as f:
-        query = f.read()
+        query = f.read().format(**purpose_features_sql(LABELS))
 
     if dest_table:
         query = f"CREATE OR REPLACE TABLE {dest_table} AS\n{query}"
@@ -42,6 +119,19 @@ def create_node_trx_features(
     conn.execute(query)
 
 
+@timeit
+def create_node_neighbor_features(
+    conn: duckdb.DuckDBPyConnection,
+    hops: int = 3,
+    dest_table: str | None = "node_neighbor_features",
+) -> None:
+    if not hops:
+        return
+
+    create_neighbor_features_table(conn, hops=hops, dest_table=dest_table)
+    record_table_rows(conn, [dest_table])
+
+
 @timeit
 def create_days_features(
     conn: duckdb.DuckDBPyConnection, dest_table: str | None = "days_features"
@@ -57,71 +147,87 @@ def create_days_features(
 
 def generate_embeddings(
     conn: duckdb.DuckDBPyConnection,
+    ids: list[int],
     word_list: list[str],
     entity: str,
-    tokenizer,
     text_encoder,
-    batch_size=1000,
     table_name="embeddings",
+    flush_rows=50000,
+    append=False,
 ):
-    for i in range(0, len(word_list), batch_size):
-        print(i, i + batch_size)
-        word_list_batch = word_list[i : i + batch_size]
-        tokenized = tokenizer(
-            word_list_batch,
-            padding=True,
-            truncation=True,
-            max_length=32,
-            return_tensors="pt",
+    # `ids` are the text ids of `word_list`, the batches of `text_encoder` are
+    # bulk-appended to `table_name` through Arrow every `flush_rows` rows.
+    # With `append` the rows are added to the existing table in its storage dtype
+    start = perf_counter()
+
+    storage = EmbeddingStorage.load(conn, table_name) if append else EmbeddingStorage()
+    pending_ids, pending_embeddings = [], []
+    num_written = 0
+
+    def flush():
+        nonlocal num_written
+        arrow_table = storage.to_arrow(
+            entity, pending_ids, np.concatenate(pending_embeddings)
         )
+        conn.register("embeddings_batch", arrow_table)
+        if num_written == 0 and not append:
+            reset_embedding_storage(conn, table_name)
+            conn.execute(
+                f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM embeddings_batch"
+            )
+        else:
+            conn.execute(f"INSERT INTO {table_name} SELECT * FROM embeddings_batch")
+        conn.unregister("embeddings_batch")
 
-        with torch.no_grad():
-            outputs = text_encoder(**tokenized)
+        num_written += len(pending_ids)
+        pending_ids.clear()
+        pending_embeddings.clear()
 
-        embeddings = outputs.last_hidden_state[:, 0, :].numpy()
-        df_emb = pd.DataFrame(embeddings)
-        df_emb.insert(0, entity, word_list_batch)
-        df_emb = df_emb.rename(
-            columns={i: f"{entity}_emb_{i}" for i in range(len(df_emb.columns))}
+        runtime = perf_counter() - start
+        print(
+            f"{entity}: {num_written}/{len(word_list)} strings"
+            f" - {num_written / runtime:.1f} strings/s"
         )
 
-        if i == 0:
-            conn.sql(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM df_emb")
-        else:
-            conn.sql(f"INSERT INTO {table_name} SELECT * FROM df_emb")
+    for indices, shard_embeddings in text_encoder.iter_batches(word_list):
+        pending_ids.extend(ids[i] for i in indices)
+        pending_embeddings.append(shard_embeddings)
+
+        if len(pending_ids) >= flush_rows:
+            flush()
+
+    if pending_ids:
+        flush()
 
 
 @timeit
 def create_remark_embeddings(
     conn: duckdb.DuckDBPyConnection,
-    tokenizer,
     text_encoder,
-    limit: int = 10000,
+    limit: int | None = 10000,
     dest_table: str | None = "remark_embeddings",
 ) -> None:
+    # ids are assigned by descending frequency when texts are first seen, so the
+    # first `limit` are the most used
     df = conn.sql(
         """
         SELECT
-            remark
-            , COUNT(trx_id)::INT32 AS cnt
+            remark_id
+            , remark
         FROM
-            edges
-        GROUP BY remark
-        ORDER BY cnt DESC
+            remark_vocab
+        ORDER BY remark_id
         """
     ).df()
-    df["pct"] = df["cnt"] / df["cnt"].sum()
-    df["csum"] = df["pct"].cumsum()
     df = df.iloc[:limit]
     remark_list = df["remark"].tolist()
 
     generate_embeddings(
         conn=conn,
+        ids=df["remark_id"].tolist(),
         word_list=remark_list,
         entity="remark",
-        tokenizer=tokenizer,
         text_encoder=text_encoder,
-        batch_size=1000,
         table_name=dest_table,
     )
 
@@ -129,38 +235,45 @@ def create_remark_embeddings(
 @timeit
 def create_node_name_embeddings(
     conn: duckdb.DuckDBPyConnection,
-    tokenizer,
     text_encoder,
-    limit: int = 10000,
+    limit: int | None = 10000,
     dest_table: str | None = "node_name_embeddings",
 ) -> None:
+    # ids are assigned by descending frequency when texts are first seen, so the
+    # first `limit` are the most used
     df = conn.sql(
         """
         SELECT
-            node_name
-            , COUNT(id)::INT32 AS cnt
+            node_name_id
+            , node_name
         FROM
-            nodes
-        GROUP BY node_name
-        ORDER BY cnt DESC
+            node_name_vocab
+        ORDER BY node_name_id
         """
     ).df()
-    df["pct"] = df["cnt"] / df["cnt"].sum()
-    df["csum"] = df["pct"].cumsum()
     df = df.iloc[:limit]
     node_list = df["node_name"].tolist()
 
     generate_embeddings(
         conn=conn,
+        ids=df["node_name_id"].tolist(),
         word_list=node_list,
         entity="node_name",
-        tokenizer=tokenizer,
         text_encoder=text_encoder,
-        batch_size=1000,
         table_name=dest_table,
     )
 
 
+@timeit
+def compress_embeddings(
+    conn: duckdb.DuckDBPyConnection, dtype: str = "float32", pca_dim: int | None = None
+) -> None:
+    if dtype == "float32" and not pca_dim:
+        return
+
+    compress_embedding_tables(conn, dtype, pca_dim=pca_dim)
+
+
 @timeit
 def get_features_statistics(
     conn: duckdb.DuckDBPyConnection,
@@ -173,38 +286,185 @@ def get_features_statistics(
         query = f"CREATE OR REPLACE TABLE {dest_table} AS\n{query}"
 
     conn.execute(query)
+    if dest_table:
+        record_table_rows(conn, [dest_table])
+
+
+def build_feature_pipeline(
+    conn: duckdb.DuckDBPyConnection,
+    text_encoder,
+    limit_remark_embeddings: int | None = None,
+    limit_node_name_embeddings: int | None = None,
+    embedding_dtype: str = "float32",
+    embedding_pca_dim: int | None = None,
+    neighbor_hops: int = 3,
+    stage_workers: int = 2,
+    force: bool | list[str] = False,
+) -> Pipeline:
+    pipeline = Pipeline(conn, workers=stage_workers, force=force)
+
+    # embeddings are re-encoded when their storage changes, compressed tables
+    # can't be compressed again so compress_embeddings skips the tables that
+    # were not re-encoded
+    embedding_config = {
+        "text_encoder": text_encoder.name,
+        "embedding_dtype": embedding_dtype,
+        "embedding_pca_dim": embedding_pca_dim,
+    }
+    embedding_resources = {"text_encoder": text_encoder}
+
+    pipeline.add(
+        Stage(
+            "remark_text_ids",
+            create_text_ids,
+            inputs=["edges"],
+            outputs=["remark_vocab", "edges"],
+            params={"entity": "remark", "source_table": "edges"},
+        )
+    )
+    pipeline.add(
+        Stage(
+            "node_name_text_ids",
+            create_text_ids,
+            inputs=["nodes"],
+            outputs=["node_name_vocab", "nodes"],
+            params={"entity": "node_name", "source_table": "nodes"},
+        )
+    )
+    pipeline.add(
+        Stage(
+            "remark_features",
+            create_remark_features,
+            inputs=["edges"],
+            outputs=["remark_features"],
+            params={"dest_table": "remark_features"},
+            files=["./queries/feature_engineering/01_remark_features.sql"],
+        )
+    )
+    pipeline.add(
+        Stage(
+            "node_trx_features",
+            create_node_trx_features,
+            inputs=["edges", "nodes"],
+            outputs=["node_trx_features"],
+            params={"dest_table": "node_trx_features"},
+            files=["./queries/feature_engineering/02_node_trx_features.sql"],
+        )
+    )
+    pipeline.add(
+        Stage(
+            "node_neighbor_features",
+            create_node_neighbor_features,
+            inputs=["nodes", "neighborhood", "node_trx_features"],
+            outputs=["node_neighbor_features"] if neighbor_hops else [],
+            params={"hops": neighbor_hops, "dest_table": "node_neighbor_features"},
+        )
+    )
+    pipeline.add(
+        Stage(
+            "days_features",
+            create_days_features,
+            outputs=["days_features"],
+            params={"dest_table": "days_features"},
+            files=["./datasets/raw/day_features.parquet"],
+        )
+    )
+    pipeline.add(
+        Stage(
+            "remark_embeddings",
+            create_remark_embeddings,
+            inputs=["remark_vocab"],
+            outputs=["remark_embeddings", "embedding_storage"],
+            params={
+                "dest_table": "remark_embeddings",
+                "limit": limit_remark_embeddings,
+            },
+            resources=embedding_resources,
+            config=embedding_config,
+        )
+    )
+    pipeline.add(
+        Stage(
+            "node_name_embeddings",
+            create_node_name_embeddings,
+            inputs=["node_name_vocab"],
+            outputs=["node_name_embeddings", "embedding_storage"],
+            params={
+                "dest_table": "node_name_embeddings",
+                "limit": limit_node_name_embeddings,
+            },
+            resources=embedding_resources,
+            config=embedding_config,
+        )
+    )
+    pipeline.add(
+        Stage(
+            "compress_embeddings",
+            compress_embeddings,
+            inputs=["remark_embeddings", "node_name_embeddings"],
+            outputs=["remark_embeddings", "node_name_embeddings", "embedding_storage"],
+            params={"dtype": embedding_dtype, "pca_dim": embedding_pca_dim},
+        )
+    )
+    pipeline.add(
+        Stage(
+            "features_statistics",
+            get_features_statistics,
+            inputs=["remark_features", "node_trx_features"],
+            outputs=["statistics_features"],
+            params={"dest_table": "statistics_features"},
+            files=["./queries/statistics/features_statistics.sql"],
+        )
+    )
+    return pipeline
 
 
 @timeit
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--db_path", type=str, required=True)
-    parser.add_argument("--limit_remark_embeddings", type=int, required=True)
-    parser.add_argument("--limit_node_name_embeddings", type=int, required=True)
+    # without limits the whole distinct vocabulary is embedded
+    parser.add_argument("--limit_remark_embeddings", type=int, default=None)
+    parser.add_argument("--limit_node_name_embeddings", type=int, default=None)
+    parser.add_argument(
+        "--text_encoder", type=str, default="indobert", choices=TEXT_ENCODERS
+    )
+    parser.add_argument("--token_budget", type=int, default=8192)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--embedding_dtype", type=str, default="float32", choices=EMBEDDING_DTYPES
+    )
+    parser.add_argument("--embedding_pca_dim", type=int, default=None)
+    parser.add_argument("--neighbor_hops", type=int, default=3, choices=[0, 1, 2, 3])
+    # stages whose code, parameters and input tables are unchanged since their
+    # last run are skipped, `--force` reruns every stage or only the named ones
+    parser.add_argument("--force", type=str, nargs="*", default=None)
+    parser.add_argument("--stage_workers", type=int, default=2)
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
     args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
 
-    tokenizer = BertTokenizer.from_pretrained(f"indobenchmark/{INDOBERT_MODEL}")
-    indobert = AutoModel.from_pretrained(f"indobenchmark/{INDOBERT_MODEL}")
+    text_encoder = load_text_encoder(
+        args.text_encoder, token_budget=args.token_budget, workers=args.workers
+    )
 
     conn = load_db(args.db_path)
-    create_remark_features(conn, dest_table="remark_features")
-    create_node_trx_features(conn, dest_table="node_trx_features")
-    create_days_features(conn, dest_table="days_features")
-    create_remark_embeddings(
-        conn,
-        tokenizer,
-        indobert,
-        dest_table="remark_embeddings",
-        limit=args.limit_remark_embeddings,
-    )
-    create_node_name_embeddings(
+    pipeline = build_feature_pipeline(
         conn,
-        tokenizer,
-        indobert,
-        dest_table="node_name_embeddings",
-        limit=args.limit_node_name_embeddings,
+        text_encoder,
+        limit_remark_embeddings=args.limit_remark_embeddings,
+        limit_node_name_embeddings=args.limit_node_name_embeddings,
+        embedding_dtype=args.embedding_dtype,
+        embedding_pca_dim=args.embedding_pca_dim,
+        neighbor_hops=args.neighbor_hops,
+        stage_workers=args.stage_workers,
+        force=True if args.force == [] else (args.force or False),
     )
-    get_features_statistics(conn, dest_table="statistics_features")
+    pipeline.run()
+    conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+import argparse
+import duckdb
+import sys
+import warnings
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling, record_table_rows  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.features import LABELS, purpose_features_sql  # type: ignore
+from utils.encoders import TEXT_ENCODERS, load_text_encoder  # type: ignore
+from sample_and_split import (  # type: ignore
+    create_neighborhood_table,
+    get_general_statistics,
+    get_nodes_statistics,
+)
+from features_remark_and_nodes import (  # type: ignore
+    create_node_neighbor_features,
+    generate_embeddings,
+    get_features_statistics,
+)
+
+warnings.filterwarnings("ignore")
+
+
+def find_new_partitions(conn: duckdb.DuckDBPyConnection, edges_path: str) -> list[str]:
+    return [
+        row[0]
+        for row in conn.execute(
+            f"""
+            SELECT file FROM glob('{edges_path}')
+            ANTI JOIN ingested_partitions USING(file)
+            ORDER BY file
+            """
+        ).fetchall()
+    ]
+
+
+@timeit
+def load_delta_edges(
+    conn: duckdb.DuckDBPyConnection, partitions: list[str], date_params: dict
+) -> int:
+    with open("./queries/incremental_refresh/01_load_delta_edges.sql") as f:
+        query = f.read()
+
+    edges_paths = "[" + ", ".join(f"'{path}'" for path in partitions) + "]"
+    conn.execute(query.format(edges_paths=edges_paths), date_params)
+    return conn.execute("SELECT COUNT(*) FROM delta_edges").fetchone()[0]
+
+
+@timeit
+def extend_remark_vocab(conn: duckdb.DuckDBPyConnection) -> list[tuple[int, str]]:
+    # returns the (remark_id, remark) of the remarks never seen before
+    max_id = conn.execute("SELECT COALESCE(MAX(remark_id), 0) FROM remark_vocab").fetchone()[0]
+
+    with open("./queries/incremental_refresh/02_extend_remark_vocab.sql") as f:
+        query = f.read()
+
+    conn.execute(query)
+    record_table_rows(conn, ["remark_vocab"])
+    return conn.execute(
+        "SELECT remark_id, remark FROM remark_vocab WHERE remark_id > $max_id ORDER BY 1",
+        {"max_id": max_id},
+    ).fetchall()
+
+
+@timeit
+def append_delta_edges(conn: duckdb.DuckDBPyConnection) -> None:
+    conn.execute("INSERT INTO edges BY NAME SELECT * FROM delta_edges")
+    record_table_rows(conn, ["edges"])
+
+
+@timeit
+def merge_sender_benef_pairs(conn: duckdb.DuckDBPyConnection) -> None:
+    with open("./queries/incremental_refresh/03_merge_sender_benef_pairs.sql") as f:
+        query = f.read()
+
+    conn.execute(query)
+    record_table_rows(conn, ["sender_benef_pairs", "touched_nodes"])
+
+
+@timeit
+def merge_neighborhood(conn: duckdb.DuckDBPyConnection) -> None:
+    # only the neighborhoods of the nodes of touched pairs change
+    create_neighborhood_table(
+        conn,
+        dest_table="delta_neighborhood",
+        src_node_filter="AND src_node_id IN (SELECT node_id FROM touched_nodes)",
+    )
+    conn.execute(
+        """
+        DELETE FROM neighborhood
+        WHERE src_node_id IN (SELECT node_id FROM touched_nodes)
+        """
+    )
+    conn.execute("INSERT INTO neighborhood SELECT * FROM delta_neighborhood")
+    conn.execute("DROP TABLE delta_neighborhood")
+    record_table_rows(conn, ["neighborhood"])
+
+
+@timeit
+def merge_purpose_features(conn: duckdb.DuckDBPyConnection) -> None:
+    for query_file in ["04_merge_remark_features", "05_merge_node_trx_features"]:
+        with open(f"./queries/incremental_refresh/{query_file}.sql") as f:
+            query = f.read().format(**purpose_features_sql(LABELS))
+
+        conn.execute(query)
+    record_table_rows(conn, ["remark_features", "node_trx_features"])
+
+
+@timeit
+def merge_labels_statistics(conn: duckdb.DuckDBPyConnection) -> None:
+    with open("./queries/incremental_refresh/06_merge_labels_statistics.sql") as f:
+        query = f.read()
+
+    conn.execute(query)
+    record_table_rows(conn, ["statistics_labels"])
+
+
+@timeit
+def embed_new_remarks(
+    conn: duckdb.DuckDBPyConnection,
+    new_remarks: list[tuple[int, str]],
+    text_encoder,
+) -> None:
+    if not new_remarks:
+        return
+
+    ids, remark_list = zip(*new_remarks)
+    generate_embeddings(
+        conn=conn,
+        ids=list(ids),
+        word_list=list(remark_list),
+        entity="remark",
+        text_encoder=text_encoder,
+        table_name="remark_embeddings",
+        append=True,
+    )
+    record_table_rows(conn, ["remark_embeddings"])
+
+
+@timeit
+def record_partitions(conn: duckdb.DuckDBPyConnection, partitions: list[str]) -> None:
+    conn.executemany(
+        "INSERT INTO ingested_partitions VALUES ($file)",
+        [{"file": path} for path in partitions],
+    )
+    record_table_rows(conn, ["ingested_partitions"])
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+
+    # a glob of the edges partitions, only files not ingested yet are read
+    parser.add_argument("--edges_path", type=str, required=True)
+    parser.add_argument("--db_path", type=str, required=True)
+    parser.add_argument("--date_train_start", type=str, default="2024-05-01")
+    parser.add_argument("--date_train_end", type=str, default="2024-05-31")
+    parser.add_argument("--date_valid_start", type=str, default="2024-06-01")
+    parser.add_argument("--date_valid_end", type=str, default="2024-06-30")
+    parser.add_argument("--date_test_start", type=str, default="2024-07-01")
+    parser.add_argument("--date_test_end", type=str, default="2024-07-31")
+    # must be the encoder of the stored embeddings
+    parser.add_argument(
+        "--text_encoder", type=str, default="indobert", choices=TEXT_ENCODERS
+    )
+    parser.add_argument("--token_budget", type=int, default=8192)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--neighbor_hops", type=int, default=3, choices=[0, 1, 2, 3])
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
+    args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
+
+    date_params = {
+        "date_train_start": args.date_train_start,
+        "date_train_end": args.date_train_end,
+        "date_valid_start": args.date_valid_start,
+        "date_valid_end": args.date_valid_end,
+        "date_test_start": args.date_test_start,
+        "date_test_end": args.date_test_end,
+    }
+
+    conn = load_db(args.db_path)
+
+    partitions = find_new_partitions(conn, args.edges_path)
+    if not partitions:
+        print("[INFO] no new partitions")
+        return
+    print(f"[INFO] new partitions: {partitions}")
+
+    # everything is applied in one transaction, a failed refresh changes nothing
+    conn.begin()
+
+    count_delta_edges = load_delta_edges(conn, partitions, date_params)
+    print(f"[INFO] {count_delta_edges} new edges")
+
+    new_remarks = extend_remark_vocab(conn)
+    append_delta_edges(conn)
+    merge_sender_benef_pairs(conn)
+    merge_neighborhood(conn)
+    merge_purpose_features(conn)
+    # propagation is linear in the edges, so neighbor features are recomputed
+    create_node_neighbor_features(
+        conn, hops=args.neighbor_hops, dest_table="node_neighbor_features"
+    )
+    merge_labels_statistics(conn)
+
+    text_encoder = load_text_encoder(
+        args.text_encoder, token_budget=args.token_budget, workers=args.workers
+    )
+    embed_new_remarks(conn, new_remarks, text_encoder)
+
+    get_general_statistics(conn)
+    get_nodes_statistics(conn)
+    get_features_statistics(conn, dest_table="statistics_features")
+    record_partitions(conn, partitions)
+
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
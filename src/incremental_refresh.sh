@@ -0,0 +1,15 @@
+# new monthly partitions are dropped next to edges.parquet as edges_<yyyymm>.parquet,
+# the test window is extended to cover them
+python ./src/incremental_refresh.py \
+    > ./logs/incremental_refresh/202405_202408_06_full.txt \
+    --profile_path ./logs/incremental_refresh/202405_202408_06_full.jsonl \
+    --edges_path "./datasets/processed/202405_202408/edges*.parquet" \
+    --db_path ./datasets/processed/202405_202408_06_full/database.duckdb \
+    --date_train_start 2024-05-01 \
+    --date_train_end 2024-05-31 \
+    --date_valid_start 2024-06-01 \
+    --date_valid_end 2024-06-30 \
+    --date_test_start 2024-07-01 \
+    --date_test_end 2024-08-31
+
+echo "Incremental refresh 202405_202408_06_full done"
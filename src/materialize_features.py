@@ -0,0 +1,156 @@
+import argparse
+import duckdb
+import numpy as np
+import os
+import sys
+import warnings
+
+sys.path.append("./utils/")
+
+from utils.time_utils import timeit  # type: ignore
+from utils.profiling import configure_profiling  # type: ignore
+from utils.db import load_db  # type: ignore
+from utils.features import (  # type: ignore
+    LABELS,
+    assemble_features,
+    feature_columns,
+    features_query,
+)
+from utils.feature_store import write_labels, write_split  # type: ignore
+from utils.embedding_cache import EmbeddingCache  # type: ignore
+from utils.encoders import TEXT_ENCODERS, load_text_encoder  # type: ignore
+from utils.embedding_storage import (  # type: ignore
+    load_embedding_lookups,
+    write_back_embeddings,
+)
+
+warnings.filterwarnings("ignore")
+
+DATA_SPLITS = ["train", "valid", "test"]
+
+
+@timeit
+def materialize_split(
+    conn: duckdb.DuckDBPyConnection,
+    data_split: str,
+    store_dir: str,
+    text_encoder,
+    vectors_per_chunk: int = 64,
+    embedding_cache: EmbeddingCache | None = None,
+    online_encoding: bool = True,
+    neighbor_hops: int = 0,
+) -> None:
+    rows_query = f"SELECT trx_id FROM edges WHERE data_split = '{data_split}'"
+    num_rows = conn.execute(f"SELECT COUNT(*) FROM ({rows_query})").fetchone()[0]
+
+    lookups = load_embedding_lookups(conn, with_vocab=online_encoding)
+    # new vectors are written back through a cursor of their own, the
+    # connection streams the features query
+    writer = conn.cursor()
+
+    def get_embeddings(word_list, entity, ids):
+        if embedding_cache is None:
+            embeddings = np.asarray(text_encoder.encode(word_list), np.float32)
+            encoded = word_list
+        else:
+            embeddings, encoded = embedding_cache.encode(word_list, text_encoder.encode)
+
+        if encoded:
+            index = {text: i for i, text in enumerate(word_list)}
+            rows = [index[text] for text in encoded]
+            write_back_embeddings(
+                writer,
+                entity,
+                lookups[entity].storage,
+                np.asarray(ids)[rows],
+                embeddings[rows],
+            )
+        return embeddings
+
+    def chunks():
+        result = conn.execute(features_query(rows_query, neighbor_hops=neighbor_hops))
+        while True:
+            df_features = result.fetch_df_chunk(vectors_per_chunk)
+            if df_features.empty:
+                break
+
+            features = assemble_features(
+                df_features, lookups, get_embeddings if online_encoding else None
+            )
+            yield (
+                df_features["trx_id"].values,
+                feature_columns(df_features, lookups),
+                features,
+            )
+
+    write_split(store_dir, data_split, num_rows, chunks())
+    writer.close()
+
+    # label codes in the row order of the features
+    label_ids = conn.execute(
+        f"""
+        SELECT COALESCE(LIST_POSITION($labels, e.purpose), 0) - 1 AS label_id
+        FROM ({rows_query}) AS b
+        LEFT JOIN edges AS e USING(trx_id)
+        ORDER BY b.trx_id
+        """,
+        {"labels": LABELS},
+    ).fetchnumpy()["label_id"]
+    write_labels(store_dir, data_split, label_ids, LABELS)
+
+
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_path", type=str, required=True)
+    parser.add_argument("--store_dir", type=str, default=None)
+    parser.add_argument("--vectors_per_chunk", type=int, default=64)
+    parser.add_argument("--embedding_cache_dir", type=str, default=None)
+    parser.add_argument(
+        "--text_encoder", type=str, default="indobert", choices=TEXT_ENCODERS
+    )
+    # without online encoding, texts missing an embedding get the unknown id
+    parser.add_argument(
+        "--online_encoding", action=argparse.BooleanOptionalAction, default=True
+    )
+    parser.add_argument("--neighbor_hops", type=int, default=0, choices=[0, 1, 2, 3])
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
+    args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
+
+    store_dir = args.store_dir or os.path.join(
+        os.path.dirname(args.db_path), "feature_store"
+    )
+
+    text_encoder = load_text_encoder(args.text_encoder)
+
+    embedding_cache = None
+    if args.embedding_cache_dir:
+        embedding_cache = EmbeddingCache(
+            args.embedding_cache_dir,
+            model_name=text_encoder.name,
+            max_length=getattr(text_encoder, "max_length", None),
+        )
+
+    conn = load_db(args.db_path)
+    for data_split in DATA_SPLITS:
+        materialize_split(
+            conn,
+            data_split,
+            store_dir,
+            text_encoder,
+            vectors_per_chunk=args.vectors_per_chunk,
+            embedding_cache=embedding_cache,
+            online_encoding=args.online_encoding,
+            neighbor_hops=args.neighbor_hops,
+        )
+
+    if embedding_cache is not None:
+        print(f"[INFO] embedding cache {embedding_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+python ./src/materialize_features.py \
+    > ./logs/materialize_features/202405_202408_01_xxs.txt \
+    --profile_path ./logs/materialize_features/202405_202408_01_xxs.jsonl \
+    --db_path ./datasets/processed/202405_202408_01_xxs/database.duckdb \
+    --store_dir ./datasets/processed/202405_202408_01_xxs/feature_store
+
+echo "Materialize features 202405_202408_01_xxs done"
+
+python ./src/materialize_features.py \
+    > ./logs/materialize_features/202405_202408_02_xs.txt \
+    --profile_path ./logs/materialize_features/202405_202408_02_xs.jsonl \
+    --db_path ./datasets/processed/202405_202408_02_xs/database.duckdb \
+    --store_dir ./datasets/processed/202405_202408_02_xs/feature_store
+
+echo "Materialize features 202405_202408_02_xs done"
+
+python ./src/materialize_features.py \
+    > ./logs/materialize_features/202405_202408_03_s.txt \
+    --profile_path ./logs/materialize_features/202405_202408_03_s.jsonl \
+    --db_path ./datasets/processed/202405_202408_03_s/database.duckdb \
+    --store_dir ./datasets/processed/202405_202408_03_s/feature_store
+
+echo "Materialize features 202405_202408_03_s done"
+
+python ./src/materialize_features.py \
+    > ./logs/materialize_features/202405_202408_04_m.txt \
+    --profile_path ./logs/materialize_features/202405_202408_04_m.jsonl \
+    --db_path ./datasets/processed/202405_202408_04_m/database.duckdb \
+    --store_dir ./datasets/processed/202405_202408_04_m/feature_store
+
+echo "Materialize features 202405_202408_04_m done"
+
+python ./src/materialize_features.py \
+    > ./logs/materialize_features/202405_202408_05_l.txt \
+    --profile_path ./logs/materialize_features/202405_202408_05_l.jsonl \
+    --db_path ./datasets/processed/202405_202408_05_l/database.duckdb \
+    --store_dir ./datasets/processed/202405_202408_05_l/feature_store
+
+echo "Materialize features 202405_202408_05_l done"
+
+python ./src/materialize_features.py \
+    > ./logs/materialize_features/202405_202408_06_full.txt \
+    --profile_path ./logs/materialize_features/202405_202408_06_full.jsonl \
+    --db_path ./datasets/processed/202405_202408_06_full/database.duckdb \
+    --store_dir ./datasets/processed/202405_202408_06_full/feature_store
+
+echo "Materialize features 202405_202408_06_full done"
@@ -0,0 +1,21 @@
+import argparse
+import sys
+import pandas as pd
+
+sys.path.append("./utils/")
+
+from utils.profiling import summarize_profile  # type: ignore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile_path", type=str, required=True)
+    parser.add_argument("--top", type=int, default=30)
+    args = parser.parse_args()
+
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(summarize_profile(args.profile_path).head(args.top).round(3))
+
+
+if __name__ == "__main__":
+    main()
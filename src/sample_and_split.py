@@ -1,47 +1,201 @@
 import os
 import argparse
 import duckdb
+import hashlib
+from datetime import date
 import sys
 
 sys.path.append("./utils/")
 
 from utils.time_utils import timeit  # type: ignore
+from utils.profiling import (  # type: ignore
+    configure_profiling,
+    profile_connection,
+    record_rows,
+    record_table_rows,
+)
+from utils.graph import create_connected_components_table  # type: ignore
+
+# rank of the sender-benef pairs, ties are broken on the node ids
+PAIR_RANK_ORDER = """
+    count_trx_total DESC
+    , count_trx_test DESC
+    , count_trx_valid DESC
+    , count_trx_train DESC
+    , sender_node_id
+    , benef_node_id
+"""
+
+
+def parse_date_params(date_params: dict) -> dict:
+    # ISO dates, validated before they are formatted into the SQL
+    parsed = {}
+    for key, value in date_params.items():
+        try:
+            parsed[key] = date.fromisoformat(str(value)).isoformat()
+        except ValueError:
+            raise ValueError(f"Invalid date for {key}: {value!r}") from None
+    return parsed
 
 
 @timeit
 def create_nodes_and_edges_table(
-    conn: duckdb.DuckDBPyConnection, nodes_path: str, edges_path: str, date_params: dict
+    conn: duckdb.DuckDBPyConnection,
+    nodes_path: str,
+    edges_path: str,
+    date_params: dict,
+    streaming: bool = False,
 ) -> None:
     with open("./queries/sample_and_split/01_create_nodes_and_edges_table.sql") as f:
         query = f.read()
 
+    # views can't hold prepared parameters, the dates are formatted in once
+    # parsed as dates
     conn.execute(
-        query.format(nodes_path=nodes_path, edges_path=edges_path), date_params
+        query.format(
+            nodes_path=nodes_path,
+            edges_path=edges_path,
+            edges_relation="VIEW" if streaming else "TABLE",
+            **parse_date_params(date_params),
+        )
     )
+    # a streamed raw_edges view would be read in full to be counted
+    record_table_rows(conn, ["nodes"] if streaming else ["nodes", "raw_edges"])
+
+
+def rank_pairs_query(limit_edges: int | None = None) -> str:
+    # the ranked pairs, or only the top `limit_edges` of them selected with a
+    # TOP_N operator instead of ranking every pair
+    with open("./queries/sample_and_split/02_rank_sender_benef_pairs.sql") as f:
+        query = f.read()
+
+    top_n_statement = (
+        f"ORDER BY {PAIR_RANK_ORDER} LIMIT {limit_edges}"
+        if limit_edges
+        else ""
+    )
+
+    return query.format(
+        top_n_statement=top_n_statement, pair_rank_order=PAIR_RANK_ORDER
+    )
+
+
+def pairs_fingerprint(
+    conn: duckdb.DuckDBPyConnection, edges_path: str, date_params: dict
+) -> str:
+    # the ranked pairs only depend on the raw edges files, the date split and
+    # the ranking query, a change to any of them gives a new fingerprint
+    sha = hashlib.sha256()
+    for (file,) in conn.execute(
+        f"SELECT file FROM glob('{edges_path}') ORDER BY file"
+    ).fetchall():
+        stat = os.stat(file)
+        sha.update(f"{os.path.abspath(file)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+
+    for key in sorted(date_params):
+        sha.update(f"{key}={date_params[key]}\0".encode())
+
+    sha.update(rank_pairs_query().encode())
+
+    return sha.hexdigest()[:16]
+
+
+@timeit
+def rank_sender_benef_pairs(
+    nodes_path: str,
+    edges_path: str,
+    date_params: dict,
+    pairs_cache_dir: str,
+    memory_limit: str | None = None,
+    temp_directory: str | None = None,
+) -> str:
+    # returns the parquet of the ranked pairs, computed only when no artifact
+    # exists for the fingerprint of the raw data and date split
+    conn = profile_connection(duckdb.connect())
+    configure_memory(conn, memory_limit=memory_limit, temp_directory=temp_directory)
+
+    fingerprint = pairs_fingerprint(conn, edges_path, date_params)
+    pairs_path = os.path.join(pairs_cache_dir, f"sender_benef_pairs_{fingerprint}.parquet")
+    if os.path.exists(pairs_path):
+        print(f"[INFO] reusing ranked pairs {pairs_path}")
+        conn.close()
+        return pairs_path
+
+    create_nodes_and_edges_table(
+        conn, nodes_path, edges_path, date_params, streaming=True
+    )
+    # write then rename, so an interrupted run never leaves a partial artifact
+    os.makedirs(pairs_cache_dir, exist_ok=True)
+    tmp_path = f"{pairs_path}.{os.getpid()}.tmp"
+    num_pairs = conn.execute(
+        f"COPY ({rank_pairs_query()}) TO '{tmp_path}' (FORMAT PARQUET)"
+    ).fetchone()[0]
+    os.replace(tmp_path, pairs_path)
+    record_rows({"sender_benef_pairs": num_pairs})
+    conn.close()
+
+    print(f"[INFO] ranked pairs written to {pairs_path}")
+    return pairs_path
 
 
 @timeit
 def create_sender_benef_pairs_table(
-    conn: duckdb.DuckDBPyConnection, limit_edges: int | None
+    conn: duckdb.DuckDBPyConnection, pairs_path: str | None, limit_edges: int | None
 ) -> None:
+    # without ranked pairs artifact, the top pairs are selected from raw_edges
+    if pairs_path is None:
+        conn.execute(
+            f"""
+            CREATE OR REPLACE TABLE sender_benef_pairs AS
+
+            {rank_pairs_query(limit_edges)}
+            """
+        )
+        record_table_rows(conn, ["sender_benef_pairs"])
+        return
+
     with open("./queries/sample_and_split/02_create_sender_benef_pairs_table.sql") as f:
         query = f.read()
 
     limit_edges_statement = (
-        f"ORDER BY pair_rank LIMIT {limit_edges}"
+        f"WHERE pair_rank <= {limit_edges}"
         if limit_edges
         else ""
     )
 
-    conn.execute(query.format(limit_edges_statement=limit_edges_statement))
+    conn.execute(
+        query.format(pairs_path=pairs_path, limit_edges_statement=limit_edges_statement)
+    )
+    record_table_rows(conn, ["sender_benef_pairs"])
 
 
 @timeit
-def resample_nodes_and_edges_table(conn: duckdb.DuckDBPyConnection) -> None:
+def resample_nodes_and_edges_table(
+    conn: duckdb.DuckDBPyConnection, streaming: bool = False
+) -> None:
     with open("./queries/sample_and_split/03_resample_nodes_and_edges.sql") as f:
         query = f.read()
 
     conn.execute(query)
+    conn.execute(f"DROP {'VIEW' if streaming else 'TABLE'} raw_edges")
+    record_table_rows(conn, ["nodes", "edges"])
+
+
+def configure_memory(
+    conn: duckdb.DuckDBPyConnection,
+    memory_limit: str | None = None,
+    temp_directory: str | None = None,
+) -> None:
+    # operators spill to `temp_directory` once `memory_limit` is reached, so
+    # the full data builds on machines with less memory than the edges
+    if memory_limit:
+        conn.execute(f"SET memory_limit = '{memory_limit}'")
+    if temp_directory:
+        os.makedirs(temp_directory, exist_ok=True)
+        conn.execute(f"SET temp_directory = '{temp_directory}'")
+    if memory_limit or temp_directory:
+        # every query that depends on row order sorts explicitly
+        conn.execute("SET preserve_insertion_order = false")
 
 
 @timeit
@@ -50,22 +204,46 @@ def reindex_tables(conn: duckdb.DuckDBPyConnection) -> None:
         query = f.read()
 
     conn.execute(query)
+    record_table_rows(conn, ["sender_benef_pairs", "edges", "nodes"])
 
 
 @timeit
-def create_neighborhood_table(conn: duckdb.DuckDBPyConnection) -> None:
+def create_neighborhood_table(
+    conn: duckdb.DuckDBPyConnection,
+    dest_table: str = "neighborhood",
+    src_node_filter: str = "",
+) -> None:
     with open("./queries/sample_and_split/05_create_neighborhood_table.sql") as f:
         query = f.read()
 
-    conn.execute(query)
+    conn.execute(query.format(dest_table=dest_table, src_node_filter=src_node_filter))
+    record_table_rows(conn, [dest_table])
+
+
+@timeit
+def record_ingested_partitions(
+    conn: duckdb.DuckDBPyConnection, edges_path: str
+) -> None:
+    # edges files already in the database, skipped by the incremental refresh
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE ingested_partitions AS
+
+        SELECT file FROM glob('{edges_path}')
+        """
+    )
+    record_table_rows(conn, ["ingested_partitions"])
 
 
 @timeit
 def create_connected_components(conn: duckdb.DuckDBPyConnection) -> None:
+    create_connected_components_table(conn, dest_table="connected_components")
+
     with open("./queries/sample_and_split/06_create_connected_components.sql") as f:
         query = f.read()
 
     conn.execute(query)
+    record_table_rows(conn, ["connected_components", "nodes"])
 
 
 @timeit
@@ -74,6 +252,7 @@ def get_general_statistics(conn: duckdb.DuckDBPyConnection) -> None:
         query = f.read()
 
     conn.sql(query)
+    record_table_rows(conn, ["statistics"])
 
 
 @timeit
@@ -82,6 +261,7 @@ def get_nodes_statistics(conn: duckdb.DuckDBPyConnection) -> None:
         query = f.read()
 
     conn.execute(query)
+    record_table_rows(conn, ["statistics_nodes"])
 
 
 @timeit
@@ -90,6 +270,7 @@ def get_labels_statistics(conn: duckdb.DuckDBPyConnection) -> None:
         query = f.read()
 
     conn.execute(query)
+    record_table_rows(conn, ["statistics_labels"])
 
 
 @timeit
@@ -98,6 +279,7 @@ def get_connected_component_statistics(conn: duckdb.DuckDBPyConnection) -> None:
         query = f.read()
 
     conn.execute(query)
+    record_table_rows(conn, ["statistics_connected_components"])
 
 
 @timeit
@@ -112,66 +294,124 @@ def show_statistics(conn: duckdb.DuckDBPyConnection, count_cc_stat=False) -> Non
 
 
 @timeit
-def main():
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument("--nodes_path", type=str, required=True)
-    parser.add_argument("--edges_path", type=str, required=True)
-    parser.add_argument("--db_path", type=str, required=True)
-    parser.add_argument("--date_train_start", type=str, default="2024-05-01")
-    parser.add_argument("--date_train_end", type=str, default="2024-05-31")
-    parser.add_argument("--date_valid_start", type=str, default="2024-06-01")
-    parser.add_argument("--date_valid_end", type=str, default="2024-06-30")
-    parser.add_argument("--date_test_start", type=str, default="2024-07-01")
-    parser.add_argument("--date_test_end", type=str, default="2024-07-31")
-    parser.add_argument("--limit_edges", type=int, default=None)
-    args = parser.parse_args()
-
-    os.makedirs(os.path.dirname(args.db_path), exist_ok=True)
+def build_database(
+    db_path: str,
+    nodes_path: str,
+    edges_path: str,
+    date_params: dict,
+    pairs_path: str | None,
+    limit_edges: int | None,
+    streaming: bool = False,
+    memory_limit: str | None = None,
+    temp_directory: str | None = None,
+) -> None:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
     # if db_path exist, remove it
-    if os.path.exists(args.db_path):
-        os.remove(args.db_path)
+    if os.path.exists(db_path):
+        os.remove(db_path)
 
-    date_params = {
-        "date_train_start": args.date_train_start,
-        "date_train_end": args.date_train_end,
-        "date_valid_start": args.date_valid_start,
-        "date_valid_end": args.date_valid_end,
-        "date_test_start": args.date_test_start,
-        "date_test_end": args.date_test_end,
-    }
-
-    conn = duckdb.connect(args.db_path)
+    conn = profile_connection(duckdb.connect(db_path))
+    configure_memory(conn, memory_limit=memory_limit, temp_directory=temp_directory)
 
     create_nodes_and_edges_table(
         conn,
-        nodes_path=args.nodes_path,
-        edges_path=args.edges_path,
+        nodes_path=nodes_path,
+        edges_path=edges_path,
         date_params=date_params,
+        streaming=streaming,
     )
-    create_sender_benef_pairs_table(conn, limit_edges=args.limit_edges)
-    resample_nodes_and_edges_table(conn)
+    record_ingested_partitions(conn, edges_path=edges_path)
+    create_sender_benef_pairs_table(conn, pairs_path, limit_edges=limit_edges)
+    resample_nodes_and_edges_table(conn, streaming=streaming)
     reindex_tables(conn)
     create_neighborhood_table(conn)
-
-    count_unique_edges = conn.sql(
-        "SELECT COUNT(DISTINCT (src_node_id, dst_node_id)) FROM neighborhood"
-    ).fetchall()[0][0]
-
-    is_feasible_to_create_cc = count_unique_edges <= 100000
-
-    if is_feasible_to_create_cc:
-        create_connected_components(conn)
+    create_connected_components(conn)
 
     get_general_statistics(conn)
     get_nodes_statistics(conn)
     get_labels_statistics(conn)
-
-    if is_feasible_to_create_cc:
-        get_connected_component_statistics(conn)
+    get_connected_component_statistics(conn)
 
     conn.close()
 
 
+@timeit
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--nodes_path", type=str, required=True)
+    parser.add_argument("--edges_path", type=str, required=True)
+    # several databases are built in one run from `--db_path a b ...` and
+    # `--limit_edges 100 1000 ...`, a limit of 0 keeps every pair
+    parser.add_argument("--db_path", type=str, nargs="+", required=True)
+    parser.add_argument("--date_train_start", type=str, default="2024-05-01")
+    parser.add_argument("--date_train_end", type=str, default="2024-05-31")
+    parser.add_argument("--date_valid_start", type=str, default="2024-06-01")
+    parser.add_argument("--date_valid_end", type=str, default="2024-06-30")
+    parser.add_argument("--date_test_start", type=str, default="2024-07-01")
+    parser.add_argument("--date_test_end", type=str, default="2024-07-31")
+    parser.add_argument("--limit_edges", type=int, nargs="+", default=None)
+    # ranked pairs artifacts, defaults to a `sender_benef_pairs` directory
+    # next to the edges
+    parser.add_argument("--pairs_cache_dir", type=str, default=None)
+    # select the top pairs of every size from the raw edges, without ranking
+    # and caching every pair first
+    parser.add_argument("--no_pairs_cache", action="store_true")
+    # read the raw edges through a view of the parquet scan instead of a table
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--memory_limit", type=str, default=None)
+    parser.add_argument("--temp_directory", type=str, default=None)
+    # structured JSONL profile of the stages, optionally with the DuckDB
+    # profile of every query
+    parser.add_argument("--profile_path", type=str, default=None)
+    parser.add_argument("--query_profiles", action="store_true")
+    args = parser.parse_args()
+    configure_profiling(args.profile_path, query_profiles=args.query_profiles)
+
+    limits_edges = args.limit_edges or [None] * len(args.db_path)
+    if len(limits_edges) != len(args.db_path):
+        parser.error("--limit_edges needs one value per --db_path")
+
+    try:
+        date_params = parse_date_params(
+            {
+                "date_train_start": args.date_train_start,
+                "date_train_end": args.date_train_end,
+                "date_valid_start": args.date_valid_start,
+                "date_valid_end": args.date_valid_end,
+                "date_test_start": args.date_test_start,
+                "date_test_end": args.date_test_end,
+            }
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    pairs_path = None
+    if not args.no_pairs_cache:
+        pairs_path = rank_sender_benef_pairs(
+            args.nodes_path,
+            args.edges_path,
+            date_params,
+            pairs_cache_dir=args.pairs_cache_dir
+            or os.path.join(os.path.dirname(args.edges_path), "sender_benef_pairs"),
+            memory_limit=args.memory_limit,
+            temp_directory=args.temp_directory,
+        )
+
+    for db_path, limit_edges in zip(args.db_path, limits_edges):
+        print(f"[INFO] building {db_path} with limit_edges={limit_edges}")
+        build_database(
+            db_path,
+            nodes_path=args.nodes_path,
+            edges_path=args.edges_path,
+            date_params=date_params,
+            pairs_path=pairs_path,
+            limit_edges=limit_edges,
+            streaming=args.streaming,
+            memory_limit=args.memory_limit,
+            temp_directory=args.temp_directory,
+        )
+
+
 if __name__ == "__main__":
     main()
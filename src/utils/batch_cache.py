@@ -0,0 +1,237 @@
+import heapq
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+CACHE_POLICIES = ["lru", "lfu"]
+
+
+def remove_spill_dir(path: str, pid: int) -> None:
+    # only the process that created the directory removes it, forked copies
+    # of the cache share it
+    if os.getpid() == pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class BatchCache:
+    # arrays kept in memory up to `max_bytes`, evicting the least recently
+    # ("lru") or least frequently ("lfu") used ones. With a `spill_dir`
+    # evicted arrays are written to a directory of this cache under it, up to
+    # `spill_max_bytes` oldest first, and read back on a memory miss. The
+    # directory goes away with the cache, so caches sharing a `spill_dir`
+    # never remove each other's arrays. Copies in other processes (pickled or
+    # forked DataLoader workers) start with an empty memory tier and share
+    # the spill directory
+    def __init__(
+        self,
+        max_bytes: int = 256 * 2**20,
+        policy: str = "lru",
+        spill_dir: str | None = None,
+        spill_max_bytes: int | None = None,
+    ):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(
+                f"Unknown cache policy '{policy}', expected one of {CACHE_POLICIES}"
+            )
+
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_dir = None
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix="batch_cache_", dir=spill_dir)
+            weakref.finalize(self, remove_spill_dir, self.spill_dir, os.getpid())
+        self.spill_max_bytes = spill_max_bytes
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._entries = OrderedDict()
+        # lfu: use count of every key, the keys of every count from the least
+        # recently used, and a heap of the counts holding each at most once
+        self._counts = {}
+        self._buckets = {}
+        self._count_heap = []
+        self._heaped = set()
+        self._spilled = OrderedDict()
+        self.bytes = 0
+        self.spill_bytes = 0
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the lock and every in-memory structure of `_reset`
+        for key in [
+            "_lock",
+            "_entries",
+            "_counts",
+            "_buckets",
+            "_count_heap",
+            "_heaped",
+            "_spilled",
+        ]:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._reset()
+
+    def _check_process(self) -> None:
+        # a forked worker drops the entries inherited from its parent
+        if os.getpid() != self._pid:
+            self.__setstate__(self.__getstate__())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        name = "_".join(str(part) for part in parts)
+        return os.path.join(self.spill_dir, f"{name}.npy")
+
+    def get(self, key) -> np.ndarray | None:
+        self._check_process()
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                if self.policy == "lfu":
+                    self._count_use(key)
+                return value
+
+        value = self._read_spill(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.spill_hits += 1
+        self.put(key, value)
+        return value
+
+    def put(self, key, value: np.ndarray) -> None:
+        self._check_process()
+        # arrays larger than the whole budget go straight to the spill
+        if value.nbytes > self.max_bytes:
+            self._spill(key, value)
+            return
+
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                return
+
+            self._entries[key] = value
+            if self.policy == "lfu":
+                self._count_use(key)
+            self.bytes += value.nbytes
+            while self.bytes > self.max_bytes:
+                evicted.append(self._evict())
+
+        for evicted_key, evicted_value in evicted:
+            self._spill(evicted_key, evicted_value)
+
+    def _count_use(self, key) -> None:
+        count = self._counts.get(key, 0)
+        if count:
+            self._drop_from_bucket(key, count)
+        self._counts[key] = count + 1
+
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+        if count + 1 not in self._heaped:
+            self._heaped.add(count + 1)
+            heapq.heappush(self._count_heap, count + 1)
+
+        # rebuilt from the live counts once stale ones make up most of it,
+        # a sorted list is a heap
+        if len(self._count_heap) > 2 * len(self._buckets) + 64:
+            self._count_heap = sorted(self._buckets)
+            self._heaped = set(self._count_heap)
+
+    def _drop_from_bucket(self, key, count: int) -> None:
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+
+    def _evict(self):
+        if self.policy == "lfu":
+            # least used, the least recent one among equals
+            while self._count_heap[0] not in self._buckets:
+                self._heaped.discard(heapq.heappop(self._count_heap))
+            key = next(iter(self._buckets[self._count_heap[0]]))
+            self._drop_from_bucket(key, self._counts.pop(key))
+        else:
+            key = next(iter(self._entries))
+
+        value = self._entries.pop(key)
+        self.bytes -= value.nbytes
+        self.evictions += 1
+        return key, value
+
+    def _spill(self, key, value: np.ndarray) -> None:
+        if self.spill_dir is None:
+            return
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            # write then rename, so other processes never read a partial file
+            os.makedirs(self.spill_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, value)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            if key not in self._spilled:
+                self._spilled[key] = value.nbytes
+                self.spill_bytes += value.nbytes
+
+            max_bytes = self.spill_max_bytes
+            while max_bytes is not None and self.spill_bytes > max_bytes:
+                old_key, nbytes = self._spilled.popitem(last=False)
+                self.spill_bytes -= nbytes
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def _read_spill(self, key) -> np.ndarray | None:
+        if self.spill_dir is None:
+            return None
+        try:
+            return np.load(self._path(key))
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+        if self.spill_dir and os.path.isdir(self.spill_dir):
+            shutil.rmtree(self.spill_dir)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.spill_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "spill_bytes": self.spill_bytes,
+            "hits": self.hits,
+            "spill_hits": self.spill_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.spill_hits) / lookups if lookups else 0.0,
+        }
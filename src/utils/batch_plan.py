@@ -0,0 +1,189 @@
+import duckdb
+import numpy as np
+
+from .features import LABELS
+from .profiling import get_profiler
+
+
+DATA_SPLITS = ["train", "valid", "test"]
+
+
+def stratified_order(
+    label_ids: np.ndarray, split_ids: np.ndarray, proportions: np.ndarray, seed: int
+) -> np.ndarray:
+    # row order grouped by split, where every purpose is shuffled from `seed`
+    # and the purposes are interleaved by `rank / proportion`, so each slice
+    # of the order keeps the purpose mix of the train split. Only the score
+    # needs a comparison sort, the small integer keys are radix sorted
+    num_rows = len(label_ids)
+    rng = np.random.default_rng(seed)
+
+    # random rank of every row within its split and purpose, from 1
+    group = split_ids.astype(np.int16) * len(proportions) + label_ids
+    grouped = rng.permutation(num_rows)
+    grouped = grouped[np.argsort(group[grouped], kind="stable")]
+    starts = np.flatnonzero(np.r_[True, np.diff(group[grouped]) != 0])
+    group_starts = np.repeat(starts, np.diff(np.r_[starts, num_rows]))
+    rank = np.empty(num_rows, dtype=np.float64)
+    rank[grouped] = np.arange(num_rows) - group_starts + 1
+
+    # stable sorts keep the purpose order on equal scores
+    score = rank / proportions[label_ids]
+    order = grouped[np.argsort(score[grouped], kind="stable")]
+    return order[np.argsort(split_ids[order], kind="stable")].astype(np.int32)
+
+
+class BatchPlan:
+    # stratified batches of every split, planned in memory from one scan of
+    # `edges`. `order` holds int32 row indices in batch order, and within a
+    # batch rows are sorted by trx_id like the features query returns them.
+    # `shuffle(seed)` replans without touching the database
+    def __init__(
+        self,
+        trx_ids,
+        label_ids,
+        split_ids,
+        proportions,
+        batch_size: int,
+        labels: list[str] | None = None,
+        seed: int = 42,
+    ):
+        self.trx_ids = np.asarray(trx_ids, dtype=np.int64)
+        self.label_ids = np.asarray(label_ids, dtype=np.int8)
+        self.split_ids = np.asarray(split_ids, dtype=np.int8)
+        self.proportions = np.asarray(proportions, dtype=np.float64)
+        self.batch_size = batch_size
+        self.labels = labels or LABELS
+        # position of every row in trx_id order, to sort rows within batches
+        self.trx_ranks = np.empty(len(self.trx_ids), dtype=np.int64)
+        self.trx_ranks[np.argsort(self.trx_ids)] = np.arange(len(self.trx_ids))
+        self.shuffle(seed)
+
+    @classmethod
+    def load(
+        cls,
+        conn: duckdb.DuckDBPyConnection,
+        batch_size: int,
+        labels: list[str] | None = None,
+        seed: int = 42,
+    ):
+        labels = labels or LABELS
+        with get_profiler().span("batch_plan.load") as record:
+            # edges outside every split or whose purpose has no train
+            # proportion are never batched
+            rows = conn.execute(
+                """
+                SELECT
+                    trx_id
+                    , (LIST_POSITION($labels, purpose) - 1)::INT1 AS label_id
+                    , (LIST_POSITION($data_splits, data_split) - 1)::INT1 AS split_id
+                FROM
+                    edges
+                SEMI JOIN
+                    statistics_labels USING(purpose)
+                WHERE 1 = 1
+                    AND LIST_POSITION($labels, purpose) > 0
+                    AND LIST_POSITION($data_splits, data_split) > 0
+                """,
+                {"labels": labels, "data_splits": DATA_SPLITS},
+            ).fetchnumpy()
+            record["rows"] = len(rows["trx_id"])
+
+            proportions = np.full(len(labels), np.nan)
+            for purpose, pct_train in conn.execute(
+                "SELECT purpose, pct_train FROM statistics_labels"
+            ).fetchall():
+                if purpose in labels:
+                    proportions[labels.index(purpose)] = pct_train
+
+        return cls(
+            rows["trx_id"],
+            rows["label_id"],
+            rows["split_id"],
+            proportions,
+            batch_size,
+            labels=labels,
+            seed=seed,
+        )
+
+    def shuffle(self, seed: int):
+        with get_profiler().span("batch_plan.shuffle", rows=len(self.trx_ids)):
+            self.seed = seed
+            order = stratified_order(
+                self.label_ids, self.split_ids, self.proportions, seed
+            )
+
+            splits = self.split_ids[order]
+            self.split_offsets = np.searchsorted(
+                splits, np.arange(len(DATA_SPLITS) + 1)
+            )
+            position = np.arange(len(order)) - self.split_offsets[splits]
+
+            batch = splits.astype(np.int64) * len(order) + position // self.batch_size
+            key = batch * len(order) + self.trx_ranks[order]
+            self.order = order[np.argsort(key)]
+        return self
+
+    def split(self, data_split: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # trx ids and int8 label ids of `data_split` in batch order, with the
+        # offsets where every batch starts
+        i = DATA_SPLITS.index(data_split)
+        rows = self.order[self.split_offsets[i] : self.split_offsets[i + 1]]
+        offsets = np.r_[np.arange(0, len(rows), self.batch_size), len(rows)]
+        return self.trx_ids[rows], self.label_ids[rows], offsets
+
+    def split_rows(self, data_split: str) -> np.ndarray:
+        # rows of `data_split` in trx_id order, the items of row-level datasets
+        rows = np.flatnonzero(self.split_ids == DATA_SPLITS.index(data_split))
+        return rows[np.argsort(self.trx_ranks[rows], kind="stable")]
+
+    def split_batches(self, data_split: str) -> tuple[np.ndarray, np.ndarray]:
+        # batches of `data_split` as positions in `split_rows(data_split)`,
+        # with the offsets where every batch starts
+        i = DATA_SPLITS.index(data_split)
+        rows = self.order[self.split_offsets[i] : self.split_offsets[i + 1]]
+        ranks = self.trx_ranks[rows]
+        positions = np.searchsorted(np.sort(ranks), ranks).astype(np.int32)
+        offsets = np.r_[np.arange(0, len(ranks), self.batch_size), len(ranks)]
+        return positions, offsets
+
+
+class StratifiedBatchSampler:
+    # batch sampler of a DataLoader over a row-level dataset, yielding the
+    # stratified batches of the plan. Like CustomDataset, epoch n uses the
+    # plan of seed + n, and `shuffle` also permutes the order of the batches
+    def __init__(
+        self,
+        batch_plan: BatchPlan,
+        data_split: str,
+        seed: int = 42,
+        shuffle: bool = False,
+    ):
+        self.batch_plan = batch_plan
+        self.data_split = data_split
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self._load_batches()
+
+    def _load_batches(self):
+        self._positions, self._offsets = self.batch_plan.split_batches(self.data_split)
+        self._plan_seed = self.batch_plan.seed
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        seed = self.seed + epoch
+        if self.batch_plan.seed != seed:
+            self.batch_plan.shuffle(seed)
+        if self._plan_seed != seed:
+            self._load_batches()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        order = np.arange(len(self))
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(order)
+        for idx in order:
+            yield self._positions[self._offsets[idx] : self._offsets[idx + 1]]
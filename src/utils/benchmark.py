@@ -0,0 +1,86 @@
+import torch
+
+from .batch_plan import BatchPlan
+from .dataset import LABELS, CustomDataset
+from .model import FCN
+from .prefetch import PrefetchLoader
+from .trainer import Trainer
+
+
+def train_and_evaluate(
+    conn,
+    text_encoder,
+    batch_size=256,
+    epochs=5,
+    n_hiddens=(256, 64),
+    learning_rate=1e-3,
+    seed=42,
+    prefetch_depth=4,
+    prefetch_workers=2,
+    **dataset_kwargs,
+) -> dict:
+    # downstream F1 of a small FCN, used to compare feature settings
+    torch.manual_seed(seed)
+
+    batch_plan = BatchPlan.load(conn, batch_size, seed=seed)
+    train_ds = CustomDataset(
+        conn, batch_size, "train", text_encoder, batch_plan=batch_plan, **dataset_kwargs
+    )
+    valid_ds = CustomDataset(
+        conn, batch_size, "valid", text_encoder, batch_plan=batch_plan, **dataset_kwargs
+    )
+    prefetch = {"depth": prefetch_depth, "workers": prefetch_workers}
+    train_dl = PrefetchLoader(train_ds, shuffle=True, seed=seed, **prefetch)
+    valid_dl = PrefetchLoader(valid_ds, **prefetch)
+
+    features, _ = train_ds[0]
+    model = FCN(LABELS, input_shape=features.shape[-1], n_hiddens=list(n_hiddens))
+    trainer = Trainer(
+        model,
+        torch.optim.Adam(model.parameters(), lr=learning_rate),
+        torch.nn.CrossEntropyLoss(),
+        device="cpu",
+    )
+    history = trainer.fit(train_dl, valid_dl, epochs)
+    print(f"[INFO] train loader {train_dl.stats()}")
+    print(f"[INFO] train batch cache {train_ds.batch_cache_stats()}")
+
+    return {
+        "f1": history["f1"][-1],
+        "val_f1": history["val_f1"][-1],
+        "val_loss": history["val_loss"][-1],
+    }
+
+
+def metric_direction(metric: str) -> int | None:
+    # 1 if higher is better, -1 if lower is better, None if not compared
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith("_s"):
+        return -1
+    return None
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    # per tier and timed metric, the relative change against the baseline,
+    # changes worse than `tolerance` are regressions
+    rows = []
+    for tier, metrics in results.items():
+        for metric, value in metrics.items():
+            direction = metric_direction(metric)
+            reference = baseline.get(tier, {}).get(metric)
+            if direction is None or not reference or value is None:
+                continue
+
+            change = (value - reference) / reference
+            rows.append(
+                {
+                    "tier": tier,
+                    "metric": metric,
+                    "baseline": reference,
+                    "current": value,
+                    "change": change,
+                    "regression": direction * change < -tolerance,
+                }
+            )
+    return rows
@@ -1,19 +1,25 @@
+import os
+import threading
+import numpy as np
 import torch
 
-from functools import lru_cache
-from torch.utils.data import Dataset
+from torch.utils.data import DataLoader, Dataset, default_collate
 
+from .batch_cache import BatchCache
+from .batch_plan import BatchPlan, StratifiedBatchSampler
+from .embedding_cache import EmbeddingCache
+from .embedding_storage import load_embedding_lookups, write_back_embeddings
+from .features import LABELS, assemble_features, features_query
+from .feature_store import FeatureStore
+from .profiling import get_profiler
 
-LABELS = [
-    "bills",
-    "business",
-    "debt_and_installment",
-    "donation",
-    "family_and_friends",
-    "invest",
-    "others",
-    "shopping",
-]
+
+def label_tensor(label_ids, num_classes, one_hot=False):
+    # int64 class indices from int8 label codes, as the loss expects them
+    labels = torch.from_numpy(label_ids.astype(np.int64))
+    if one_hot:
+        return torch.nn.functional.one_hot(labels, num_classes).float()
+    return labels
 
 
 class CustomDataset(Dataset):
@@ -22,22 +28,94 @@ class CustomDataset(Dataset):
         duckdb_conn,
         batch_size,
         data_split,
-        tokenizer,
-        text_encoder,
+        text_encoder=None,
         labels=None,
         seed=42,
+        feature_store_dir=None,
+        embedding_cache_dir=None,
+        embedding_lookups=None,
+        online_encoding=True,
+        neighbor_hops=0,
+        batch_plan=None,
+        batch_cache_bytes=256 * 2**20,
+        batch_cache_policy="lru",
+        batch_cache_dir=None,
+        one_hot_labels=False,
+        batch_layout=False,
     ):
         self.conn = duckdb_conn
         self.batch_size = batch_size
         self.data_split = data_split
-        self.tokenizer = tokenizer
+        # any encoder of `utils.encoders`, only needed with online encoding
         self.text_encoder = text_encoder
         self.labels = labels or LABELS
         self.labels_map = dict(zip(self.labels, range(len(self.labels))))
         self.seed = seed
+        # labels as class indices, or as one-hot rows
+        self.one_hot_labels = one_hot_labels
+        # encode texts without a stored embedding, else they use the unknown id
+        self.online_encoding = online_encoding and text_encoder is not None
+        # join the sender and benef neighbor features of hops 1..neighbor_hops
+        self.neighbor_hops = neighbor_hops
+
+        # persistent cache for texts missing from the embedding tables
+        self.embedding_cache = None
+        if embedding_cache_dir and text_encoder is not None:
+            self.embedding_cache = EmbeddingCache(
+                embedding_cache_dir,
+                model_name=text_encoder.name,
+                max_length=getattr(text_encoder, "max_length", None),
+            )
+
+        # prefetch threads query through their own cursors, and write new
+        # embeddings back one at a time so the same id is inserted once
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        # stratified batches of every split, can be shared between datasets,
+        # epoch n uses the batches of seed + n
+        self.epoch = 0
+        self.batch_plan = batch_plan or BatchPlan.load(
+            duckdb_conn, batch_size, labels=self.labels, seed=seed
+        )
+        self._load_batches()
+
+        # batches are gathered from the memory-mapped feature matrix. With
+        # `batch_layout` they are views of a copy of it in the batch order of
+        # the first epoch instead, which doubles the split on disk and replaces
+        # the layout of datasets with another plan, later epochs are gathered
+        self.feature_store = None
+        self._layout_seed = None
+        if feature_store_dir:
+            self.feature_store = FeatureStore(feature_store_dir, data_split)
+            self._batch_positions = self.feature_store.positions(self._batch_trx_ids)
+            if batch_layout:
+                self.feature_store.use_batch_layout(self._batch_positions)
+                self._layout_seed = self._plan_seed
 
-        self._generate_batches()
-        self.num_batches = self._get_num_batches()
+        # queried batches kept up to `batch_cache_bytes`, evicted ones spilled
+        # under `batch_cache_dir` when given. Owned by this dataset, so it and
+        # its spilled batches, only valid for the current database, go away
+        # with it
+        self.batch_cache = None
+        if self.feature_store is None and batch_cache_bytes:
+            spill_dir = None
+            if batch_cache_dir:
+                spill_dir = os.path.join(
+                    batch_cache_dir,
+                    f"{data_split}-b{batch_size}-h{neighbor_hops}",
+                )
+            self.batch_cache = BatchCache(
+                batch_cache_bytes, policy=batch_cache_policy, spill_dir=spill_dir
+            )
+
+        # embedding tables decoded in memory, can be shared between datasets
+        self.embedding_lookups = embedding_lookups
+        if self.feature_store is None and self.embedding_lookups is None:
+            self.embedding_lookups = load_embedding_lookups(
+                duckdb_conn, with_vocab=online_encoding
+            )
 
     def __len__(self):
         return self.num_batches
@@ -49,218 +127,236 @@ class CustomDataset(Dataset):
             .purpose.tolist()
         )
 
-    def _generate_batches(self):
-        self.conn.execute(
-            """
-            CREATE OR REPLACE TEMPORARY TABLE batches AS
-
-            -- Calculate the proportion of each purpose within the training set
-            WITH purpose_proportions AS (
-                SELECT
-                    purpose,
-                    pct_train AS proportion
-                FROM
-                    statistics_labels
-            ),
-
-            -- Number each row with respect to the purpose and data_split while ordering by hash to maintain randomness
-            row_numbered AS (
-                SELECT
-                    e.data_split,
-                    e.purpose,
-                    e.trx_id,
-                    ROW_NUMBER() OVER(
-                        PARTITION BY e.data_split, e.purpose ORDER BY HASH(e.trx_id + $seed)
-                    ) AS row_num1,
-                    pp.proportion
-                FROM
-                    edges e
-                    JOIN purpose_proportions pp ON e.purpose = pp.purpose
-            ),
-
-            -- Determine the batch size per purpose for each row
-            batched AS (
-                SELECT
-                    data_split,
-                    purpose,
-                    trx_id,
-                    row_num1,
-                    proportion,
-                    ROW_NUMBER() OVER(
-                        PARTITION BY data_split ORDER BY row_num1 / proportion, purpose, trx_id
-                    ) AS row_num2
-                FROM
-                    row_numbered
-            ),
-
-            -- Assign batch IDs based on the row numbers and batch size
-            final AS (
-                SELECT
-                    *,
-                    FLOOR(row_num2 / $batch_size)::INT AS batch_id
-                FROM
-                    batched
+    def _cursor(self):
+        # DuckDB connections are not thread-safe, other threads than the
+        # owner get a cursor of their own
+        if threading.get_ident() == self._owner:
+            return self.conn
+        if not hasattr(self._local, "cursor"):
+            self._local.cursor = self.conn.cursor()
+        return self._local.cursor
+
+    def _load_batches(self):
+        # trx ids and int8 label ids of the split in batch order, held in
+        # memory so any cursor can fetch a batch
+        if self.batch_plan.batch_size != self.batch_size:
+            raise ValueError(
+                f"Batch plan has batch size {self.batch_plan.batch_size},"
+                f" expected {self.batch_size}"
             )
+        if self.batch_plan.labels != self.labels:
+            raise ValueError("Batch plan was built with other labels")
 
-            SELECT
-                batch_id,
-                data_split,
-                trx_id,
-                purpose
-            FROM
-                final
-            """,
-            {
-                "batch_size": self.batch_size,
-                "seed": self.seed,
-            },
-        )
+        (
+            self._batch_trx_ids,
+            self._batch_label_ids,
+            self._batch_offsets,
+        ) = self.batch_plan.split(self.data_split)
+        self._plan_seed = self.batch_plan.seed
+        self.num_batches = len(self._batch_offsets) - 1
 
-    def _get_num_batches(self):
-        return (
-            self.conn.execute(
-                f"""
-            SELECT MAX(batch_id) + 1 FROM batches WHERE data_split = '{self.data_split}'
-            """
-            ).fetchone()[0]
-            or 0
-        )
+    def set_epoch(self, epoch):
+        # fresh batch composition for `epoch`, a shared plan is reshuffled
+        # once for every dataset using it and nothing is queried
+        self.epoch = epoch
+        seed = self.seed + epoch
+        if self.batch_plan.seed != seed:
+            self.batch_plan.shuffle(seed)
+        if self._plan_seed != seed:
+            self._load_batches()
+            if self.feature_store is not None:
+                self._batch_positions = self.feature_store.positions(
+                    self._batch_trx_ids
+                )
+
+    def _batch_slice(self, idx):
+        return slice(self._batch_offsets[idx], self._batch_offsets[idx + 1])
 
-    @lru_cache(maxsize=1024)
     def _get_labels(self, idx):
-        df_labels = self.conn.execute(
-            f"""
-            WITH batch AS (
-                SELECT
-                    trx_id
-                FROM
-                    batches
-                WHERE 1 = 1
-                    AND data_split = '{self.data_split}'
-                    AND batch_id = {idx}
-            )
+        return label_tensor(
+            self._batch_label_ids[self._batch_slice(idx)],
+            len(self.labels),
+            self.one_hot_labels,
+        )
 
-            SELECT
-                e.purpose
-            FROM
-                batch AS b
-            LEFT JOIN
-                edges AS e USING(trx_id)
-            ORDER BY
-                b.trx_id
-            """
-        ).df()
+    def _get_store_features(self, idx):
+        # zero-copy view while the batches are those of the layout, else the
+        # rows are gathered, nothing is cached per batch either way
+        batch = self._batch_slice(idx)
+        layout = self.feature_store.batch_features is not None
+        if layout and self._plan_seed == self._layout_seed:
+            features = self.feature_store.batch_slice(batch.start, batch.stop)
+        else:
+            features = self.feature_store.gather(self._batch_positions[batch])
+        return torch.from_numpy(features)
 
-        mapped = df_labels.purpose.map(self.labels_map).values
-        tensor = torch.zeros((len(mapped), len(self.labels)), dtype=torch.float32)
-        tensor[torch.arange(len(df_labels)), mapped] = 1
+    def _get_features(self, idx):
+        # the plan seed keys the cache by batch composition
+        if self.batch_cache is None:
+            return torch.from_numpy(self._query_features(idx))
 
-        return tensor
+        key = (self._plan_seed, idx)
+        features = self.batch_cache.get(key)
+        if features is None:
+            features = self._query_features(idx)
+            self.batch_cache.put(key, features)
+        return torch.from_numpy(features)
 
-    @lru_cache(maxsize=1024)
-    def _get_features(self, idx):
-        df_features = self.conn.execute(
-            f"""
-            WITH batch AS (
-                SELECT
-                    trx_id
-                FROM
-                    batches
-                WHERE 1 = 1
-                    AND data_split = '{self.data_split}'
-                    AND batch_id = {idx}
-            )
+    def _query_features(self, idx):
+        profiler = get_profiler()
+        with profiler.span("dataset.features_query") as record:
+            df_features = self._cursor().execute(
+                features_query(
+                    "SELECT UNNEST($trx_ids) AS trx_id",
+                    neighbor_hops=self.neighbor_hops,
+                ),
+                {"trx_ids": self._batch_trx_ids[self._batch_slice(idx)].tolist()},
+            ).df()
+            record["rows"] = len(df_features)
 
-            , features AS (
-                SELECT
-                    b.trx_id
-                    , e.remark
-                    , node_s.node_name AS sender_node_name
-                    , node_b.node_name AS benef_node_name
-                    , df.* EXCLUDE (calendar_date)
-                    , amount_encoding(e.amount, 10_000, 100_000)         AS encoded_amount_10K_100K
-                    , amount_encoding(e.amount, 100_000, 300_000)        AS encoded_amount_100K_300K
-                    , amount_encoding(e.amount, 300_000, 1_000_000)      AS encoded_amount_300K_1M
-                    , amount_encoding(e.amount, 1_000_000, 5_000_000)    AS encoded_amount_1M_5M
-                    , amount_encoding(e.amount, 5_000_000, 10_000_000)   AS encoded_amount_5M_10M
-                    , amount_encoding(e.amount, 10_000_000, 50_000_000)  AS encoded_amount_10M_50M
-                    , amount_encoding(e.amount, 10_000, 50_000_000)      AS encoded_amount_10K_50M
-                    , re.* EXCLUDE (remark)
-                    , nne_s.* EXCLUDE (node_name)
-                    , nne_b.* EXCLUDE (node_name)
-                FROM
-                    batch AS b
-                LEFT JOIN
-                    edges AS e USING(trx_id)
-                LEFT JOIN
-                    days_features AS df
-                    ON e.trx_date = df.calendar_date
-                LEFT JOIN
-                    remark_embeddings AS re
-                    ON e.remark = re.remark
-                LEFT JOIN
-                    nodes AS node_s
-                    ON e.sender_node_id = node_s.id
-                LEFT JOIN
-                    nodes AS node_b
-                    ON e.benef_node_id = node_b.id
-                LEFT JOIN
-                    node_name_embeddings AS nne_s
-                    ON node_s.node_name = nne_s.node_name
-                LEFT JOIN
-                    node_name_embeddings AS nne_b
-                    ON node_b.node_name = nne_b.node_name
+        with profiler.span("dataset.assemble_features"):
+            features = assemble_features(
+                df_features,
+                self.embedding_lookups,
+                self.get_embeddings if self.online_encoding else None,
             )
-
-            SELECT
-                *
-            FROM
-                features
-            ORDER BY
-                trx_id
-            """
-        ).df()
-
-        # get df with no pre-computed embeddings
-        for emb_col, col in zip(
-            ["remark_emb_0", "node_name_emb_0", "node_name_emb_0_1"],
-            ["remark", "sender_node_name", "benef_node_name"],
-        ):
-            mask_null = df_features[emb_col].isnull()
-            df_no_emb = df_features.loc[mask_null, ["trx_id", col]]
-
-            if df_no_emb.empty:
-                continue
-
-            embeddings = self.get_embeddings(df_no_emb[col].tolist())
-            len_emb = embeddings.shape[1]
-            splitted = emb_col.split("_")  # "{emb_col}_0_1" -> ["{emb_col}", "0", "1"]
-            idx_emb = splitted.index("emb")
-            emb_col_last = "_".join(splitted[: idx_emb + 1]) + f"_{len_emb - 1}"
-            if len(splitted) > idx_emb + 2:
-                emb_col_last += "_" + "_".join(splitted[idx_emb + 2 :])
-
-            df_features.loc[mask_null, emb_col:emb_col_last] = embeddings.numpy()
-
-        features = df_features.drop(
-            columns=["trx_id", "remark", "sender_node_name", "benef_node_name"]
-        )
-        features = torch.tensor(features.values, dtype=torch.float32)
         return features
 
-    @lru_cache(maxsize=1024)
     def __getitem__(self, idx):
-        return self._get_features(idx), self._get_labels(idx)
-
-    def get_embeddings(self, word_list):
-        with torch.no_grad():
-            embeddings = self.text_encoder(
-                **self.tokenizer(
-                    word_list,
-                    padding=True,
-                    truncation=True,
-                    max_length=32,
-                    return_tensors="pt",
+        # cached batches show up as spans without children
+        profiler = get_profiler()
+        with profiler.span("dataset.getitem", data_split=self.data_split, idx=idx) as record:
+            with profiler.span("dataset.features"):
+                if self.feature_store is not None:
+                    features = self._get_store_features(idx)
+                else:
+                    features = self._get_features(idx)
+
+            with profiler.span("dataset.labels"):
+                labels = self._get_labels(idx)
+
+            record["rows"] = len(labels)
+        return features, labels
+
+    def get_embeddings(self, word_list, entity=None, ids=None):
+        with get_profiler().span("dataset.encode", entity=entity, rows=len(word_list)):
+            return self._get_embeddings(word_list, entity=entity, ids=ids)
+
+    def _get_embeddings(self, word_list, entity=None, ids=None):
+        if self.embedding_cache is None:
+            embeddings = np.asarray(self.text_encoder.encode(word_list), np.float32)
+            encoded = word_list
+        else:
+            embeddings, encoded = self.embedding_cache.encode(
+                word_list, self.text_encoder.encode
+            )
+
+        # write new vectors back, so the next lookup is served by the tables
+        if entity and ids is not None and encoded:
+            index = {text: i for i, text in enumerate(word_list)}
+            rows = [index[text] for text in encoded]
+            with self._write_lock:
+                write_back_embeddings(
+                    self._cursor(),
+                    entity,
+                    self.embedding_lookups[entity].storage,
+                    np.asarray(ids)[rows],
+                    embeddings[rows],
                 )
-            ).last_hidden_state[:, 0, :]
-        return embeddings
+
+        return torch.from_numpy(embeddings)
+
+    def embedding_cache_stats(self):
+        if self.embedding_cache is None:
+            return {}
+        return self.embedding_cache.stats()
+
+    def batch_cache_stats(self):
+        if self.batch_cache is None:
+            return {}
+        return self.batch_cache.stats()
+
+
+class RowDataset(Dataset):
+    # one item per transaction of `data_split` in the order of
+    # `BatchPlan.split_rows`, served from the feature store. `__getitems__`
+    # gathers a whole batch of rows at once, so a DataLoader with a
+    # `StratifiedBatchSampler` and `collate_rows` yields (batch, features)
+    # tensors, and worker processes re-map the store instead of copying it
+    def __init__(
+        self,
+        feature_store_dir,
+        data_split,
+        batch_plan,
+        labels=None,
+        one_hot_labels=False,
+    ):
+        self.data_split = data_split
+        self.labels = labels or LABELS
+        self.one_hot_labels = one_hot_labels
+        if batch_plan.labels != self.labels:
+            raise ValueError("Batch plan was built with other labels")
+
+        rows = batch_plan.split_rows(data_split)
+        self.trx_ids = batch_plan.trx_ids[rows]
+
+        self.feature_store = FeatureStore(feature_store_dir, data_split)
+        self.positions = self.feature_store.positions(self.trx_ids)
+
+        # int8 label codes of the store rows, or of the plan for older stores
+        if self.feature_store.labels == self.labels:
+            self.label_ids = self.feature_store.label_ids[self.positions]
+        else:
+            self.label_ids = batch_plan.label_ids[rows]
+
+    def __len__(self):
+        return len(self.trx_ids)
+
+    def __getitem__(self, idx):
+        features, labels = self.__getitems__([idx])
+        return features[0], labels[0]
+
+    def __getitems__(self, indices):
+        profiler = get_profiler()
+        with profiler.span("dataset.getitems", data_split=self.data_split) as record:
+            indices = np.asarray(indices)
+            features = self.feature_store.gather(self.positions[indices])
+            labels = label_tensor(
+                self.label_ids[indices], len(self.labels), self.one_hot_labels
+            )
+            record["rows"] = len(indices)
+        return torch.from_numpy(features), labels
+
+
+def collate_rows(batch):
+    # batches from `__getitems__` are already collated, lists of single rows
+    # are stacked
+    if isinstance(batch, tuple):
+        return batch
+    return default_collate(batch)
+
+
+def row_loader(
+    feature_store_dir,
+    data_split,
+    batch_plan,
+    shuffle=False,
+    seed=42,
+    num_workers=0,
+    pin_memory=False,
+    one_hot_labels=False,
+):
+    # DataLoader over the rows of `data_split` in the stratified batches of
+    # `batch_plan`, one gather per batch in the main process or a worker
+    return DataLoader(
+        RowDataset(
+            feature_store_dir, data_split, batch_plan, one_hot_labels=one_hot_labels
+        ),
+        batch_sampler=StratifiedBatchSampler(
+            batch_plan, data_split, seed=seed, shuffle=shuffle
+        ),
+        collate_fn=collate_rows,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=num_workers > 0,
+    )
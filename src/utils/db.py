@@ -1,5 +1,6 @@
 import duckdb
 from .features import amount_encoding
+from .profiling import profile_connection
 
 
 def load_db(db_path: str) -> duckdb.DuckDBPyConnection:
@@ -10,4 +11,4 @@ def load_db(db_path: str) -> duckdb.DuckDBPyConnection:
         )
     except duckdb.CatalogException:
         pass
-    return conn
+    return profile_connection(conn)
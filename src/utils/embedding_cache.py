@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+import numpy as np
+
+
+class EmbeddingCache:
+    # on-disk cache of text embeddings, one `.npy` file per
+    # sha256(model name, max_length, text), safe to share between processes
+    # and between the threads of a process
+    def __init__(self, cache_dir: str, model_name: str, max_length: int = 32):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.max_length = max_length
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_lock")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        payload = "\0".join([self.model_name, str(self.max_length), text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def get(self, text: str) -> np.ndarray | None:
+        path = self._path(self.key(text))
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return np.load(path)
+
+    def put(self, text: str, embedding: np.ndarray) -> None:
+        path = self._path(self.key(text))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write then rename, so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(embedding, dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    def encode(self, word_list: list[str], encode_fn) -> tuple[np.ndarray, list[str]]:
+        # returns the embeddings of `word_list` and the texts that had to be
+        # encoded by `encode_fn`, each distinct text is encoded at most once
+        if not word_list:
+            return np.empty((0, 0), dtype=np.float32), []
+
+        cached = {}
+        for text in dict.fromkeys(word_list):
+            embedding = self.get(text)
+            if embedding is not None:
+                cached[text] = embedding
+
+        missing = [text for text in dict.fromkeys(word_list) if text not in cached]
+        if missing:
+            embeddings = np.asarray(encode_fn(missing), dtype=np.float32)
+            for text, embedding in zip(missing, embeddings):
+                self.put(text, embedding)
+                cached[text] = embedding
+
+        return np.stack([cached[text] for text in word_list]), missing
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
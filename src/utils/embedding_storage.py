@@ -0,0 +1,358 @@
+import duckdb
+import threading
+import numpy as np
+import pyarrow as pa
+
+from .embeddings import embeddings_to_arrow
+from .features import EMBEDDING_TABLES, UNKNOWN_ID, VOCAB_TABLES
+
+
+EMBEDDING_DTYPES = ["float32", "float16", "int8"]
+STORAGE_TABLE = "embedding_storage"
+
+# numpy dtype of the stored codes, float16 is kept as its raw SMALLINT bits
+CODE_DTYPES = {"float16": np.int16, "int8": np.int8}
+
+
+def fit_pca(matrix: np.ndarray, dim: int) -> tuple[np.ndarray, np.ndarray]:
+    mean = matrix.mean(axis=0)
+    _, _, vt = np.linalg.svd(matrix - mean, full_matrices=False)
+    return mean.astype(np.float32), vt[:dim].astype(np.float32)
+
+
+def quantize(matrix: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    if dtype == "float16":
+        return matrix.astype(np.float16).view(np.int16), None
+
+    # symmetric int8 with one scale per row
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray | None, dtype: str) -> np.ndarray:
+    if dtype == "float16":
+        return codes.view(np.float16).astype(np.float32)
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def storage_row_bytes(dtype: str, dim: int) -> int:
+    if dtype == "float32":
+        return 4 * dim
+    if dtype == "float16":
+        return 2 * dim
+    return dim + 4  # int8 codes and a FLOAT scale
+
+
+class EmbeddingStorage:
+    # how the embeddings of a table are stored, float32 tables keep one column
+    # per dimension while compressed tables hold a fixed-size array of codes
+    def __init__(self, dtype="float32", pca_mean=None, pca_components=None):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{dtype}'")
+
+        self.dtype = dtype
+        self.pca_mean = pca_mean
+        self.pca_components = pca_components
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.dtype != "float32" or self.pca_components is not None
+
+    @property
+    def pca_dim(self) -> int | None:
+        return None if self.pca_components is None else len(self.pca_components)
+
+    def matches(self, dtype: str, pca_dim: int | None = None) -> bool:
+        return self.dtype == dtype and self.pca_dim == (pca_dim or None)
+
+    def project(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.pca_components is None:
+            return embeddings
+        return (embeddings - self.pca_mean) @ self.pca_components.T
+
+    def round_trip(self, embeddings: np.ndarray) -> np.ndarray:
+        # the vectors a model sees for `embeddings` once stored and decoded
+        embeddings = self.project(embeddings)
+        if self.dtype == "float32":
+            return embeddings
+        return dequantize(*quantize(embeddings, self.dtype), self.dtype)
+
+    @classmethod
+    def load(cls, conn: duckdb.DuckDBPyConnection, table_name: str):
+        exists = conn.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = $name",
+            {"name": STORAGE_TABLE},
+        ).fetchone()[0]
+        if not exists:
+            return cls()
+
+        row = conn.execute(
+            f"""
+            SELECT dtype, pca_mean, pca_components
+            FROM {STORAGE_TABLE}
+            WHERE table_name = $table_name
+            """,
+            {"table_name": table_name},
+        ).fetchone()
+        if row is None:
+            return cls()
+
+        dtype, pca_mean, pca_components = row
+        if pca_components is not None:
+            pca_mean = np.array(pca_mean, dtype=np.float32)
+            pca_components = np.array(pca_components, dtype=np.float32)
+        return cls(dtype, pca_mean, pca_components)
+
+    def save(self, conn: duckdb.DuckDBPyConnection, table_name: str) -> None:
+        reset_embedding_storage(conn, table_name)
+        conn.execute(
+            f"INSERT INTO {STORAGE_TABLE} VALUES ($table_name, $dtype, $mean, $components)",
+            {
+                "table_name": table_name,
+                "dtype": self.dtype,
+                "mean": None if self.pca_mean is None else self.pca_mean.tolist(),
+                "components": (
+                    None
+                    if self.pca_components is None
+                    else self.pca_components.tolist()
+                ),
+            },
+        )
+
+    def to_arrow(self, entity: str, ids, embeddings) -> pa.Table:
+        # `embeddings` are raw encoder outputs, projected and quantized here
+        embeddings = self.project(embeddings)
+
+        if not self.is_compressed:
+            return embeddings_to_arrow(entity, ids, embeddings)
+
+        if self.dtype == "float32":
+            codes, scales = embeddings.astype(np.float32), None
+        else:
+            codes, scales = quantize(embeddings, self.dtype)
+
+        columns = {f"{entity}_id": pa.array(np.asarray(ids, dtype=np.int32))}
+        columns[f"{entity}_emb"] = pa.FixedSizeListArray.from_arrays(
+            pa.array(codes.ravel()), codes.shape[1]
+        )
+        if scales is not None:
+            columns[f"{entity}_emb_scale"] = pa.array(scales)
+        return pa.table(columns)
+
+    def decode(self, entity: str, table: pa.Table) -> np.ndarray:
+        num_rows = table.num_rows
+        if not self.is_compressed:
+            columns = [name for name in table.column_names if name != f"{entity}_id"]
+            if not columns:
+                return np.zeros((num_rows, 0), dtype=np.float32)
+            return np.stack(
+                [table.column(name).to_numpy() for name in columns], axis=1
+            ).astype(np.float32)
+
+        values = table.column(f"{entity}_emb").combine_chunks().values.to_numpy()
+        codes = values.reshape(num_rows, -1)
+        if self.dtype == "float32":
+            return codes.astype(np.float32)
+
+        scales = None
+        if self.dtype == "int8":
+            scales = table.column(f"{entity}_emb_scale").to_numpy()
+        return dequantize(codes.astype(CODE_DTYPES[self.dtype]), scales, self.dtype)
+
+
+class EmbeddingLookup:
+    # decoded embedding table held in memory, `rows` maps every text id to its
+    # matrix row and row 0 is the zero vector of the shared unknown id
+    def __init__(
+        self, entity: str, ids, matrix: np.ndarray, vocab_size: int, storage=None, vocab=None
+    ):
+        self.entity = entity
+        self.storage = storage or EmbeddingStorage()
+        self.vocab = vocab
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.rows = np.zeros(vocab_size, dtype=np.int64)
+        self.rows[self.ids] = np.arange(1, len(self.ids) + 1)
+        self.matrix = np.concatenate(
+            [np.zeros((1, matrix.shape[1]), dtype=np.float32), matrix]
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @classmethod
+    def load(
+        cls,
+        conn: duckdb.DuckDBPyConnection,
+        table_name: str,
+        entity: str,
+        with_vocab: bool = False,
+    ):
+        # `with_vocab` also loads the id -> text vocabulary, which is only
+        # needed to encode ids without an embedding
+        storage = EmbeddingStorage.load(conn, table_name)
+        table = conn.execute(f"SELECT * FROM {table_name}").arrow()
+        matrix = storage.decode(entity, table)
+
+        ids, keep = np.unique(table.column(f"{entity}_id").to_numpy(), return_index=True)
+
+        vocab_table = VOCAB_TABLES[entity]
+        vocab_size = conn.execute(
+            f"SELECT COALESCE(MAX({entity}_id), 0) + 1 FROM {vocab_table}"
+        ).fetchone()[0]
+
+        vocab = None
+        if with_vocab:
+            vocab = np.empty(vocab_size, dtype=object)
+            df_vocab = conn.execute(f"SELECT * FROM {vocab_table}").df()
+            vocab[df_vocab[f"{entity}_id"].values] = df_vocab[entity].values
+
+        return cls(entity, ids, matrix[keep], vocab_size, storage, vocab)
+
+    def gather(self, ids) -> tuple[np.ndarray, np.ndarray]:
+        # rows of `ids`, ids without an embedding get the unknown vector and
+        # are flagged in the returned mask
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = self.rows[ids]
+        missing = (rows == 0) & (ids != UNKNOWN_ID)
+        return self.matrix[rows], missing
+
+    def texts(self, ids) -> list[str]:
+        if self.vocab is None:
+            raise ValueError(f"The {self.entity} lookup was loaded without vocabulary")
+        return self.vocab[np.asarray(ids, dtype=np.int64)].tolist()
+
+    def add(self, ids, embeddings: np.ndarray) -> np.ndarray:
+        # add raw encoder outputs, returns them as stored and decoded. Safe
+        # with concurrent `gather`: the rows only point into the new matrix
+        # once it is in place
+        ids = np.asarray(ids, dtype=np.int64)
+        embeddings = self.storage.round_trip(embeddings)
+        with self._lock:
+            matrix = self.matrix
+            if self.dim == 0:
+                matrix = np.zeros((len(matrix), embeddings.shape[1]), np.float32)
+
+            rows = np.arange(len(matrix), len(matrix) + len(ids))
+            self.matrix = np.concatenate([matrix, embeddings])
+            self.ids = np.concatenate([self.ids, ids])
+            self.rows[ids] = rows
+        return embeddings
+
+
+def reset_embedding_storage(conn: duckdb.DuckDBPyConnection, table_name: str) -> None:
+    # forget how `table_name` was stored, e.g. before it is rewritten as float32
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {STORAGE_TABLE} (
+            table_name VARCHAR
+            , dtype VARCHAR
+            , pca_mean FLOAT[]
+            , pca_components FLOAT[][]
+        )
+        """
+    )
+    conn.execute(
+        f"DELETE FROM {STORAGE_TABLE} WHERE table_name = $table_name",
+        {"table_name": table_name},
+    )
+
+
+def write_back_embeddings(
+    conn: duckdb.DuckDBPyConnection,
+    entity: str,
+    storage: EmbeddingStorage,
+    ids,
+    embeddings: np.ndarray,
+) -> None:
+    # append raw encoder outputs to the embedding table of `entity` in its
+    # storage format, so later runs find them there, known ids are skipped
+    table_name = EMBEDDING_TABLES[entity]
+    conn.register("new_embeddings", storage.to_arrow(entity, ids, embeddings))
+    conn.execute(
+        f"""
+        INSERT INTO {table_name}
+        SELECT d.*
+        FROM new_embeddings AS d
+        ANTI JOIN {table_name} AS t USING({entity}_id)
+        """
+    )
+    conn.unregister("new_embeddings")
+
+
+def load_embedding_lookups(
+    conn: duckdb.DuckDBPyConnection, with_vocab: bool = False
+) -> dict:
+    return {
+        entity: EmbeddingLookup.load(conn, table_name, entity, with_vocab=with_vocab)
+        for entity, table_name in EMBEDDING_TABLES.items()
+    }
+
+
+def compress_embedding_table(
+    conn: duckdb.DuckDBPyConnection,
+    table_name: str,
+    entity: str,
+    dtype: str,
+    pca_dim: int | None = None,
+    pca_fit_ids=None,
+) -> None:
+    # rewrite a float32 table as `dtype` codes, optionally projected on the
+    # first `pca_dim` principal components of the `pca_fit_ids` vectors
+    lookup = EmbeddingLookup.load(conn, table_name, entity)
+    if lookup.storage.is_compressed:
+        raise ValueError(f"Table '{table_name}' is already compressed")
+
+    pca_mean, pca_components = None, None
+    if pca_dim:
+        fit_matrix = lookup.matrix[1:]
+        if pca_fit_ids is not None:
+            rows = lookup.rows[np.asarray(pca_fit_ids, dtype=np.int64)]
+            fit_matrix = lookup.matrix[rows[rows > 0]]
+        pca_mean, pca_components = fit_pca(fit_matrix, pca_dim)
+
+    storage = EmbeddingStorage(dtype, pca_mean, pca_components)
+    conn.register(
+        "compressed_embeddings",
+        storage.to_arrow(entity, lookup.ids, lookup.matrix[1:]),
+    )
+    conn.execute(
+        f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM compressed_embeddings"
+    )
+    conn.unregister("compressed_embeddings")
+    storage.save(conn, table_name)
+
+
+def compress_embedding_tables(
+    conn: duckdb.DuckDBPyConnection, dtype: str, pca_dim: int | None = None
+) -> None:
+    # PCA is fitted on the texts of the train transactions only
+    train_ids_queries = {
+        "remark": """
+            SELECT DISTINCT remark_id FROM edges WHERE data_split = 'train'
+        """,
+        "node_name": """
+            SELECT DISTINCT n.node_name_id
+            FROM edges AS e JOIN nodes AS n ON e.sender_node_id = n.id
+            WHERE e.data_split = 'train'
+            UNION
+            SELECT DISTINCT n.node_name_id
+            FROM edges AS e JOIN nodes AS n ON e.benef_node_id = n.id
+            WHERE e.data_split = 'train'
+        """,
+    }
+
+    for entity, table_name in EMBEDDING_TABLES.items():
+        # a table that was not re-encoded since its last compression is kept,
+        # e.g. when only the other table got new texts
+        if EmbeddingStorage.load(conn, table_name).matches(dtype, pca_dim):
+            continue
+
+        train_ids = conn.execute(train_ids_queries[entity]).fetchnumpy()[f"{entity}_id"]
+        compress_embedding_table(
+            conn, table_name, entity, dtype, pca_dim=pca_dim, pca_fit_ids=train_ids
+        )
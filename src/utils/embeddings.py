@@ -0,0 +1,104 @@
+import multiprocessing as mp
+import os
+import numpy as np
+import pyarrow as pa
+import torch
+
+
+# tokenizer and text encoder of an embedding worker process
+_worker_state = {}
+
+
+def tokenize(tokenizer, word_list: list[str], max_length: int = 32) -> list[dict]:
+    # tokenize once without padding, batches are padded to their own longest row
+    encoded = tokenizer(word_list, truncation=True, max_length=max_length)
+    keys = list(encoded.keys())
+    return [{key: encoded[key][i] for key in keys} for i in range(len(word_list))]
+
+
+def token_budget_batches(
+    lengths: np.ndarray, token_budget: int, max_batch_size: int
+) -> list[np.ndarray]:
+    # sort by length to minimise padding, then grow each batch while
+    # `rows * longest row` stays within the token budget
+    order = np.argsort(lengths, kind="stable")
+    batches, start = [], 0
+
+    while start < len(order):
+        end = start + 1
+        while (
+            end < len(order)
+            and end - start < max_batch_size
+            and (end - start + 1) * lengths[order[end]] <= token_budget
+        ):
+            end += 1
+
+        batches.append(order[start:end])
+        start = end
+
+    return batches
+
+
+def encode_tokenized(tokenizer, text_encoder, features: list[dict]) -> np.ndarray:
+    inputs = tokenizer.pad(features, padding=True, return_tensors="pt")
+    with torch.no_grad():
+        outputs = text_encoder(**inputs)
+    return outputs.last_hidden_state[:, 0, :].numpy()
+
+
+def embeddings_to_arrow(entity: str, ids, embeddings: np.ndarray) -> pa.Table:
+    columns = {f"{entity}_id": pa.array(np.asarray(ids, dtype=np.int32))}
+    for i in range(embeddings.shape[1]):
+        columns[f"{entity}_emb_{i}"] = pa.array(
+            np.ascontiguousarray(embeddings[:, i], dtype=np.float32)
+        )
+    return pa.table(columns)
+
+
+def _init_worker(model_name: str, num_threads: int) -> None:
+    from transformers import BertTokenizer, AutoModel
+
+    torch.set_num_threads(num_threads)
+    _worker_state["tokenizer"] = BertTokenizer.from_pretrained(model_name)
+    _worker_state["text_encoder"] = AutoModel.from_pretrained(model_name)
+
+
+def _encode_shard(features: list[dict]) -> np.ndarray:
+    return encode_tokenized(
+        _worker_state["tokenizer"], _worker_state["text_encoder"], features
+    )
+
+
+def create_embedding_pool(
+    model_name: str, workers: int, threads_per_worker: int | None = None
+):
+    # every worker loads `model_name` once and gets an equal share of the cores
+    num_threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    ctx = mp.get_context("spawn")
+    return ctx.Pool(workers, initializer=_init_worker, initargs=(model_name, num_threads))
+
+
+def iter_embeddings(
+    shards: list[list[dict]],
+    tokenizer,
+    text_encoder,
+    model_name: str | None = None,
+    workers: int = 1,
+    pool=None,
+):
+    # yields the embeddings of every shard in input order, with `workers` > 1
+    # (or an existing `pool`) the shards are encoded by worker processes
+    if pool is not None:
+        yield from pool.imap(_encode_shard, shards)
+        return
+
+    if workers <= 1:
+        for features in shards:
+            yield encode_tokenized(tokenizer, text_encoder, features)
+        return
+
+    if model_name is None:
+        raise ValueError("model_name is required to encode with several workers")
+
+    with create_embedding_pool(model_name, workers) as pool:
+        yield from pool.imap(_encode_shard, shards)
@@ -0,0 +1,147 @@
+import numpy as np
+import torch
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.random_projection import SparseRandomProjection
+
+from .embeddings import iter_embeddings, token_budget_batches, tokenize
+
+
+# a text encoder turns strings into fixed size float32 vectors:
+# `name` identifies its outputs (embedding caches, stage fingerprints),
+# `encode(word_list)` encodes one batch and `iter_batches(word_list)` yields
+# `(indices, embeddings)` over a whole vocabulary in the encoder's best order
+TEXT_ENCODERS = ["indobert", "hashing_tf"]
+INDOBERT_MODEL = "indobenchmark/indobert-lite-base-p2"
+
+
+class BertEncoder:
+    # CLS vector of a BERT model, the vocabulary is bucketed by token length,
+    # batched by token budget and optionally encoded by worker processes
+    def __init__(
+        self,
+        tokenizer,
+        text_encoder,
+        model_name: str | None = None,
+        max_length: int = 32,
+        token_budget: int = 8192,
+        batch_size: int = 1000,
+        workers: int = 1,
+    ):
+        self.tokenizer = tokenizer
+        self.text_encoder = text_encoder
+        self.model_name = model_name or getattr(
+            text_encoder, "name_or_path", type(text_encoder).__name__
+        )
+        self.max_length = max_length
+        self.token_budget = token_budget
+        self.batch_size = batch_size
+        self.workers = workers
+
+    @property
+    def name(self) -> str:
+        return self.model_name
+
+    def encode(self, word_list: list[str]) -> np.ndarray:
+        with torch.no_grad():
+            embeddings = self.text_encoder(
+                **self.tokenizer(
+                    word_list,
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt",
+                )
+            ).last_hidden_state[:, 0, :]
+        return embeddings.numpy()
+
+    def iter_batches(self, word_list: list[str]):
+        features = tokenize(self.tokenizer, word_list, max_length=self.max_length)
+        lengths = np.array([len(f["input_ids"]) for f in features])
+        batches = token_budget_batches(lengths, self.token_budget, self.batch_size)
+
+        shards = [[features[i] for i in indices] for indices in batches]
+        embeddings = iter_embeddings(
+            shards,
+            self.tokenizer,
+            self.text_encoder,
+            model_name=self.model_name,
+            workers=self.workers,
+        )
+        yield from zip(batches, embeddings)
+
+
+class HashingEncoder:
+    # character n-gram counts hashed into `n_features` buckets, weighted by
+    # sublinear TF and projected to `dim` with a seeded sparse random
+    # projection. There is deliberately no IDF: it would have to be fitted on
+    # the train texts and shared by the embedding tables, online encoding,
+    # incremental refreshes and the embedding cache. Being stateless, offline
+    # and online vectors always agree
+    def __init__(
+        self,
+        dim: int = 256,
+        ngram_range: tuple[int, int] = (2, 4),
+        n_features: int = 2**18,
+        batch_size: int = 10000,
+        seed: int = 42,
+    ):
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+        self.n_features = n_features
+        self.batch_size = batch_size
+        self.seed = seed
+
+        self.vectorizer = HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=self.ngram_range,
+            n_features=n_features,
+            lowercase=True,
+            alternate_sign=False,
+            norm=None,
+        )
+        # the projection matrix only depends on the shapes and the seed
+        self.projection = SparseRandomProjection(
+            n_components=dim, dense_output=True, random_state=seed
+        )
+        self.projection.fit(np.zeros((1, n_features), dtype=np.float32))
+
+    @property
+    def name(self) -> str:
+        low, high = self.ngram_range
+        return f"hashing-tf-char{low}{high}-{self.n_features}-{self.dim}-{self.seed}"
+
+    def encode(self, word_list: list[str]) -> np.ndarray:
+        counts = self.vectorizer.transform(word_list).astype(np.float32)
+        counts.data = 1 + np.log(counts.data)
+        embeddings = self.projection.transform(normalize(counts))
+        return normalize(embeddings).astype(np.float32)
+
+    def iter_batches(self, word_list: list[str]):
+        for start in range(0, len(word_list), self.batch_size):
+            indices = np.arange(start, min(start + self.batch_size, len(word_list)))
+            yield indices, self.encode(word_list[start : indices[-1] + 1])
+
+
+def load_text_encoder(
+    name: str = "indobert",
+    max_length: int = 32,
+    token_budget: int = 8192,
+    workers: int = 1,
+    dim: int = 256,
+):
+    if name == "indobert":
+        from transformers import BertTokenizer, AutoModel
+
+        return BertEncoder(
+            BertTokenizer.from_pretrained(INDOBERT_MODEL),
+            AutoModel.from_pretrained(INDOBERT_MODEL),
+            model_name=INDOBERT_MODEL,
+            max_length=max_length,
+            token_budget=token_budget,
+            workers=workers,
+        )
+    if name == "hashing_tf":
+        return HashingEncoder(dim=dim)
+
+    raise ValueError(f"Unknown text encoder '{name}', expected one of {TEXT_ENCODERS}")
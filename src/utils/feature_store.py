@@ -0,0 +1,200 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+
+
+FEATURES_FILE = "features.npy"
+TRX_ID_FILE = "trx_id.npy"
+LABEL_ID_FILE = "label_id.npy"
+METADATA_FILE = "metadata.json"
+BATCH_LAYOUT_PATTERN = "batches_*.npy"
+
+
+def get_split_dir(store_dir: str, data_split: str) -> str:
+    return os.path.join(store_dir, data_split)
+
+
+def write_split(store_dir: str, data_split: str, num_rows: int, chunks) -> None:
+    # `chunks` yields (trx_ids, columns, features) blocks ordered by trx_id, they
+    # are written straight into a memory-mapped file so the split never has to
+    # fit in memory
+    split_dir = get_split_dir(store_dir, data_split)
+    os.makedirs(split_dir, exist_ok=True)
+
+    features_path = os.path.join(split_dir, FEATURES_FILE)
+    tmp_path = features_path + ".tmp"
+    trx_ids = np.empty(num_rows, dtype=np.int64)
+    features, columns, offset = None, None, 0
+
+    for chunk_trx_ids, chunk_columns, chunk_features in chunks:
+        if features is None:
+            columns = list(chunk_columns)
+            features = np.lib.format.open_memmap(
+                tmp_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(num_rows, len(columns)),
+            )
+
+        if list(chunk_columns) != columns:
+            raise ValueError(f"Inconsistent feature columns in split '{data_split}'")
+
+        end = offset + len(chunk_trx_ids)
+        trx_ids[offset:end] = chunk_trx_ids
+        features[offset:end] = chunk_features
+        offset = end
+
+    if offset != num_rows:
+        raise ValueError(
+            f"Expected {num_rows} rows in split '{data_split}', got {offset}"
+        )
+
+    if features is None:
+        features = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(0, 0)
+        )
+        columns = []
+
+    features.flush()
+    del features
+    os.replace(tmp_path, features_path)
+
+    # batch layouts and label codes belong to the previous feature matrix
+    for path in glob.glob(os.path.join(split_dir, BATCH_LAYOUT_PATTERN)):
+        os.remove(path)
+    if os.path.exists(os.path.join(split_dir, LABEL_ID_FILE)):
+        os.remove(os.path.join(split_dir, LABEL_ID_FILE))
+
+    np.save(os.path.join(split_dir, TRX_ID_FILE), trx_ids)
+
+    with open(os.path.join(split_dir, METADATA_FILE), "w") as f:
+        json.dump(
+            {
+                "data_split": data_split,
+                "num_rows": num_rows,
+                "dtype": "float32",
+                "columns": columns,
+            },
+            f,
+            indent=2,
+        )
+
+
+def write_labels(
+    store_dir: str, data_split: str, label_ids: np.ndarray, labels: list[str]
+) -> None:
+    # int8 code of every row of the split, -1 for purposes outside `labels`
+    split_dir = get_split_dir(store_dir, data_split)
+    with open(os.path.join(split_dir, METADATA_FILE)) as f:
+        metadata = json.load(f)
+
+    if len(label_ids) != metadata["num_rows"]:
+        raise ValueError(
+            f"Expected {metadata['num_rows']} labels in split '{data_split}',"
+            f" got {len(label_ids)}"
+        )
+
+    np.save(os.path.join(split_dir, LABEL_ID_FILE), label_ids.astype(np.int8))
+
+    metadata["labels"] = list(labels)
+    with open(os.path.join(split_dir, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+class FeatureStore:
+    def __init__(self, store_dir: str, data_split: str, mmap_mode: str | None = "c"):
+        self.split_dir = get_split_dir(store_dir, data_split)
+        self.data_split = data_split
+        # copy-on-write maps share the page cache between datasets and workers
+        # while still giving writable arrays for `torch.from_numpy`
+        self.mmap_mode = mmap_mode
+        self.layout_path = None
+
+        with open(os.path.join(self.split_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+
+        self.columns = self.metadata["columns"]
+        # labels of the int8 codes in `label_ids`, None for stores without them
+        self.labels = self.metadata.get("labels")
+        self._open()
+
+    def _open(self):
+        self.trx_ids = np.load(os.path.join(self.split_dir, TRX_ID_FILE))
+        self.label_ids = None
+        if self.labels is not None:
+            self.label_ids = np.load(os.path.join(self.split_dir, LABEL_ID_FILE))
+        self.features = np.load(
+            os.path.join(self.split_dir, FEATURES_FILE), mmap_mode=self.mmap_mode
+        )
+        self.batch_features = None
+        # another process may have replaced the layout since, batches are
+        # then gathered
+        if self.layout_path and os.path.exists(self.layout_path):
+            self.batch_features = np.load(self.layout_path, mmap_mode=self.mmap_mode)
+
+    def __getstate__(self):
+        # re-map the files in worker processes instead of pickling their content
+        state = self.__dict__.copy()
+        for key in ["trx_ids", "label_ids", "features", "batch_features"]:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.trx_ids)
+
+    def positions(self, trx_ids) -> np.ndarray:
+        trx_ids = np.asarray(trx_ids)
+        positions = np.searchsorted(self.trx_ids, trx_ids)
+        positions = np.minimum(positions, max(len(self.trx_ids) - 1, 0))
+
+        if len(trx_ids) and (
+            not len(self.trx_ids) or not np.array_equal(self.trx_ids[positions], trx_ids)
+        ):
+            raise KeyError(
+                f"Some trx_id are missing from the '{self.data_split}' feature store"
+            )
+
+        return positions
+
+    def gather(self, positions) -> np.ndarray:
+        return self.features[positions]
+
+    def use_batch_layout(self, positions, chunk_size: int = 65536) -> None:
+        # copy of the matrix with rows in batch order, so every batch is a
+        # contiguous range served as a view, keyed by the row order it holds.
+        # It costs one more copy of the split's features on disk, a split
+        # keeps only the layout used last and maps already open stay valid
+        digest = hashlib.sha1(np.ascontiguousarray(positions).tobytes()).hexdigest()
+        path = os.path.join(self.split_dir, f"batches_{digest[:16]}.npy")
+
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            layout = np.lib.format.open_memmap(
+                tmp_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(len(positions), self.features.shape[1]),
+            )
+            for start in range(0, len(positions), chunk_size):
+                end = start + chunk_size
+                layout[start:end] = self.features[positions[start:end]]
+
+            layout.flush()
+            del layout
+            os.replace(tmp_path, path)
+
+        for old_path in glob.glob(os.path.join(self.split_dir, BATCH_LAYOUT_PATTERN)):
+            if old_path != path:
+                os.remove(old_path)
+
+        self.layout_path = path
+        self.batch_features = np.load(path, mmap_mode=self.mmap_mode)
+
+    def batch_slice(self, start: int, end: int) -> np.ndarray:
+        return self.batch_features[start:end]
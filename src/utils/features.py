@@ -1,6 +1,267 @@
+import numpy as np
+import pandas as pd
+
+
+LABELS = [
+    "bills",
+    "business",
+    "debt_and_installment",
+    "donation",
+    "family_and_friends",
+    "invest",
+    "others",
+    "shopping",
+]
+OTHERS_LABEL = "others"
+
+
+# columns returned by `features_query` that are identifiers, not model inputs
+KEY_COLUMNS = ["trx_id", "remark_id", "sender_node_name_id", "benef_node_name_id"]
+
+# (text id column, entity) of the embeddings appended after the query features
+EMBEDDING_COLUMNS = [
+    ("remark_id", "remark"),
+    ("sender_node_name_id", "node_name"),
+    ("benef_node_name_id", "node_name"),
+]
+
+EMBEDDING_TABLES = {
+    "remark": "remark_embeddings",
+    "node_name": "node_name_embeddings",
+}
+
+# dense `<entity>_id` of every distinct text, ids start at 1 by descending
+# frequency and 0 is the shared id of unknown (or NULL) texts
+VOCAB_TABLES = {
+    "remark": "remark_vocab",
+    "node_name": "node_name_vocab",
+}
+UNKNOWN_ID = 0
+
+
+# (min_val, max_val) of every encoded amount band
+AMOUNT_BANDS = [
+    (10_000, 100_000),
+    (100_000, 300_000),
+    (300_000, 1_000_000),
+    (1_000_000, 5_000_000),
+    (5_000_000, 10_000_000),
+    (10_000_000, 50_000_000),
+    (10_000, 50_000_000),
+]
+
+
 def amount_encoding(x: int, min_val: int, max_val: int) -> float:
     if x < min_val:
         return 0
     if x > max_val:
         return 1
     return (x - min_val) / (max_val - min_val)
+
+
+def format_amount(x: int) -> str:
+    for suffix, unit in [("M", 1_000_000), ("K", 1_000)]:
+        if x >= unit and x % unit == 0:
+            return f"{x // unit}{suffix}"
+    return str(x)
+
+
+def amount_encoding_sql(column: str, min_val: int, max_val: int) -> str:
+    # native equivalent of the `amount_encoding` UDF, the value is cast to INT
+    # like the UDF argument and divided in DOUBLE before the FLOAT cast, which
+    # gives bit-identical results
+    value = f"{column}::INT"
+    return (
+        f"(CASE WHEN {value} < {min_val} THEN 0"
+        f" WHEN {value} > {max_val} THEN 1"
+        f" ELSE ({value}::DOUBLE - {min_val}) / {max_val - min_val} END)::FLOAT"
+    )
+
+
+def amount_features_sql(column: str = "e.amount", bands=None) -> str:
+    return "\n".join(
+        f", {amount_encoding_sql(column, min_val, max_val)}"
+        f" AS encoded_amount_{format_amount(min_val)}_{format_amount(max_val)}"
+        for min_val, max_val in bands or AMOUNT_BANDS
+    )
+
+
+def purpose_count_columns(labels=None) -> list[str]:
+    # `count_trx_<alias>` columns with the alias of a label being its first word,
+    # the others label comes last
+    labels = [label for label in labels or LABELS if label != OTHERS_LABEL]
+    aliases = [label.split("_")[0] for label in labels] + [OTHERS_LABEL]
+    return ["count_trx", "count_trx_not_others"] + [
+        f"count_trx_{alias}" for alias in aliases
+    ]
+
+
+def purpose_ratio_columns(labels=None) -> list[str]:
+    labels = [label for label in labels or LABELS if label != OTHERS_LABEL]
+    aliases = [label.split("_")[0] for label in labels]
+    return (
+        [f"ratio_trx_{alias}" for alias in aliases + [OTHERS_LABEL, "not_others"]]
+        + [f"ratio_trx_{alias}_non_others" for alias in aliases]
+    )
+
+
+def neighbor_feature_columns(hops: int, labels=None) -> list[str]:
+    # k-hop neighbor averages of the node purpose ratios, hop by hop
+    return [
+        f"neighbor_{hop}hop_{col}"
+        for hop in range(1, hops + 1)
+        for col in purpose_ratio_columns(labels)
+    ]
+
+
+def purpose_features_sql(labels=None, source: str = "ft", delta: str = "d") -> dict:
+    # SELECT-list fragments of the purpose counts and ratios of any grouping key,
+    # to be formatted into a query template:
+    #   `purpose_counts` aggregates of a GROUP BY over edges, trx_id is unique so
+    #       conditional counts replace COUNT(DISTINCT) and need a single scan
+    #   `purpose_ratios` ratios over the output of `purpose_counts`
+    #   `purpose_features` counts and ratios of `source`, zero when missing
+    #   `purpose_merged_counts` counts of `source` plus the counts of `delta`
+    labels = labels or LABELS
+    conditions = {"count_trx_not_others": f"purpose != '{OTHERS_LABEL}'"}
+    for label in labels:
+        conditions[f"count_trx_{label.split('_')[0]}"] = f"purpose = '{label}'"
+
+    counts = [", COUNT(*)::INT4 AS count_trx"] + [
+        f", COUNT_IF({conditions[col]})::INT4 AS {col}"
+        for col in purpose_count_columns(labels)[1:]
+    ]
+
+    ratios = []
+    for col in purpose_ratio_columns(labels):
+        numerator = col.removesuffix("_non_others").replace("ratio_", "count_")
+        denominator = "count_trx_not_others" if col.endswith("_non_others") else "count_trx"
+        ratios.append(
+            f", IF({denominator} > 0, {numerator} / {denominator}, 0) AS {col}"
+        )
+
+    features = [
+        f", IFNULL({source}.{col}, 0)::INT4 AS {col}"
+        for col in purpose_count_columns(labels)
+    ] + [
+        f", IFNULL({source}.{col}, 0) AS {col}"
+        for col in purpose_ratio_columns(labels)
+    ]
+
+    merged_counts = [
+        f", (IFNULL({source}.{col}, 0) + {delta}.{col})::INT4 AS {col}"
+        for col in purpose_count_columns(labels)
+    ]
+
+    # the templates put every placeholder on its own line, indented by 8 spaces
+    separator = "\n" + " " * 8
+    return {
+        "purpose_counts": separator.join(counts),
+        "purpose_ratios": separator.join(ratios),
+        "purpose_features": separator.join(features),
+        "purpose_merged_counts": separator.join(merged_counts),
+    }
+
+
+def features_query(rows_query: str, neighbor_hops: int = 0) -> str:
+    # `rows_query` must return a single `trx_id` column. The output is ordered by
+    # trx_id with a fixed column order, shared by the dataset and the feature store,
+    # embeddings are gathered in memory by `assemble_features`. With `neighbor_hops`
+    # the sender and benef neighbor features of hops 1..neighbor_hops are appended
+    neighbor_columns = "".join(
+        f"\n            , IFNULL(nbr_{role[0]}.{col}, 0) AS {role}_{col}"
+        for role in ["sender", "benef"]
+        for col in neighbor_feature_columns(neighbor_hops)
+    )
+    neighbor_joins = (
+        """
+        LEFT JOIN
+            node_neighbor_features AS nbr_s
+            ON e.sender_node_id = nbr_s.node_id
+        LEFT JOIN
+            node_neighbor_features AS nbr_b
+            ON e.benef_node_id = nbr_b.node_id"""
+        if neighbor_hops
+        else ""
+    )
+
+    return f"""
+    WITH batch AS (
+        {rows_query}
+    )
+
+    , features AS (
+        SELECT
+            b.trx_id
+            , e.remark_id
+            , node_s.node_name_id AS sender_node_name_id
+            , node_b.node_name_id AS benef_node_name_id
+            , df.* EXCLUDE (calendar_date)
+            {amount_features_sql("e.amount")}{neighbor_columns}
+        FROM
+            batch AS b
+        LEFT JOIN
+            edges AS e USING(trx_id)
+        LEFT JOIN
+            days_features AS df
+            ON e.trx_date = df.calendar_date
+        LEFT JOIN
+            nodes AS node_s
+            ON e.sender_node_id = node_s.id
+        LEFT JOIN
+            nodes AS node_b
+            ON e.benef_node_id = node_b.id{neighbor_joins}
+    )
+
+    SELECT
+        *
+    FROM
+        features
+    ORDER BY
+        trx_id
+    """
+
+
+def feature_columns(df_features: pd.DataFrame, lookups: dict) -> list[str]:
+    columns = [col for col in df_features.columns if col not in KEY_COLUMNS]
+    for col, entity in EMBEDDING_COLUMNS:
+        prefix = col.removesuffix("_id")
+        columns += [f"{prefix}_emb_{i}" for i in range(lookups[entity].dim)]
+    return columns
+
+
+def assemble_features(
+    df_features: pd.DataFrame, lookups: dict, get_embeddings=None, chunk_size: int = 1000
+) -> np.ndarray:
+    # query features followed by the remark, sender and benef name embeddings
+    # gathered by text id, ids missing from the lookups are encoded once by
+    # `get_embeddings(texts, entity, ids)` and added to the lookup, or fall back
+    # to the unknown embedding without it
+    blocks = [df_features.drop(columns=KEY_COLUMNS).values.astype(np.float32)]
+
+    for col, entity in EMBEDDING_COLUMNS:
+        lookup = lookups[entity]
+        ids = df_features[col].values
+        embeddings, missing = lookup.gather(ids)
+
+        if missing.any() and get_embeddings is not None:
+            new_ids = np.unique(ids[missing])
+            words = lookup.texts(new_ids)
+            encoded = np.concatenate(
+                [
+                    np.asarray(
+                        get_embeddings(
+                            words[i : i + chunk_size],
+                            entity,
+                            new_ids[i : i + chunk_size],
+                        )
+                    )
+                    for i in range(0, len(words), chunk_size)
+                ]
+            )
+            lookup.add(new_ids, encoded)
+            embeddings, missing = lookup.gather(ids)
+
+        blocks.append(embeddings)
+
+    return np.concatenate(blocks, axis=1)
@@ -0,0 +1,117 @@
+import duckdb
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .features import neighbor_feature_columns, purpose_ratio_columns
+
+
+def node_components(node_ids: np.ndarray, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    # component of every node of `node_ids`, identified by its smallest node id,
+    # linear in the number of edges through a sparse adjacency matrix
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    num_nodes = int(max(node_ids.max(initial=-1), src.max(initial=-1), dst.max(initial=-1))) + 1
+    if num_nodes == 0:
+        return np.empty(0, dtype=np.int64)
+
+    adjacency = coo_matrix(
+        (np.ones(len(src), dtype=np.int8), (src.astype(np.int32), dst.astype(np.int32))),
+        shape=(num_nodes, num_nodes),
+    ).tocsr()
+    # weak components of the directed matrix avoid building its symmetric copy
+    _, labels = connected_components(adjacency, directed=True, connection="weak")
+
+    min_ids = np.full(labels.max() + 1, num_nodes, dtype=np.int64)
+    np.minimum.at(min_ids, labels[node_ids], node_ids)
+    return min_ids[labels[node_ids]]
+
+
+def create_connected_components_table(
+    conn: duckdb.DuckDBPyConnection, dest_table: str = "connected_components"
+) -> None:
+    node_ids = conn.execute("SELECT id FROM nodes").fetchnumpy()["id"]
+    edges = conn.execute("SELECT src_node_id, dst_node_id FROM neighborhood").fetchnumpy()
+
+    df_components = pd.DataFrame(
+        {
+            "node_id": node_ids.astype(np.int32),
+            "connected_component_id": node_components(
+                node_ids, edges["src_node_id"], edges["dst_node_id"]
+            ).astype(np.int32),
+        }
+    )
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TEMPORARY TABLE {dest_table} AS
+
+        SELECT * FROM df_components ORDER BY connected_component_id, node_id
+        """
+    )
+
+
+def propagate_features(
+    num_nodes: int,
+    src: np.ndarray,
+    dst: np.ndarray,
+    weights: np.ndarray,
+    features: np.ndarray,
+    hops: int,
+) -> list[np.ndarray]:
+    # weighted neighbor averages `A^k X` for k = 1..hops, one sparse-dense product
+    # per hop so the cost stays linear in the number of edges
+    adjacency = coo_matrix(
+        (weights.astype(np.float64), (src.astype(np.int32), dst.astype(np.int32))),
+        shape=(num_nodes, num_nodes),
+    ).tocsr()
+
+    propagated, hidden = [], features
+    for _ in range(hops):
+        hidden = adjacency @ hidden
+        propagated.append(hidden)
+    return propagated
+
+
+def create_neighbor_features_table(
+    conn: duckdb.DuckDBPyConnection,
+    hops: int = 3,
+    dest_table: str = "node_neighbor_features",
+    weight_column: str = "proportion_train",
+) -> None:
+    # `weight_column` of neighborhood is normalized per source node, so every hop
+    # is a weighted average of the purpose ratios of the previous one
+    ratio_columns = purpose_ratio_columns()
+    df_nodes = conn.execute(
+        f"SELECT node_id, {', '.join(ratio_columns)} FROM node_trx_features"
+    ).df()
+    edges = conn.execute(
+        f"SELECT src_node_id, dst_node_id, {weight_column} FROM neighborhood"
+    ).fetchnumpy()
+
+    node_ids = conn.execute("SELECT id FROM nodes ORDER BY id").fetchnumpy()["id"]
+    num_nodes = int(max(node_ids.max(initial=-1), df_nodes["node_id"].max())) + 1
+
+    features = np.zeros((num_nodes, len(ratio_columns)), dtype=np.float64)
+    features[df_nodes["node_id"].values] = df_nodes[ratio_columns].values
+
+    propagated = propagate_features(
+        num_nodes,
+        edges["src_node_id"],
+        edges["dst_node_id"],
+        np.nan_to_num(edges[weight_column]),
+        features,
+        hops,
+    )
+
+    df_neighbors = pd.DataFrame(
+        np.concatenate([hidden[node_ids] for hidden in propagated], axis=1),
+        columns=neighbor_feature_columns(hops),
+    )
+    df_neighbors.insert(0, "node_id", node_ids.astype(np.int32))
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE {dest_table} AS
+
+        SELECT * FROM df_neighbors ORDER BY node_id
+        """
+    )
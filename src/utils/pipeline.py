@@ -0,0 +1,299 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+import duckdb
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from .profiling import get_profiler, record_table_rows
+
+
+STATE_TABLE = "pipeline_state"
+
+
+class Stage:
+    # a step of a pipeline, `func(conn, **params, **resources)` reads the
+    # `inputs` tables and the `files`, and (re)writes the `outputs` tables.
+    # `params` are part of the fingerprint while `resources` (models,
+    # tokenizers, worker counts) are not, `config` holds settings the outputs
+    # depend on that `func` does not take as arguments. The code of `func`,
+    # of the functions and project modules it references and of the classes of
+    # `resources` is fingerprinted, `code` adds modules or callables it reaches
+    # in other ways
+    def __init__(
+        self,
+        name: str,
+        func,
+        inputs: list[str] | None = None,
+        outputs: list[str] | None = None,
+        params: dict | None = None,
+        files: list[str] | None = None,
+        resources: dict | None = None,
+        config: dict | None = None,
+        code: list | None = None,
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.params = params or {}
+        self.files = files or []
+        self.resources = resources or {}
+        self.config = config or {}
+        self.code = code or []
+
+    def depends_on(self, other) -> bool:
+        # `other` is declared before, so it runs first if either stage
+        # writes a table the other one reads or writes
+        return bool(
+            set(other.outputs) & (set(self.inputs) | set(self.outputs))
+            or set(other.inputs) & set(self.outputs)
+        )
+
+    def run(self, conn: duckdb.DuckDBPyConnection) -> None:
+        self.func(conn, **self.params, **self.resources)
+
+
+def file_fingerprint(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def referenced_names(code) -> set[str]:
+    # global names used by a code object and the functions nested in it
+    names, codes = set(), [code]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+    return names
+
+
+def code_sources(objects, root: str) -> dict[str, str]:
+    # source of the given functions, of the functions of their module they
+    # call and of every module under `root` they reference, with the modules
+    # those import in turn. Keyed by path relative to `root`
+    def in_project(module) -> bool:
+        path = getattr(module, "__file__", None)
+        return bool(path) and os.path.abspath(path).startswith(root + os.sep)
+
+    def project_module(obj, name=None):
+        module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+        if in_project(module):
+            return module
+        # constants imported from a project module, e.g. `VOCAB_TABLES`
+        if name is not None and not callable(obj):
+            for module in list(sys.modules.values()):
+                if in_project(module) and vars(module).get(name) is obj:
+                    return module
+        return None
+
+    def key(module, qualname=None):
+        path = os.path.relpath(os.path.abspath(module.__file__), root)
+        return f"{path}:{qualname}" if qualname else path
+
+    sources, funcs, modules = {}, [], []
+    for obj in objects:
+        if inspect.isfunction(obj):
+            funcs.append(obj)
+        elif (module := project_module(obj)) is not None:
+            modules.append(module)
+
+    while funcs:
+        func = inspect.unwrap(funcs.pop())
+        module = inspect.getmodule(func)
+        name = key(module, func.__qualname__)
+        if name in sources:
+            continue
+
+        sources[name] = inspect.getsource(func)
+        for global_name in referenced_names(func.__code__):
+            # attribute names are listed too, they are not globals
+            if global_name not in func.__globals__:
+                continue
+            obj = func.__globals__[global_name]
+            if inspect.isfunction(obj) and inspect.getmodule(obj) is module:
+                funcs.append(obj)
+            elif (dependency := project_module(obj, global_name)) not in [None, module]:
+                modules.append(dependency)
+
+    while modules:
+        module = modules.pop()
+        name = key(module)
+        if name in sources:
+            continue
+
+        with open(module.__file__) as f:
+            sources[name] = f.read()
+        for obj in vars(module).values():
+            if (dependency := project_module(obj)) not in [None, module]:
+                modules.append(dependency)
+
+    return sources
+
+
+def table_fingerprint(conn: duckdb.DuckDBPyConnection, table: str) -> str | None:
+    # order-independent hash of the schema and rows, None if the table is missing
+    columns = conn.execute(
+        """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_name = $table
+        ORDER BY ordinal_position
+        """,
+        {"table": table},
+    ).fetchall()
+    if not columns:
+        return None
+
+    count, row_hash = conn.execute(
+        f"SELECT COUNT(*), SUM(HASH({table})::HUGEINT) FROM {table}"
+    ).fetchone()
+    return f"{columns}:{count}:{row_hash}"
+
+
+class Pipeline:
+    # runs its stages in dependency order, on up to `workers` cursors at once.
+    # A stage is skipped when its code and the project code it references, params,
+    # config, files and input tables have the fingerprint recorded after its
+    # last run and all its outputs exist,
+    # `force` reruns every stage or only the named ones
+    def __init__(
+        self,
+        conn: duckdb.DuckDBPyConnection,
+        workers: int = 1,
+        force: bool | list[str] = False,
+    ):
+        self.conn = conn
+        self.workers = workers
+        self.force = force
+        self.stages: list[Stage] = []
+        self._table_fingerprints: dict[str, str | None] = {}
+        self._code_fingerprints: dict[str, dict[str, str]] = {}
+
+    def add(self, stage: Stage) -> Stage:
+        if any(s.name == stage.name for s in self.stages):
+            raise ValueError(f"Stage '{stage.name}' is already in the pipeline")
+
+        self.stages.append(stage)
+        return stage
+
+    def _table_fingerprint(self, table: str) -> str | None:
+        if table not in self._table_fingerprints:
+            self._table_fingerprints[table] = table_fingerprint(self.conn, table)
+        return self._table_fingerprints[table]
+
+    def _code_fingerprint(self, stage: Stage) -> dict[str, str]:
+        # modules are looked up under the directory of the stage's script
+        if stage.name not in self._code_fingerprints:
+            func = inspect.unwrap(stage.func)
+            root = os.path.dirname(os.path.abspath(inspect.getfile(func)))
+            objects = [func, *stage.code]
+            objects += [type(resource) for resource in stage.resources.values()]
+            sources = code_sources(objects, root)
+            self._code_fingerprints[stage.name] = {
+                name: hashlib.sha256(source.encode()).hexdigest()
+                for name, source in sources.items()
+            }
+        return self._code_fingerprints[stage.name]
+
+    def fingerprint(self, stage: Stage) -> str:
+        payload = {
+            "code": self._code_fingerprint(stage),
+            "params": stage.params,
+            "config": stage.config,
+            "files": {path: file_fingerprint(path) for path in stage.files},
+            "inputs": {table: self._table_fingerprint(table) for table in stage.inputs},
+        }
+        payload = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _load_state(self) -> dict[str, str]:
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                stage VARCHAR PRIMARY KEY
+                , fingerprint VARCHAR
+                , updated_at TIMESTAMP
+            )
+            """
+        )
+        return dict(
+            self.conn.execute(f"SELECT stage, fingerprint FROM {STATE_TABLE}").fetchall()
+        )
+
+    def _save_state(self, stage: Stage) -> None:
+        # inputs are fingerprinted again after the run, stages may rewrite them
+        for table in stage.inputs + stage.outputs:
+            self._table_fingerprints.pop(table, None)
+
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES ($stage, $fingerprint, $now)",
+            {
+                "stage": stage.name,
+                "fingerprint": self.fingerprint(stage),
+                "now": datetime.now(),
+            },
+        )
+
+    def _is_forced(self, stage: Stage) -> bool:
+        if isinstance(self.force, bool):
+            return self.force
+        return stage.name in self.force
+
+    def _is_unchanged(self, stage: Stage, state: dict[str, str]) -> bool:
+        if self._is_forced(stage):
+            return False
+        if any(self._table_fingerprint(table) is None for table in stage.outputs):
+            return False
+        return state.get(stage.name) == self.fingerprint(stage)
+
+    def run(self) -> None:
+        state = self._load_state()
+        upstream = {
+            stage.name: [s.name for s in self.stages[:i] if stage.depends_on(s)]
+            for i, stage in enumerate(self.stages)
+        }
+        done, running = set(), {}
+
+        def run_on_cursor(stage: Stage) -> None:
+            cursor = self.conn.cursor()
+            try:
+                with get_profiler().span(f"stage:{stage.name}") as record:
+                    stage.run(cursor)
+                    record_table_rows(cursor, stage.outputs)
+            finally:
+                cursor.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(done) < len(self.stages):
+                for stage in self.stages:
+                    if (
+                        stage.name in done
+                        or stage.name in running.values()
+                        or len(running) >= self.workers
+                        or not all(name in done for name in upstream[stage.name])
+                    ):
+                        continue
+
+                    if self._is_unchanged(stage, state):
+                        print(f"[INFO] {datetime.now()} - skipped - {stage.name}")
+                        done.add(stage.name)
+                        continue
+
+                    running[executor.submit(run_on_cursor, stage)] = stage.name
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    future.result()
+                    self._save_state(next(s for s in self.stages if s.name == name))
+                    done.add(name)
@@ -0,0 +1,94 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from .profiling import get_profiler
+
+
+class PrefetchLoader:
+    # iterates the batches of `dataset` while `workers` threads fetch up to
+    # `depth` batches ahead, so feature queries and online encoding overlap
+    # the training step. Batches come out in a fixed order whatever thread
+    # fetched them, shuffled from `seed` and the number of passes so far
+    def __init__(self, dataset, shuffle=False, seed=42, depth=4, workers=2):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.depth = max(1, depth)
+        self.workers = max(1, min(workers, self.depth))
+        self.passes = 0
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def set_epoch(self, epoch: int) -> None:
+        if hasattr(self.dataset, "set_epoch"):
+            self.dataset.set_epoch(epoch)
+
+    def reset_stats(self) -> None:
+        self._stats = {
+            "batches": 0,
+            "fetch_s": 0.0,
+            "consumer_wait_s": 0.0,
+            "producer_wait_s": 0.0,
+            "queue_depth": 0,
+        }
+
+    def stats(self) -> dict:
+        # `consumer_wait_s` is the time the training loop waited for a batch,
+        # `producer_wait_s` the time fetched batches waited for the training
+        # loop and `mean_queue_depth` the fetched batches ready at each take
+        stats = dict(self._stats)
+        batches = stats.pop("batches")
+        queue_depth = stats.pop("queue_depth")
+        return {
+            "batches": batches,
+            **stats,
+            "mean_queue_depth": queue_depth / batches if batches else 0.0,
+        }
+
+    def order(self) -> np.ndarray:
+        if not self.shuffle:
+            return np.arange(len(self.dataset))
+        rng = np.random.default_rng([self.seed, self.passes])
+        return rng.permutation(len(self.dataset))
+
+    def _fetch(self, idx):
+        start = perf_counter()
+        item = self.dataset[idx]
+        return item, perf_counter() - start, perf_counter()
+
+    def __iter__(self):
+        order = self.order()
+        self.passes += 1
+        profiler = get_profiler()
+
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="prefetch")
+        pending = deque()
+        position = 0
+        try:
+            while position < len(order) or pending:
+                while position < len(order) and len(pending) < self.depth:
+                    pending.append(executor.submit(self._fetch, order[position]))
+                    position += 1
+
+                future = pending.popleft()
+                queue_depth = future.done() + sum(f.done() for f in pending)
+                with profiler.span("prefetch.wait", queue_depth=queue_depth):
+                    waited = perf_counter()
+                    item, fetch_s, fetched_at = future.result()
+                    taken = perf_counter()
+
+                self._stats["batches"] += 1
+                self._stats["fetch_s"] += fetch_s
+                self._stats["consumer_wait_s"] += taken - waited
+                self._stats["producer_wait_s"] += max(0.0, waited - fetched_at)
+                self._stats["queue_depth"] += queue_depth
+                yield item
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
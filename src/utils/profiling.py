@@ -0,0 +1,252 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb() -> float | None:
+    # peak resident memory of the process so far
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+class Profiler:
+    # writes one JSON line per span to `path` with its wall and CPU time and
+    # the memory of the process, spans are nested per thread and do nothing
+    # while no path is configured
+    def __init__(self, path: str | None = None, query_profiles: bool = False):
+        self.path = path
+        self.query_profiles = query_profiles
+        self._file = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "w", buffering=1)
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def _stack(self) -> list[dict]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self) -> dict | None:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def write(self, record: dict) -> None:
+        if not self.enabled:
+            return
+
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    @contextmanager
+    def span(self, name: str, **fields):
+        # fields set on the yielded record, e.g. `rows`, are written with it
+        if not self.enabled:
+            yield {}
+            return
+
+        stack = self._stack()
+        record = {"name": name, **fields}
+        parent = stack[-1]["name"] if stack else None
+
+        started_at = datetime.now()
+        wall, cpu = time.perf_counter(), time.process_time()
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            # CPU time counts every thread of the process, DuckDB and torch
+            # included, so cpu_s / wall_s above 1 means parallel work
+            record.update(
+                parent=parent,
+                pid=os.getpid(),
+                started_at=started_at,
+                wall_s=time.perf_counter() - wall,
+                cpu_s=time.process_time() - cpu,
+                rss_mb=rss_mb(),
+                peak_rss_mb=peak_rss_mb(),
+            )
+            self.write(record)
+
+    def iterate(self, iterable, name: str):
+        # yields the items of `iterable`, each `next` is timed as a span
+        iterator = iter(iterable)
+        while True:
+            with self.span(name) as record:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    record["exhausted"] = True
+                    return
+            yield item
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_profiler = Profiler()
+
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+
+def configure_profiling(path: str | None, query_profiles: bool = False) -> Profiler:
+    global _profiler
+    _profiler.close()
+    _profiler = Profiler(path, query_profiles=query_profiles)
+    return _profiler
+
+
+def record_rows(rows: dict) -> None:
+    # row counts of the outputs of the innermost open span, e.g. per table
+    record = get_profiler().current()
+    if record is not None:
+        record.setdefault("rows", {}).update(rows)
+
+
+def record_table_rows(conn, tables: list[str]) -> None:
+    # row counts of the tables written by the innermost open span, only
+    # counted while profiling
+    if get_profiler().current() is None:
+        return
+    record_rows(
+        {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in tables
+        }
+    )
+
+
+class ProfiledConnection:
+    # DuckDB connection that attaches the JSON profile (EXPLAIN ANALYZE tree)
+    # of every completed query to the innermost open span. A query completes
+    # once its result is consumed, so the profile of a SELECT fetched after
+    # `execute` is attached on the next call
+    def __init__(self, conn, profiler: Profiler | None = None):
+        self._conn = conn
+        self._profiler = profiler
+        fd, self._profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+        os.close(fd)
+        os.remove(self._profile_path)
+        self._profile_mtime = None
+
+        conn.execute(f"PRAGMA profiling_output = '{self._profile_path}'")
+        conn.execute("PRAGMA enable_profiling = 'json'")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def _collect(self) -> None:
+        try:
+            mtime = os.stat(self._profile_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._profile_mtime:
+            return
+        self._profile_mtime = mtime
+
+        profiler = self._profiler or get_profiler()
+        record = profiler.current()
+        if record is None:
+            return
+
+        with open(self._profile_path) as f:
+            try:
+                profile = json.load(f)
+            except json.JSONDecodeError:
+                return
+        record.setdefault("query_profiles", []).append(profile)
+
+    def execute(self, query, parameters=None):
+        self._collect()
+        self._conn.execute(query, parameters)
+        self._collect()
+        return self
+
+    def executemany(self, query, parameters=None):
+        self._collect()
+        self._conn.executemany(query, parameters)
+        self._collect()
+        return self
+
+    def cursor(self):
+        return ProfiledConnection(self._conn.cursor(), self._profiler)
+
+    def close(self) -> None:
+        self._collect()
+        self._conn.close()
+        if os.path.exists(self._profile_path):
+            os.remove(self._profile_path)
+
+
+def profile_connection(conn):
+    # wrap `conn` when DuckDB query profiles are requested
+    if get_profiler().enabled and get_profiler().query_profiles:
+        return ProfiledConnection(conn)
+    return conn
+
+
+def total_rows(rows) -> float:
+    # `rows` of a span, a count or the counts of its tables
+    if isinstance(rows, dict):
+        return sum(rows.values())
+    return rows if isinstance(rows, (int, float)) else float("nan")
+
+
+def summarize_profile(path: str) -> pd.DataFrame:
+    # per span name: calls, total and mean wall time, CPU utilisation, output
+    # rows and their throughput, and the share of the wall time of its
+    # parent spans
+    df = pd.read_json(path, lines=True)
+    df["rows"] = df["rows"].map(total_rows) if "rows" in df else float("nan")
+    summary = df.groupby(["parent", "name"], dropna=False).agg(
+        calls=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        rows=("rows", lambda rows: rows.sum(min_count=1)),
+    )
+    summary["mean_wall_ms"] = 1000 * summary["wall_s"] / summary["calls"]
+    summary["cpu_util"] = summary["cpu_s"] / summary["wall_s"]
+    summary["rows_per_s"] = summary["rows"] / summary["wall_s"]
+
+    parent_wall = df.groupby("name")["wall_s"].sum()
+    parents = summary.index.get_level_values("parent")
+    summary["share_of_parent"] = summary["wall_s"].values / parent_wall.reindex(
+        parents
+    ).values
+    return summary.sort_values("wall_s", ascending=False)
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import pandas as pd
+
+from .features import LABELS
+
+
+# remark words per purpose, so remarks carry some signal about the label
+PURPOSE_WORDS = {
+    "bills": ["tagihan", "listrik", "pln", "pdam", "internet", "pulsa", "bpjs"],
+    "business": ["modal", "usaha", "supplier", "stok", "invoice", "toko", "omzet"],
+    "debt_and_installment": ["cicilan", "angsuran", "hutang", "kredit", "pinjaman"],
+    "donation": ["sedekah", "infaq", "zakat", "donasi", "amal", "sumbangan"],
+    "family_and_friends": ["kirim", "ortu", "adik", "kakak", "mama", "papa", "teman"],
+    "invest": ["investasi", "saham", "reksadana", "emas", "deposito", "tabungan"],
+    "others": ["transfer", "trf", "tf", "dana", "uang", "bayar"],
+    "shopping": ["belanja", "beli", "baju", "sepatu", "olshop", "pesanan", "barang"],
+}
+FILLER_WORDS = ["bulan", "ini", "untuk", "buat", "via", "mbanking", "ok", "ya", "lunas"]
+NAME_WORDS = [
+    "budi", "siti", "agus", "dewi", "andi", "rina", "joko", "sri", "eko", "wati",
+    "putra", "sari", "santoso", "lestari", "wijaya", "utama", "jaya", "abadi",
+]
+COMPANY_PREFIXES = ["pt", "cv", "toko", "ud"]
+
+
+def generate_nodes(
+    num_senders: int, num_benefs: int, rng: np.random.Generator
+) -> pd.DataFrame:
+    num_nodes = num_senders + num_benefs
+    first = rng.choice(NAME_WORDS, num_nodes)
+    last = rng.choice(NAME_WORDS, num_nodes)
+    names = np.char.add(np.char.add(first, " "), last)
+
+    # part of the beneficiaries are merchants with a company prefix
+    is_company = np.arange(num_nodes) >= num_senders
+    is_company &= rng.random(num_nodes) < 0.3
+    prefixes = rng.choice(COMPANY_PREFIXES, num_nodes)
+    names = np.where(
+        is_company, np.char.add(np.char.add(prefixes, " "), names), names
+    )
+
+    return pd.DataFrame(
+        {
+            "id": (np.arange(1, num_nodes + 1) * 7 + 1000).astype(np.int64),
+            "node_name": names,
+            "is_sender": np.arange(num_nodes) < num_senders,
+        }
+    )
+
+
+def generate_edges(
+    nodes: pd.DataFrame,
+    num_senders: int,
+    num_edges: int,
+    num_pairs: int,
+    date_start: str,
+    date_end: str,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    node_ids = nodes["id"].to_numpy()
+    sender_ids, benef_ids = node_ids[:num_senders], node_ids[num_senders:]
+
+    # pairs have a dominant purpose and a heavy-tailed activity, so the top
+    # ranked pairs of the small tiers are dense like in the real data
+    pair_sender = rng.choice(sender_ids, num_pairs)
+    pair_benef = rng.choice(benef_ids, num_pairs)
+    pair_purpose = rng.choice(len(LABELS), num_pairs)
+    weights = 1 / np.arange(1, num_pairs + 1) ** 0.8
+    pair = rng.choice(num_pairs, num_edges, p=weights / weights.sum())
+
+    # 80% of the edges follow the purpose of their pair
+    purpose = np.where(
+        rng.random(num_edges) < 0.8,
+        pair_purpose[pair],
+        rng.choice(len(LABELS), num_edges),
+    )
+
+    # remark: a word of the purpose (or a generic one), a filler and a number
+    words = np.empty(num_edges, dtype=object)
+    for i, label in enumerate(LABELS):
+        mask = purpose == i
+        words[mask] = rng.choice(PURPOSE_WORDS[label], mask.sum())
+    generic = rng.random(num_edges) < 0.3
+    words[generic] = rng.choice(PURPOSE_WORDS["others"], generic.sum())
+    remarks = np.char.add(
+        np.char.add(words.astype(str), " "), rng.choice(FILLER_WORDS, num_edges)
+    )
+    numbered = rng.random(num_edges) < 0.5
+    remarks = np.where(
+        numbered,
+        np.char.add(
+            np.char.add(remarks, " "), rng.integers(1, 500, num_edges).astype(str)
+        ),
+        remarks,
+    )
+
+    dates = pd.date_range(date_start, date_end, freq="D").date
+    amounts = np.exp(rng.normal(12, 1.5, num_edges)).clip(1_000, 2_000_000_000)
+
+    edges = pd.DataFrame(
+        {
+            "trx_id": np.arange(1, num_edges + 1, dtype=np.int64),
+            "sender_node_id": pair_sender[pair],
+            "benef_node_id": pair_benef[pair],
+            "trx_date": rng.choice(dates, num_edges),
+            "amount": amounts.astype(np.int64),
+            "remark": remarks,
+            "purpose": np.asarray(LABELS)[purpose],
+        }
+    )
+    return edges.sort_values(["trx_date", "trx_id"], ignore_index=True)
+
+
+def generate_dataset(
+    out_dir: str,
+    num_edges: int = 1_000_000,
+    num_senders: int = 20_000,
+    num_benefs: int = 30_000,
+    num_pairs: int | None = None,
+    date_start: str = "2024-05-01",
+    date_end: str = "2024-07-31",
+    seed: int = 42,
+) -> tuple[str, str]:
+    # writes `nodes.parquet` and `edges.parquet` with the schema of the raw
+    # data to `out_dir`, the same arguments give the same files
+    rng = np.random.default_rng(seed)
+    num_pairs = num_pairs or max(1, num_edges // 10)
+
+    nodes = generate_nodes(num_senders, num_benefs, rng)
+    edges = generate_edges(
+        nodes, num_senders, num_edges, num_pairs, date_start, date_end, rng
+    )
+
+    os.makedirs(out_dir, exist_ok=True)
+    nodes_path = os.path.join(out_dir, "nodes.parquet")
+    edges_path = os.path.join(out_dir, "edges.parquet")
+    nodes.to_parquet(nodes_path, index=False)
+    edges.to_parquet(edges_path, index=False)
+    return nodes_path, edges_path
@@ -1,12 +1,20 @@
+import functools
 from datetime import datetime
 
+from .profiling import get_profiler
+
 
 def timeit(func):
+    # prints the runtime and, when profiling is configured, records a span
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         name = func.__name__
         start = datetime.now()
 
-        result = func(*args, **kwargs)
+        with get_profiler().span(name) as record:
+            result = func(*args, **kwargs)
+            if isinstance(result, int) and not isinstance(result, bool):
+                record["rows"] = result
 
         runtime = (datetime.now() - start).total_seconds()
         print(f'[INFO] {datetime.now()} - {runtime:.2f}s - {name}')
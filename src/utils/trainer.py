@@ -3,6 +3,15 @@ from tqdm import tqdm
 from sklearn.metrics import f1_score
 from time import time
 
+from .profiling import get_profiler
+
+
+def class_indices(labels):
+    # datasets yield class indices, or one-hot rows when asked to
+    if labels.ndim > 1:
+        return torch.argmax(labels, dim=1)
+    return labels
+
 
 class Trainer:
     def __init__(self, model, optimizer, criterion, device):
@@ -12,19 +21,26 @@ class Trainer:
         self.device = device
 
     def preprocess(self, inputs, labels):
-        inputs = torch.reshape(inputs, (-1, inputs.shape[-1]))
-        labels = torch.reshape(labels, (-1, self.model.num_classes))
+        # loaders yield (batch, features) tensors, subclasses can transform them
         return inputs, labels
 
     def train_step(self, inputs, labels):
-        inputs, labels = inputs.to(self.device), labels.to(self.device)
-        inputs, labels = self.preprocess(inputs, labels)
+        profiler = get_profiler()
+        with profiler.span("trainer.train_step", rows=inputs.shape[-2]):
+            with profiler.span("trainer.to_device"):
+                inputs, labels = inputs.to(self.device), labels.to(self.device)
+                inputs, labels = self.preprocess(inputs, labels)
 
-        self.optimizer.zero_grad()
-        outputs = self.model(inputs)
-        loss = self.criterion(outputs, labels)
-        loss.backward()
-        self.optimizer.step()
+            with profiler.span("trainer.forward"):
+                self.optimizer.zero_grad()
+                outputs = self.model(inputs)
+                loss = self.criterion(outputs, labels)
+
+            with profiler.span("trainer.backward"):
+                loss.backward()
+
+            with profiler.span("trainer.optimizer_step"):
+                self.optimizer.step()
 
         preds = torch.argmax(outputs, dim=1)
         # f1 = f1_score(torch.argmax(labels, dim=1), preds, average="macro")
@@ -67,6 +83,14 @@ class Trainer:
         for epoch in range(epochs):
             time_st = time()
 
+            # loaders that plan their batches per epoch get a new composition,
+            # a DataLoader through its batch sampler
+            epoch_target = train_loader
+            if not hasattr(epoch_target, "set_epoch"):
+                epoch_target = getattr(train_loader, "batch_sampler", None)
+            if hasattr(epoch_target, "set_epoch"):
+                epoch_target.set_epoch(epoch)
+
             text_prefix = f"[Train] [Epoch {epoch + 1}/{epochs}] "
             _ = self.train(
                 train_loader, verbose=(verbose == 2), text_prefix=text_prefix
@@ -120,12 +144,15 @@ class Trainer:
         if verbose:
             pbar = tqdm(train_loader)
 
+        # time spent waiting on the loader, against the time in train_step,
+        # tells whether an epoch is bound by data loading or by compute
+        batches = get_profiler().iterate(pbar, "trainer.load_batch")
+
         running_loss = 0.0
-        for i, data in enumerate(pbar):
+        for i, data in enumerate(batches):
             inputs, labels = data
             metrics, preds, output = self.train_step(inputs, labels)
 
-            labels = torch.reshape(labels, (-1, self.model.num_classes))
             running_loss += metrics["loss"]
 
             if verbose:
@@ -145,12 +172,12 @@ class Trainer:
             pbar = tqdm(test_loader)
 
         with torch.no_grad():
-            for data in pbar:
+            for data in get_profiler().iterate(pbar, "trainer.load_eval_batch"):
                 inputs, labels = data
-                metrics, preds, output = self.test_step(inputs, labels)
+                with get_profiler().span("trainer.test_step", rows=inputs.shape[-2]):
+                    metrics, preds, output = self.test_step(inputs, labels)
 
-                labels = torch.reshape(labels, (-1, self.model.num_classes))
-                targets.append(torch.argmax(labels, dim=1))
+                targets.append(class_indices(labels))
                 predictions.append(preds)
                 outputs.append(output)
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import `utils` relative to `src`, as when run from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,82 @@
+import os
+
+import duckdb
+import pytest
+
+from utils.db import load_db
+from utils.encoders import load_text_encoder
+from utils.embedding_storage import EmbeddingStorage
+from utils.features import EMBEDDING_TABLES
+from utils.synthetic import generate_dataset
+from features_dates import generate_date_features
+from features_remark_and_nodes import build_feature_pipeline
+from sample_and_split import build_database, rank_sender_benef_pairs
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+DATE_PARAMS = {
+    "date_train_start": "2024-05-01",
+    "date_train_end": "2024-05-31",
+    "date_valid_start": "2024-06-01",
+    "date_valid_end": "2024-06-30",
+    "date_test_start": "2024-07-01",
+    "date_test_end": "2024-07-31",
+}
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    # the stages read `./queries` and `./datasets/raw` from the working directory
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.abspath(os.path.join(ROOT, "queries")), "queries")
+    os.makedirs("datasets/raw")
+
+    day_features = generate_date_features("2024-05-01", "2024-07-31")
+    day_features.index.name = "calendar_date"
+    day_features = day_features.reset_index()
+    day_features["calendar_date"] = day_features["calendar_date"].dt.date
+    duckdb.sql(
+        "COPY(SELECT * FROM day_features) "
+        "TO './datasets/raw/day_features.parquet' (FORMAT PARQUET)"
+    )
+
+    nodes_path, edges_path = generate_dataset(
+        "raw", num_edges=2000, num_senders=100, num_benefs=150, num_pairs=300
+    )
+    pairs_path = rank_sender_benef_pairs(
+        nodes_path, edges_path, DATE_PARAMS, "raw/sender_benef_pairs"
+    )
+    db_path = "processed/database.duckdb"
+    build_database(db_path, nodes_path, edges_path, DATE_PARAMS, pairs_path, None)
+
+    conn = load_db(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("dtype, pca_dim", [("int8", None), ("float16", 8)])
+def test_rerun_one_compressed_embedding_table(conn, dtype, pca_dim):
+    text_encoder = load_text_encoder("hashing_tf", dim=16)
+
+    def run(force):
+        build_feature_pipeline(
+            conn,
+            text_encoder,
+            embedding_dtype=dtype,
+            embedding_pca_dim=pca_dim,
+            neighbor_hops=1,
+            force=force,
+        ).run()
+
+    run(False)
+    node_names = conn.execute("SELECT * FROM node_name_embeddings").arrow()
+
+    # only the remark table is re-encoded, the node name table is kept as is
+    run(["remark_embeddings"])
+
+    for table_name in EMBEDDING_TABLES.values():
+        storage = EmbeddingStorage.load(conn, table_name)
+        assert storage.matches(dtype, pca_dim)
+    assert conn.execute("SELECT * FROM node_name_embeddings").arrow().equals(
+        node_names
+    )